@@ -8,7 +8,7 @@ from utils.utils import configure_genai_api, get_local_repo_path, clone_remote_r
 import sv_ttk
 import subprocess
 import git
-import google.generativeai as genai
+from app.utils.metrics import pipeline_stage
 from utils.help_popup import HelpPopup
 import threading
 
@@ -72,7 +72,8 @@ class CommitAnalyzerTab(tk.Frame):
             self.repo_path = clone_remote_repo(repo_input)
 
         configure_genai_api(api_key)
-        self.model = genai.GenerativeModel(model_name)
+        # Routed per request with the actual diff (see commit_message.generate_CM)
+        self.model = model_name
 
         for widget in self.content_frame.winfo_children():
             widget.destroy()
@@ -426,7 +427,9 @@ class History_CM(tk.Frame):
 
                 original_CM = commit.message.strip()
                 commit_hash = commit.hexsha
-                refined_CM = improve_CM(code_diff, original_CM, self.model)
+                # Bulk refinement runs at background priority so single requests from the GUI go first.
+                with pipeline_stage("commit_history"):
+                    refined_CM = improve_CM(code_diff, original_CM, self.model)
                 self.refined_messages.update({commit_hash: refined_CM})
 
                 def update_progress():
@@ -663,7 +666,7 @@ class History_CM(tk.Frame):
             improved_text_area.delete("1.0", "end")
             code_diff = "\n".join([patch.diff.decode("utf-8") for patch in commit.parents[0].diff(commit, create_patch=True)])
             original_CM = commit.message.strip()
-            commit_message = improve_CM(code_diff, original_CM, self.model)
+            commit_message = improve_CM(code_diff, original_CM, self.model, task="commit_message")
             improved_text_area.insert(tk.END, commit_message)
 
         def save_refined_message():
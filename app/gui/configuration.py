@@ -3,7 +3,7 @@ from tkinter import ttk, messagebox, filedialog
 import webbrowser
 import subprocess
 import threading
-import time
+import shutil
 import os
 import queue
 import google.generativeai as genai
@@ -11,27 +11,17 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 import app.utils.utils as utils
+import app.utils.warmup as warmup
 
 def open_url(url):
     webbrowser.open(url, new=2)
 
 def is_ollama_installed():
-    try:
-        result = subprocess.run(['ollama', '--version'], capture_output=True, text=True)
-        return result.returncode == 0
-    except FileNotFoundError:
-        return False
-
-def get_ollama_models():
-    try:
-        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip().split('\n')
-        else:
-            return []
-    except Exception as e:
-        print(f"Error fetching Ollama models: {e}")
-        return []
+    return bool(warmup.ollama_models()) or shutil.which('ollama') is not None
+
+def get_ollama_models(refresh=False):
+    # Asks the running server over HTTP instead of spawning `ollama list`; the result is cached by the warm-up.
+    return warmup.ollama_models(refresh=refresh)
 
 def install_ollama_model(model, progress_var, progress_label, callback):
     def run_install():
@@ -103,6 +93,39 @@ class ConfigTab(tk.Frame):
         )
         self.save_repo_button.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
 
+        self.start_warmup()
+
+    def start_warmup(self):
+        """
+        Prefills the last repository and the GEMINI_API_KEY environment key, then validates, connects
+        and indexes in the background so the first real request does not wait for them.
+        """
+        last_repo = warmup.last_repo()
+        if last_repo and not self.repo_path_entry.get():
+            self.repo_path_entry.insert(0, last_repo["path"])
+        api_key = os.environ.get("GEMINI_API_KEY", "").strip()
+        if api_key and not self.api_key_entry.get():
+            self.api_key_entry.insert(0, api_key)
+            self.data_queue.put(("status", "Checking...", "blue"))
+        warmup.start_warmup(
+            api_key or None, last_repo,
+            on_event=lambda name, ok, detail: self.on_warmup_event(name, ok, detail, api_key),
+        )
+
+    def on_warmup_event(self, name, ok, detail, api_key):
+        # Called from a warm-up thread; the widgets are only touched from process_queue.
+        if name == "api":
+            if ok:
+                self.api_key_validated = True
+                self.api_gemini_key = api_key
+                self.data_queue.put(("status", "✔️", "green"))
+                self.data_queue.put(("shared_var", self.api_gemini_key))
+            else:
+                self.data_queue.put(("status", "✖️", "red"))
+        elif name == "repo" and ok:
+            self.data_queue.put(("repo_status", "✔️ (previous session)", "green"))
+            self.data_queue.put(("repo_type_var", detail))
+
     def browse_local_repo(self):
         repo_path = filedialog.askdirectory()
         if repo_path:
@@ -119,20 +142,15 @@ class ConfigTab(tk.Frame):
             self.data_queue.put(("repo_status", "Checking...", "blue"))
             self.data_queue.put(("repo_button", "disabled"))
             try:
-                time.sleep(1)  # Simulate validation delay
-                # Determine if the repository is remote or local based on input
-                if "github.com" in repo_input:
-                    new_type = "remote"
-                else:
-                    new_type = "local"
-                valid = True  # In a complete implementation, add actual checks here.
-                if valid:
-                    self.data_queue.put(("repo_status", "✔️", "green"))
-                    self.data_queue.put(("repo_path_var", repo_input))
-                    self.data_queue.put(("repo_type_var", new_type))
-                else:
-                    self.data_queue.put(("repo_status", "✖️", "red"))
-                    self.data_queue.put(("error", "Invalid repository path/URL."))
+                # Local paths must exist; remote URLs are probed with git ls-remote
+                new_type = utils.check_repository(repo_input)
+                self.data_queue.put(("repo_status", "✔️", "green"))
+                self.data_queue.put(("repo_path_var", repo_input))
+                self.data_queue.put(("repo_type_var", new_type))
+                warmup.remember_repo(repo_input, new_type)
+                if new_type == "local":
+                    # Index now so the tabs find the snapshot already uploaded
+                    warmup.index_repo(repo_input, upload=self.api_key_validated)
             except Exception as e:
                 self.data_queue.put(("repo_status", "✖️", "red"))
                 self.data_queue.put(("error", f"An error occurred: {e}"))
@@ -235,8 +253,11 @@ class ConfigTab(tk.Frame):
             self.data_queue.put(("status", "Checking...", "blue"))
             self.data_queue.put(("button", "disabled"))
             
-            test_prompt = "Test"
-            valid, error_message = utils.validate_gemini_api_key(api_gemini_key, test_prompt)
+            try:
+                warmup.prepare_api(api_gemini_key)
+                valid, error_message = True, ""
+            except Exception as e:
+                valid, error_message = False, str(e)
 
             if valid:
                 self.data_queue.put(("status", "✔️", "green"))
@@ -13,11 +13,15 @@ from app.utils.utils import (
     upload_file_to_gemini,
     configure_genai_api,
 )
+from app.utils.context_cache import get_context_cache
+from app.utils.llm_api import generate_content
+from app.utils.hedging import hedged_call
+from app.utils.metrics import pipeline_stage
+from app.utils.model_router import route
 
 import google.generativeai as genai
 
 # You can change this if you have a different model for chat.
-MODEL_NAME = "gemini-2.0-flash" # Default model if 'auto' is selected
 
 class GeminiChatTab(ttk.Frame):
     def __init__(self, parent, shared_vars):
@@ -162,9 +166,9 @@ class GeminiChatTab(ttk.Frame):
              return
 
         # Determine the actual model name string to use
-        model_name_to_use = MODEL_NAME # Default
-        if selected_model_config != "auto" and selected_model_config:
-            model_name_to_use = selected_model_config
+        # "auto" is resolved by the model router (model_routing.tasks.chat in llm_settings.yaml)
+        chat_route = route("chat", selected_model=selected_model_config)
+        model_name_to_use = chat_route.model_name
         # -------------------------------------------------
 
         # Append user message in red with a blank line after it
@@ -179,12 +183,12 @@ class GeminiChatTab(ttk.Frame):
         # Pass the determined model name string and api_key to the background thread
         threading.Thread(
             target=self.generate_gemini_response,
-            args=(prompt, model_name_to_use, api_key), # Pass model_name_to_use and api_key
+            args=(prompt, model_name_to_use, api_key, chat_route.generation_config), # Pass model_name_to_use and api_key
             daemon=True
         ).start()
 
     # Modified to accept model_name and api_key as arguments
-    def generate_gemini_response(self, prompt, model_name_to_use, api_key):
+    def generate_gemini_response(self, prompt, model_name_to_use, api_key, generation_config=None):
         try:
             if not self.uploaded_file:
                 self._append_text("Error: Repository context not initialized. Please click 'Initialize Repository Context' first.\n")
@@ -195,15 +199,29 @@ class GeminiChatTab(ttk.Frame):
             try:
                 # It's often better to configure the API key just before use within the thread
                 # if the library isn't explicitly documented as globally thread-safe.
-                genai.configure(api_key=api_key)
+                configure_genai_api(api_key)
             except Exception as config_err:
                 self._append_text(f"Error re-configuring Gemini API in thread: {config_err}\n")
                 return
             # --------------------------------------------------------------------
 
-            # Use the model name passed as an argument
-            model = genai.GenerativeModel(model_name_to_use)
-            response = model.generate_content([self.uploaded_file, "\n\n", prompt])
+            # Use the model name passed as an argument; the repository is referenced
+            # through a provider-side cache when the model supports it.
+            def send(model_name, create_cache=True):
+                context = get_context_cache().bind(model_name, self.uploaded_file, create=create_cache)
+                return generate_content(
+                    context.model, context.contents(prompt), counted_contents=context.counted_contents(prompt),
+                    generation_config=generation_config,
+                )
+
+            # A slow answer is hedged with a faster model once the chat latency SLO is exceeded.
+            # The hedge reuses that model's cache if there is one but never creates it (storage is billed).
+            # The "chat" stage also gives the request interactive priority (scheduling in llm_settings.yaml).
+            with pipeline_stage("chat"):
+                response = hedged_call(
+                    "chat", model_name_to_use, lambda: send(model_name_to_use),
+                    lambda hedge_model: send(hedge_model, create_cache=False),
+                )
             answer = response.text.strip()
             # Append Gemini response in dark blue with a blank line after it
             self._append_text(f"Gemini: {answer}\n\n", tag="gemini")
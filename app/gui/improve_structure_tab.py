@@ -16,6 +16,9 @@ from utils.utils import (
     configure_genai_api,
     upload_file_to_gemini
 )
+from app.utils.context_cache import get_context_cache
+from app.utils.llm_api import generate_content
+from app.utils.model_router import route
 
 class ImproveStructureTab(ttk.Frame):
     def __init__(self, parent, shared_vars):
@@ -556,18 +559,18 @@ Please only provide the title of the chosen template and the improved file struc
         try:
             # Check the shared variable for default model selection.
             shared_model = self.shared_vars.get("default_gemini_model").get()
-            if shared_model.lower() == "auto":
-                model_to_use = "gemini-2.0-flash-thinking-exp-01-21"
-            else:
-                model_to_use = shared_model
+            structure_route = route("project_structure", selected_model=shared_model)
+            model_to_use = structure_route.model_name
 
             debug_message = f"DEBUG: Using model -> {model_to_use}"
             print(debug_message)
             self.status_label.config(text=debug_message, foreground="purple")
 
-            model = genai.GenerativeModel(model_to_use)
-            inputs = [uploaded_file, "\n\n", prompt]
-            response = model.generate_content(inputs)
+            context = get_context_cache().bind(model_to_use, uploaded_file)
+            response = generate_content(
+                context.model, context.contents(prompt), counted_contents=context.counted_contents(prompt),
+                generation_config=structure_route.generation_config,
+            )
             improved_structure = response.text.strip()
         except Exception as e:
             self.show_error(e)
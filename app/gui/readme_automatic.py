@@ -8,9 +8,9 @@ from app.utils.utils import configure_genai_api, get_local_repo_path, clone_remo
 from app.readme_automatic_generator import ReadmeAutomaticGenerator
 import utils.llm_api as llm_api
 from utils import toolkit
+from app.utils.model_router import resolve_model
+from app.utils.prompt_registry import get_prompt_registry
 import sv_ttk
-import yaml
-import google.generativeai as genai
 from pathlib import Path
 
 class ReadmeAutomaticTab(tk.Frame):
@@ -59,7 +59,6 @@ class ReadmeAutomaticTab(tk.Frame):
             api_key = self.shared_vars.get("api_gemini_key").get().strip()
             model_name = self.shared_vars.get("default_gemini_model").get()
             configure_genai_api(api_key)
-            self.model = genai.GenerativeModel(model_name)
 
             # repo initialzation
             repo_input = self.shared_vars.get("repo_path_var").get().strip()
@@ -81,15 +80,13 @@ class ReadmeAutomaticTab(tk.Frame):
             with open(self.file, 'r', encoding='utf-8') as f:
                 markdown_content = f.read()
 
-            with open("app/prompts/improvements_prompt.yaml", 'r') as file:
-                prompts_repo = yaml.safe_load(file)
-
-            prompt = prompts_repo["automatic"]
+            prompt = get_prompt_registry().get("improvements_prompt")["automatic"]
 
             input = prompt + "\n\n" + markdown_content
 
             messagebox.showinfo("Info", "Start to improve. Please wait for some seconds.")
-            response = llm_api.gemini_api(input, self.model)
+            model, generation_config = resolve_model("readme", input, model_name)
+            response = llm_api.gemini_api(input, model, generation_config=generation_config)
 
             result = toolkit.export_markdown(response)
             self.message_label.config(text=result, foreground="green")
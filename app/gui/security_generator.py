@@ -3,7 +3,6 @@ from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
 import shutil
 import tempfile
-import google.generativeai as genai
 import logging
 import sys
 import os
@@ -20,6 +19,8 @@ from app.utils.utils import (
     convert_file_to_txt,
     upload_file_to_gemini
 )
+from app.utils.llm_api import generate_content, get_model
+from app.utils.model_router import route
 
 class SecurityGeneratorTab(ttk.Frame):
     def __init__(self, parent, shared_vars):
@@ -27,7 +28,6 @@ class SecurityGeneratorTab(ttk.Frame):
         self.shared_vars = shared_vars
         self.grid(row=0, column=0, sticky='nsew')
 
-        self.model_name = "gemini-2.0-flash"
         self.log_file_path = Path(__file__).parent.parent / "security_generator.log"
 
         # Shared variables for repository path and type are obtained from shared_vars
@@ -212,12 +212,9 @@ class SecurityGeneratorTab(ttk.Frame):
 
     def generate_security_md_process(self, repo_selection_info):
         API_KEY = self.shared_vars.get('api_gemini_key', tk.StringVar()).get()
-        # Check the shared variable for default_gemini_model. Use the hardcoded model if it's set to "auto"
+        # Check the shared variable for default_gemini_model; "auto" is resolved by the model router.
         default_model = self.shared_vars.get('default_gemini_model', tk.StringVar(value="auto")).get()
-        if default_model != "auto":
-            MODEL_NAME = default_model
-        else:
-            MODEL_NAME = self.model_name
+        MODEL_NAME = route("security_md", selected_model=default_model).model_name
 
         # Read contact information directly from the Entry widgets.
         contact_name = self.contact_name_entry.get().strip()
@@ -280,6 +277,8 @@ class SecurityGeneratorTab(ttk.Frame):
             readme_txt_path = temp_dir / "README.txt"
             license_txt_path = temp_dir / "LICENSE.txt"
 
+            configure_genai_api(API_KEY)
+
             convert_file_to_txt(README_PATH, readme_txt_path)
             readme_file = upload_file_to_gemini(readme_txt_path)
 
@@ -300,21 +299,16 @@ class SecurityGeneratorTab(ttk.Frame):
             PROMPT += license_section
             PROMPT += "As a final output, write the complete `SECURITY.md` file with the above content."
 
-            configure_genai_api(API_KEY)
-            readme_file = upload_file_to_gemini(readme_txt_path)
-            if license_file:
-                license_file = upload_file_to_gemini(license_txt_path)
-
             return self.generate_security_md(readme_file, license_file, PROMPT, MODEL_NAME)
 
     def generate_security_md(self, readme_file, license_file, prompt, model_name):
-        model = genai.GenerativeModel(model_name)
+        model = get_model(model_name)
         # If license_file is None, omit it from inputs
         if license_file:
             inputs = [readme_file, "\n\n", license_file, "\n\n", prompt]
         else:
             inputs = [readme_file, "\n\n", prompt]
-        response = model.generate_content(inputs)
+        response = generate_content(model, inputs)
         return response.text.strip()
 
     def save_security_md(self, content, repo_type):
@@ -9,6 +9,10 @@ from pathlib import Path
 import os
 import git
 import google.generativeai as genai
+from app.utils.llm_api import get_model
+from app.utils.llm_settings import get_setting
+from app.utils.model_router import is_auto
+from app.utils.scan_journal import ScanJournal, journal_path, read_journal
 
 # Import functions and constants from your scanner module.
 # Make sure your scanner module (security_scanner_gemini_all_code_withsecondpass.py)
@@ -18,7 +22,9 @@ try:
     import app.security_scanner_gemini_all_code_withsecondpass as scanner
     from app.security_scanner_gemini_all_code_withsecondpass import (
         extract_code_files,
-        generate_security_report,
+        scan_code_files,
+        load_previous_report,
+        report_file_paths,
         get_relative_path,
         refine_vulnerability_report_gemini_batch,
         load_repo_content_to_text,
@@ -40,7 +46,9 @@ except ImportError:
     import security_scanner_gemini_all_code_withsecondpass as scanner
     from security_scanner_gemini_all_code_withsecondpass import (
         extract_code_files,
-        generate_security_report,
+        scan_code_files,
+        load_previous_report,
+        report_file_paths,
         get_relative_path,
         refine_vulnerability_report_gemini_batch,
         load_repo_content_to_text,
@@ -84,9 +92,20 @@ class SecurityScannerTab(ttk.Frame):
         self.first_pass_button = ttk.Button(self, text="Run First Pass", command=self.run_first_pass)
         self.first_pass_button.pack(pady=5)
 
+        # Continues an interrupted first pass from its journal; enabled while one exists
+        self.resume_button = ttk.Button(self, text="Resume scan", command=self.resume_first_pass, state="disabled")
+        self.resume_button.pack(pady=5)
+
         self.second_pass_button = ttk.Button(self, text="Run Second Pass", command=self.run_second_pass)
         self.second_pass_button.pack(pady=5)
 
+        # Only rescan files changed since the last first pass report
+        self.incremental_var = tk.BooleanVar(value=bool(get_setting("security_scan.incremental", True)))
+        self.incremental_check = ttk.Checkbutton(
+            self, text="Only scan files changed since the last scan", variable=self.incremental_var
+        )
+        self.incremental_check.pack(pady=5)
+
         # Determinate progress bar (max=100)
         self.progress = ttk.Progressbar(self, mode="determinate", maximum=100, value=0)
         self.progress.pack(fill="x", padx=20, pady=5)
@@ -98,16 +117,41 @@ class SecurityScannerTab(ttk.Frame):
         # Text widget to display JSON summary output
         self.summary_text = tk.Text(self, height=10, wrap="word")
         self.summary_text.pack(fill="both", expand=True, padx=20, pady=10)
+        self.refresh_resume_button()
+
+    def first_pass_report_path(self) -> Path:
+        # Use Path(__file__).parent to ensure path is relative to this script
+        return Path(__file__).resolve().parent / SECURITY_OUTPUT_FILE
+
+    def refresh_resume_button(self):
+        header, recorded = read_journal(journal_path(self.first_pass_report_path()))
+        if header and header.get("repo_input"):
+            self.resume_button.config(state="normal", text=f"Resume scan of {header['repo']} ({recorded} results saved)")
+        else:
+            self.resume_button.config(state="disabled", text="Resume scan")
 
     def run_first_pass(self):
         # Get necessary values in the main thread
         repo_input = self.shared_vars.get("repo_path_var").get().strip()
         repo_type = self.shared_vars.get("repo_type_var").get()
-        api_key = self.shared_vars.get("api_gemini_key").get().strip()
         selected_model = self.shared_vars.get("default_gemini_model").get().strip() # Get selected model
+        self.start_first_pass(repo_input, repo_type, selected_model)
+
+    def resume_first_pass(self):
+        # The interrupted scan's repository and model, whatever is selected now
+        header, _ = read_journal(journal_path(self.first_pass_report_path()))
+        if not header:
+            self.refresh_resume_button()
+            return
+        self.start_first_pass(header["repo_input"], header["repo_type"], header.get("selected_model", ""))
+
+    def start_first_pass(self, repo_input, repo_type, selected_model):
+        api_key = self.shared_vars.get("api_gemini_key").get().strip()
+        incremental = self.incremental_var.get()
 
         # Disable buttons and reset progress bar and label
         self.first_pass_button.config(state="disabled")
+        self.resume_button.config(state="disabled")
         self.second_pass_button.config(state="disabled")
         self.progress.config(value=0)
         self.progress_label.config(text="Progress: 0/0")
@@ -115,11 +159,11 @@ class SecurityScannerTab(ttk.Frame):
         # Start the background thread with the captured values
         threading.Thread(
             target=self.first_pass_thread,
-            args=(repo_input, repo_type, api_key, selected_model), # Pass selected_model
+            args=(repo_input, repo_type, api_key, selected_model, incremental), # Pass selected_model
             daemon=True
         ).start()
 
-    def first_pass_thread(self, repo_input, repo_type, api_key, selected_model):
+    def first_pass_thread(self, repo_input, repo_type, api_key, selected_model, incremental=False):
         try:
             # Validate inputs
             if not repo_input:
@@ -146,10 +190,10 @@ class SecurityScannerTab(ttk.Frame):
                 first_pass_model_name = selected_model
                 print(f"Security Scanner (Pass 1): Using selected model '{first_pass_model_name}'") # Optional logging
             else:
-                print(f"Security Scanner (Pass 1): Using default model '{first_pass_model_name}'") # Optional logging
+                print("Security Scanner (Pass 1): Model routed per file (model_routing in llm_settings.yaml)") # Optional logging
 
-            # Initialize the model for first pass analysis
-            gemini_model = genai.GenerativeModel(first_pass_model_name)
+            # Initialize the model for first pass analysis; with "auto" the router picks one per file
+            gemini_model = None if is_auto(first_pass_model_name) else get_model(first_pass_model_name)
             # Set the module-level model in scanner if functions rely on it
             # (Check if scanner.generate_security_report uses a global or passed model)
             # If generate_security_report uses a global model set in scanner, uncomment the next line
@@ -165,55 +209,36 @@ class SecurityScannerTab(ttk.Frame):
             # Update progress label with total files
             self.after(0, lambda: self.progress_label.config(text=f"Progress: 0/{total_files}"))
 
-            security_output = {}
-            threat_summary = {
-                "code quality issue": 0,
-                "low": 0,
-                "medium": 0,
-                "high": 0,
-                "critical": 0,
-            }
-
-            # Process each file and update progress bar and label
-            for idx, file_path in enumerate(code_files, start=1):
-                relative_file_path = get_relative_path(repo, file_path, repo_name)
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        file_content = f.read()
-                except Exception as e:
-                    security_output[relative_file_path] = {"error": f"Failed to read file: {e}"}
-                    continue
-
-                try:
-                    # Pass the initialized gemini_model explicitly
-                    vulnerabilities = generate_security_report(file_content, relative_file_path, model=gemini_model)
-                    if vulnerabilities == {"vulnerabilities": []}:
-                        security_output[relative_file_path] = []
-                    elif isinstance(vulnerabilities, list):
-                        security_output[relative_file_path] = vulnerabilities
-                        for vuln in vulnerabilities:
-                            level = vuln.get("threat_level", "code quality issue").lower()
-                            if level not in threat_summary:
-                                level = "code quality issue"
-                            threat_summary[level] += 1
-                    else:
-                        # Handle unexpected response format (e.g., error dict)
-                        security_output[relative_file_path] = vulnerabilities
-                except Exception as e:
-                    security_output[relative_file_path] = {"error": f"Failed to analyze: {e}"}
-
-                # Update progress bar and label
-                progress_value = int((idx / total_files) * 100)
+            # Files are scanned concurrently (security_scan.first_pass_workers), paced by the shared rate limiter
+            def on_progress(done, total, relative_file_path):
+                progress_value = int((done / total) * 100)
                 self.after(0, lambda val=progress_value: self.progress.config(value=val))
-                self.after(0, lambda cur=idx, tot=total_files: self.progress_label.config(text=f"Progress: {cur}/{tot}"))
-
-            security_output["threat_summary"] = threat_summary
-
-            # Save JSON output
-            # Use Path(__file__).parent to ensure path is relative to this script
-            script_dir = Path(__file__).resolve().parent
-            output_path = script_dir / SECURITY_OUTPUT_FILE
-            save_json(security_output, output_path, "security vulnerabilities (first pass)")
+                self.after(0, lambda cur=done, tot=total: self.progress_label.config(text=f"Progress: {cur}/{tot}"))
+
+            output_path = self.first_pass_report_path()
+            previous_report = load_previous_report(output_path) if incremental else None
+            # Each result is journaled as it arrives; a rerun on the same repository and commit continues from it
+            journal = None
+            if get_setting("security_scan.journal", True):
+                journal = ScanJournal(
+                    journal_path(output_path),
+                    {"repo_input": repo_input, "repo_type": repo_type, "selected_model": selected_model},
+                )
+
+            security_output = scan_code_files(
+                repo, repo_name, code_files, model=gemini_model, on_progress=on_progress, previous_report=previous_report,
+                journal=journal,
+            )
+            threat_summary = security_output["threat_summary"]
+            scan_state = security_output["scan_state"]
+            if scan_state["scanned"] == 0:
+                status = "resumed" if scan_state["resumed"] else "unchanged"
+                self.after(0, lambda: self.progress.config(value=100))
+                self.after(0, lambda tot=total_files: self.progress_label.config(text=f"Progress: {tot}/{tot} ({status})"))
+
+            # Save JSON output; the journal is only dropped once the report is on disk
+            if save_json(security_output, output_path, "security vulnerabilities (first pass)") and journal is not None:
+                journal.finish()
 
             summary_text = json.dumps(threat_summary, indent=4)
             self.after(0, lambda: self.summary_text.delete("1.0", tk.END))
@@ -225,6 +250,7 @@ class SecurityScannerTab(ttk.Frame):
             # Ensure buttons are re-enabled in the main thread
             self.after(0, lambda: self.first_pass_button.config(state="normal"))
             self.after(0, lambda: self.second_pass_button.config(state="normal"))
+            self.after(0, self.refresh_resume_button)
 
     def run_second_pass(self):
         # Get necessary values in the main thread
@@ -235,6 +261,7 @@ class SecurityScannerTab(ttk.Frame):
 
         # Disable buttons and reset progress bar and label
         self.first_pass_button.config(state="disabled")
+        self.resume_button.config(state="disabled")
         self.second_pass_button.config(state="disabled")
         self.progress.config(value=0)
         self.progress_label.config(text="Progress: 0/0")
@@ -297,12 +324,12 @@ class SecurityScannerTab(ttk.Frame):
                 second_pass_model_name = selected_model
                 print(f"Security Scanner (Pass 2): Using selected model '{second_pass_model_name}'") # Optional logging
             else:
-                print(f"Security Scanner (Pass 2): Using default model '{second_pass_model_name}'") # Optional logging
+                print("Security Scanner (Pass 2): Model routed per batch (model_routing in llm_settings.yaml)") # Optional logging
 
-            # Initialize model for second pass refinement
-            gemini_model_second = genai.GenerativeModel(second_pass_model_name)
+            # Initialize model for second pass refinement; with "auto" the router picks one per batch
+            gemini_model_second = None if is_auto(second_pass_model_name) else get_model(second_pass_model_name)
 
-            file_keys = [k for k in security_report.keys() if k != "threat_summary"]
+            file_keys = report_file_paths(security_report)
             total_files = len(file_keys)
             total_batches = math.ceil(total_files / BATCH_SIZE) if BATCH_SIZE > 0 else 1
             improved_security_output = {"threat_summary": {
@@ -397,6 +424,7 @@ class SecurityScannerTab(ttk.Frame):
             # Ensure buttons are re-enabled in the main thread
             self.after(0, lambda: self.first_pass_button.config(state="normal"))
             self.after(0, lambda: self.second_pass_button.config(state="normal"))
+            self.after(0, self.refresh_resume_button)
 
 # For independent testing
 if __name__ == "__main__":
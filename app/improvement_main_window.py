@@ -2,9 +2,10 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import re
-import yaml
 # from utils import toolkit, file_tree
 import utils.llm_api as llm_api
+from app.utils.model_router import resolve_model
+from app.utils.prompt_registry import get_prompt_registry
 
 def split_sections(file_path):
     '''
@@ -76,8 +77,8 @@ def improve_part(part_name, content, file_tree, model):
     btw, it seems that parameter can be improved. This will be done once UI is designed.
     :return: improved section
     '''
-    with open("app/prompts/improvements_prompt.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    registry = get_prompt_registry()
+    prompts_repo = registry.get("improvements_prompt")
 
     meta_prompt = prompts_repo["meta-prompt"]
     output_prompt = prompts_repo["output-meta"]
@@ -88,10 +89,7 @@ def improve_part(part_name, content, file_tree, model):
         file_tree_prompt = ""
 
     if part_name == "title":
-        prompt = (meta_prompt + "\n\n"
-                  + prompts_repo["title"] + "\n\n"
-                  + prompts_repo["about"] + "\n\n"
-                  + output_prompt + "\n\n"
+        prompt = (registry.compose("improvements_prompt", "meta-prompt", "title", "about", "output-meta") + "\n\n"
                   + content)
     else:
         prompt = (meta_prompt + "\n\n"
@@ -100,7 +98,8 @@ def improve_part(part_name, content, file_tree, model):
             + output_prompt + "\n\n"
             + content)
         
-    result = llm_api.gemini_api(prompt, model)
+    model, generation_config = resolve_model("readme_section", prompt, model)
+    result = llm_api.gemini_api(prompt, model, task="readme_section", generation_config=generation_config)
 
     # add section name if LLM misses it.
     if not result.startswith("##") and not part_name == "title":
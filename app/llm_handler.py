@@ -1,5 +1,26 @@
-import requests
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.utils.llm_settings import get_setting
+from app.utils.metrics import get_metrics
+from app.utils.retry_policy import transient_retry
+from app.utils.token_budget import get_estimator
+from app.utils.upload_registry import get_upload_registry
+
+ANALYZE_CODE_PROMPT = (
+    "Analyze this Python code: \n```\n{code}\n```\n\n"
+    "Provide a structured response suitable for generating documentation."
+)
 
 
 class LLMHandler(ABC):
@@ -11,33 +32,405 @@ class LLMHandler(ABC):
         pass
 
 
-class OllamaHandler(LLMHandler):
-    def __init__(self, llm_url="http://localhost:11434/api/generate"):
-        self.llm_url = llm_url
+class OllamaError(RuntimeError):
+    """
+    Raised when the Ollama server reports an error inside a response stream.
+    """
+
+
+class OpenAICompatibleError(RuntimeError):
+    """
+    Raised when an OpenAI-compatible server reports an error inside a response stream.
+    """
+
+
+class StreamInterruptedError(RuntimeError):
+    """
+    Raised when a request fails after part of its output was passed to on_token.
+    It is not retried: a retry would pass the same fragments again.
+    """
+
+
+def split_into_chunks(text: str, max_chars: int) -> list:
+    """
+    Splits text on line boundaries into chunks of at most max_chars characters.
+    Lines longer than max_chars are split hard.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    chunks, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if size + len(line) > max_chars and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+class PooledHTTPHandler(LLMHandler):
+    """
+    Shared plumbing for HTTP inference servers: one pooled session, up to max_parallel
+    concurrent requests, retries of transient errors, metrics, and chunked analyze_code.
+    Subclasses implement _generate and set context_tokens / output_tokens.
+    """
+
+    context_tokens = 8192
+    output_tokens = 1024
+
+    def __init__(self, model: str, max_parallel: int, timeout: float):
+        self.model = model
+        self.max_parallel = max(int(max_parallel), 1)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_parallel)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @abstractmethod
+    def _generate(self, prompt: str, system: str = None, params: dict = None, on_token=None) -> tuple:
+        """
+        Sends one streamed request without retries or metrics.
+        :return: (text, usage) where usage has input_tokens and output_tokens.
+        """
+
+    def config_params(self, generation_config) -> dict:
+        """
+        Request parameters equivalent to a Gemini-style generation config.
+        """
+        return {}
+
+    @transient_retry()
+    def generate_with_usage(self, prompt: str, system: str = None, params: dict = None, on_token=None) -> tuple:
+        """
+        Sends one prompt, retrying transient errors as long as no fragment has reached on_token.
+        :return: (text, usage) where usage has input_tokens and output_tokens.
+        """
+        streamed = False
+
+        def forward(fragment):
+            nonlocal streamed
+            streamed = True
+            on_token(fragment)
+
+        try:
+            return self._generate(prompt, system, params, forward if on_token else None)
+        except Exception as e:
+            if streamed:
+                raise StreamInterruptedError(f"{self.model} failed after streaming part of its output: {e}") from e
+            raise
+
+    def generate(self, prompt: str, system: str = None, params: dict = None, on_token=None) -> str:
+        """
+        Sends one prompt and returns the full response text.
+        :param params: request parameters merged into the payload.
+        :param on_token: optional callable receiving each streamed text fragment.
+        """
+        start = time.monotonic()
+        try:
+            text, usage = self.generate_with_usage(prompt, system, params, on_token)
+        except Exception as e:
+            get_metrics().record_error(self.model, e, time.monotonic() - start)
+            raise
+        get_metrics().record_request(self.model, time.monotonic() - start, **usage)
+        return text
+
+    def generate_many(self, prompts: list, system: str = None, params: dict = None) -> list:
+        """
+        Runs prompts concurrently, at most max_parallel in flight, and returns the texts in input order.
+        """
+        if len(prompts) <= 1 or self.max_parallel <= 1:
+            return [self.generate(prompt, system, params) for prompt in prompts]
+        # One context copy per task keeps the caller's metrics stage in the worker threads.
+        contexts = [contextvars.copy_context() for _ in prompts]
+        return list(self._get_executor().map(
+            lambda context, prompt: context.run(self.generate, prompt, system, params), contexts, prompts
+        ))
+
+    def input_chars(self, template: str = "") -> int:
+        """
+        Characters of input that fit next to template in the context window, leaving room for the output.
+        """
+        available_tokens = self.context_tokens - self.output_tokens - get_estimator().estimate(template)
+        return max(int(available_tokens * get_estimator().chars_per_token), 1)
 
     def analyze_code(self, code):
         """
-        Sends the code to Ollama for analysis.
+        Sends the code for analysis.
+        Code that does not fit the context window is analysed in chunks, in parallel, and the answers are concatenated.
         """
+        chunks = split_into_chunks(code, self.input_chars(ANALYZE_CODE_PROMPT))
+        if len(chunks) > 1:
+            logging.info(f"Code does not fit {self.context_tokens} context tokens; analysing it in {len(chunks)} chunks.")
+        answers = self.generate_many([ANALYZE_CODE_PROMPT.format(code=chunk) for chunk in chunks])
+        return {"model": self.model, "response": "\n\n".join(answers), "chunks": len(chunks), "done": True}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_parallel, thread_name_prefix=type(self).__name__.lower()
+                )
+            return self._executor
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+
+
+class OllamaHandler(PooledHTTPHandler):
+    """
+    Ollama backend over its HTTP API.
+    Requests keep the model loaded for `keep_alive`, stream NDJSON output and run up to
+    `max_parallel` at a time (match the server's OLLAMA_NUM_PARALLEL).
+    Inputs larger than the context window (`num_ctx`) are split into chunks that fit.
+    Defaults come from the `ollama` section of app/config/llm_settings.yaml.
+    """
+
+    def __init__(self, llm_url=None, model=None, num_ctx=None, keep_alive=None, max_parallel=None,
+                 num_predict=None, timeout=None, options=None):
+        super().__init__(
+            model or get_setting("ollama.model", "llama3.2"),
+            max_parallel or get_setting("ollama.max_parallel", 1),
+            timeout or get_setting("ollama.request_timeout_seconds", 300),
+        )
+        # llm_url used to be the full /api/generate endpoint; a base URL works as well.
+        base_url = llm_url or get_setting("ollama.base_url", "http://localhost:11434")
+        self.base_url = base_url.rstrip("/").removesuffix("/api/generate")
+        self.num_ctx = int(num_ctx or get_setting("ollama.num_ctx", 8192))
+        self.keep_alive = keep_alive if keep_alive is not None else get_setting("ollama.keep_alive", "30m")
+        self.num_predict = int(num_predict or get_setting("ollama.num_predict", 1024))
+        self.options = {"temperature": 0, **(options or {})}
+
+    @property
+    def context_tokens(self) -> int:
+        return self.num_ctx
+
+    @property
+    def output_tokens(self) -> int:
+        return self.num_predict
+
+    def config_params(self, generation_config) -> dict:
+        config = generation_config or {}
+        options = {}
+        if config.get("max_output_tokens"):
+            options["num_predict"] = config["max_output_tokens"]
+        if config.get("temperature") is not None:
+            options["temperature"] = config["temperature"]
+        params = {"options": options} if options else {}
+        if config.get("response_schema"):
+            params["format"] = config["response_schema"]
+        elif config.get("response_mime_type") == "application/json":
+            params["format"] = "json"
+        return params
+
+    def _generate(self, prompt: str, system: str = None, params: dict = None, on_token=None) -> tuple:
+        params = dict(params or {})
         payload = {
-            "prompt": f"Analyze this Python code: \n```\n{code}\n```\n\nProvide a structured response suitable for generating documentation.",
-            "model": "llama3.2",
-            "options": {"temperature": 0},
-            "stream": False,
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {**self.options, "num_ctx": self.num_ctx, "num_predict": self.num_predict,
+                        **params.pop("options", {})},
+            **params,
         }
+        if system:
+            payload["system"] = system
+        parts, final = [], {}
+        with self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if "error" in message:
+                    raise OllamaError(message["error"])
+                fragment = message.get("response", "")
+                if fragment:
+                    parts.append(fragment)
+                    if on_token:
+                        on_token(fragment)
+                if message.get("done"):
+                    final = message
+                    break
+        if final.get("done_reason") == "length":
+            logging.warning(f"Ollama output for {self.model} hit num_predict and was cut off.")
+        usage = {"input_tokens": final.get("prompt_eval_count", 0), "output_tokens": final.get("eval_count", 0)}
+        return "".join(parts), usage
 
-        response = requests.post(self.llm_url, json=payload)
+    def list_models(self, timeout: float = 5) -> list:
+        """
+        Names of the models installed on the server (GET /api/tags).
+        """
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=timeout)
         response.raise_for_status()
-        
-        return response.json()
+        return [model["name"] for model in response.json().get("models", [])]
 
+    def preload(self):
+        """
+        Loads the model without generating, so the first real request does not pay the load time.
+        """
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
 
-# Example of adding another LLM (hypothetical 'OtherLLM')
-class OtherLLMHandler(LLMHandler):
-    def __init__(self, api_key, api_url):
-        # ... specific initialisation
-        pass
 
-    def analyze_code(self, code):
-        # ...  implementation for OtherLLM API interaction
-        pass
+class OpenAICompatibleHandler(PooledHTTPHandler):
+    """
+    Backend for servers exposing the OpenAI chat completions API (llama.cpp server, vLLM, ...).
+    Requests are streamed as server-sent events and dispatched concurrently so the server can batch them.
+    Defaults come from the `openai_compatible` section of app/config/llm_settings.yaml;
+    the API key falls back to the OPENAI_API_KEY environment variable.
+    """
+
+    def __init__(self, api_url=None, api_key=None, model=None, max_parallel=None, max_tokens=None,
+                 context_tokens=None, timeout=None, options=None):
+        super().__init__(
+            model or get_setting("openai_compatible.model", "default"),
+            max_parallel or get_setting("openai_compatible.max_parallel", 8),
+            timeout or get_setting("openai_compatible.request_timeout_seconds", 300),
+        )
+        base_url = api_url or get_setting("openai_compatible.base_url", "http://localhost:8000/v1")
+        self.base_url = base_url.rstrip("/").removesuffix("/chat/completions")
+        self.context_tokens = int(context_tokens or get_setting("openai_compatible.context_tokens", 8192))
+        self.output_tokens = int(max_tokens or get_setting("openai_compatible.max_tokens", 2048))
+        self.options = {"temperature": 0, **(options or {})}
+        api_key = api_key or get_setting("openai_compatible.api_key") or os.environ.get("OPENAI_API_KEY")
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def config_params(self, generation_config) -> dict:
+        config = generation_config or {}
+        params = {}
+        if config.get("max_output_tokens"):
+            params["max_tokens"] = config["max_output_tokens"]
+        if config.get("temperature") is not None:
+            params["temperature"] = config["temperature"]
+        if config.get("response_schema"):
+            params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": config["response_schema"]},
+            }
+        elif config.get("response_mime_type") == "application/json":
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    def _generate(self, prompt: str, system: str = None, params: dict = None, on_token=None) -> tuple:
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            "max_tokens": self.output_tokens,
+            **self.options,
+            **(params or {}),
+        }
+        parts, usage, finish_reason = [], {}, None
+        with self.session.post(f"{self.base_url}/chat/completions", json=payload, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("error"):
+                    error = chunk["error"]
+                    raise OpenAICompatibleError(error.get("message", error) if isinstance(error, dict) else error)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    fragment = (choice.get("delta") or {}).get("content")
+                    if fragment:
+                        parts.append(fragment)
+                        if on_token:
+                            on_token(fragment)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+        if finish_reason == "length":
+            logging.warning(f"Output of {self.model} hit max_tokens and was cut off.")
+        return "".join(parts), {
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+        }
+
+
+def contents_to_text(contents) -> str:
+    """
+    Flattens Gemini-style contents into one prompt string; uploaded files are inlined from their local copy.
+    """
+    texts = []
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, str):
+            texts.append(part)
+            continue
+        local_path = get_upload_registry().local_path(part)
+        if local_path is None:
+            raise ValueError(f"Cannot send {getattr(part, 'name', part)} to a local model: no local copy is known.")
+        with open(local_path, "r", encoding="utf-8", errors="replace") as f:
+            texts.append(f.read())
+    return "".join(texts)
+
+
+class HandlerModel:
+    """
+    Presents a handler through the generate_content interface that llm_api and the GUI use,
+    so local servers work wherever a Gemini model does. Each call sends a single request: retries,
+    circuit breaking and metrics are left to llm_api and its callers, as for every provider.
+    """
+
+    def __init__(self, handler: PooledHTTPHandler, model_name: str):
+        self.handler = handler
+        self.model_name = model_name
+        # Read by token_budget, so prompts are checked against the server's window rather than Gemini's.
+        self.context_tokens = handler.context_tokens
+        self.output_tokens = handler.output_tokens
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        text, usage = self.handler._generate(
+            contents_to_text(contents), params=self.handler.config_params(generation_config)
+        )
+        usage_metadata = SimpleNamespace(
+            prompt_token_count=usage["input_tokens"],
+            candidates_token_count=usage["output_tokens"],
+            cached_content_token_count=0,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage_metadata)
+
+
+HANDLER_TYPES = {
+    "ollama": OllamaHandler,
+    "openai": OpenAICompatibleHandler,
+}
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def get_handler(provider: str, model: str) -> PooledHTTPHandler:
+    """
+    Returns the shared handler (and connection pool) for a provider and model.
+    """
+    with _handlers_lock:
+        handler = _handlers.get((provider, model))
+        if handler is None:
+            handler = _handlers[(provider, model)] = HANDLER_TYPES[provider](model=model)
+        return handler
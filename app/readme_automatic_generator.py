@@ -2,9 +2,9 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import re
-import yaml
 from utils import toolkit
 import utils.llm_api as llm_api
+from app.utils.prompt_registry import get_prompt_registry
 
 class ReadmeAutomaticGenerator:
     def __init__(self):
@@ -95,8 +95,7 @@ class ReadmeAutomaticGenerator:
         btw, it seems that parameter can be improved. This will be done once UI is designed.
         :return: improved section
         '''
-        with open("app/prompts/improvements_prompt.yaml", 'r') as file:
-            prompts_repo = yaml.safe_load(file)
+        prompts_repo = get_prompt_registry().get("improvements_prompt")
 
         meta_prompt = prompts_repo["meta-prompt"]
         output_prompt = prompts_repo["output-meta"]
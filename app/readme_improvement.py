@@ -8,7 +8,6 @@ from app.utils.creation import create_part, create_feature, structure_markdown
 from app.utils.repo_structure import generate_file_tree, convert_repo_to_txt
 from app.utils.utils import configure_genai_api, get_local_repo_path, clone_remote_repo
 import sv_ttk
-import google.generativeai as genai
 from app.utils.help_popup import HelpPopup
 from pathlib import Path
 
@@ -74,7 +73,8 @@ class ReadmeImprovementTab(tk.Frame):
             repo_path = str(clone_remote_repo(repo_input))
 
         configure_genai_api(api_key)
-        model = genai.GenerativeModel(model_name)
+        # Routed per request with the actual prompt (see creation.create_part)
+        model = model_name
 
         for widget in self.content_frame.winfo_children():
             widget.destroy()
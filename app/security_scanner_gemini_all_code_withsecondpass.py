@@ -3,17 +3,11 @@ import os
 import sys
 import json
 import logging
+import math
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
-import google.generativeai as genai
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
-)
 
 # Import utility functions from utils.py
 from app.utils.utils import (
@@ -26,21 +20,34 @@ from app.utils.utils import (
     upload_file_to_gemini,      # Upload a file to Gemini (returns a file reference)
     convert_file_to_txt,        # Convert a file to text (if needed)
 )
+from app.utils.context_cache import get_context_cache
+from app.utils.finding_cache import get_finding_cache, git_blob_sha, git_blob_sha_of_file, prompt_version, rewrite_paths
+from app.utils.key_pool import get_key_pool
+from app.utils.line_index import LineIndex
+from app.utils.llm_settings import get_setting
+from app.utils.llm_api import generate_content
+from app.utils.metrics import get_metrics, pipeline_stage
+from app.utils.model_router import candidate_models, route, routed_model
+from app.utils.rate_limiter import get_rate_limiter
+from app.utils.scan_journal import ScanJournal, journal_path
+from app.utils.retry_policy import transient_retry
+from app.utils.secret_detector import CWE_ID as HARDCODED_CREDENTIALS_CWE, scan_secrets
+from app.utils.static_triage import triage_file, triage_files
+from app.utils.structured_output import StructuredOutputError, generate_json
+from app.utils.token_budget import PromptTooLargeError, get_estimator, model_name_of
 
 # API key and model settings
-API_KEY = ""  # Replace with your actual Gemini API key
-MODEL_NAME = "gemini-2.0-flash-thinking-exp-01-21"  # First pass model
-SECOND_PASS_MODEL = "gemini-2.0-flash-thinking-exp-01-21"  # Second pass model
+API_KEY = ""  # Replace with your actual Gemini API key (several keys separated by commas form a key pool)
+# "auto" lets the model router pick per request (see model_routing in app/config/llm_settings.yaml)
+MODEL_NAME = "auto"  # First pass model
+SECOND_PASS_MODEL = "auto"  # Second pass model
 
 # Output file names and repository content file
 SECURITY_OUTPUT_FILE = "security_vulnerabilities.json"
 IMPROVED_SECURITY_OUTPUT_FILE = "improved_security_vulnerabilities.json"  # For refined vulnerabilities
 REPO_CONTENT_FILE = "repo_content.txt"  # Stores entire repository content as text
 
-# Constants for API rate limiting and retry logic
-RATE_LIMIT_SECONDS = 10
-RATE_LIMIT_SECONDS_SECOND_PASS = 10
-MAX_RETRIES = 3
+# Request pacing, daily quotas, retries and first-pass concurrency are configured in app/config/llm_settings.yaml
 BATCH_SIZE = 5  # Process vulnerabilities in batches
 
 # File extensions to consider as code files
@@ -50,9 +57,13 @@ CODE_FILE_EXTENSIONS = [
     ".xml", ".json", ".yaml", ".yml",
 ]
 
-# Global counters for Gemini API statistics
-gemini_stats_first = {"num_requests": 0, "num_errors": 0, "total_response_time": 0.0}
-gemini_stats_second = {"num_requests": 0, "num_errors": 0, "total_response_time": 0.0}
+# Report entries that are not files: the threat summary and what the report was produced from (see scan_code_files)
+SCAN_STATE_KEY = "scan_state"
+REPORT_METADATA_KEYS = ("threat_summary", SCAN_STATE_KEY)
+
+# Pipeline stages under which request metrics are recorded (see app/utils/metrics.py)
+FIRST_PASS_STAGE = "security_first_pass"
+SECOND_PASS_STAGE = "security_second_pass"
 
 
 def get_repo_source() -> dict:
@@ -115,18 +126,43 @@ def extract_code_files(repo: git.Repo) -> list:
     return code_files
 
 
-def extract_json(text: str) -> dict:
-    text = text.strip()
-    text = re.sub(r"^```(?:json)?\n?", "", text, flags=re.IGNORECASE)
-    text = re.sub(r"\n```$", "", text, flags=re.IGNORECASE)
-    start_idx = text.find("{")
-    end_idx = text.rfind("}") + 1
-    if start_idx == -1 or end_idx == 0:
-        return None
-    try:
-        return json.loads(text[start_idx:end_idx])
-    except json.JSONDecodeError:
-        return None
+# Response schemas (OpenAPI subset accepted by Gemini's response_schema).
+# Only name and location are required: validate_vulnerability fills in defaults for the rest.
+VULNERABILITY_PROPERTIES = {
+    "vulnerability_name": {"type": "string"},
+    "vulnerability_description": {"type": "string"},
+    "location": {"type": "string"},
+    "remediation": {"type": "string"},
+    "threat_level": {"type": "string", "enum": ["code quality issue", "low", "medium", "high", "critical"]},
+    "cwe_id": {"type": "string"},
+    "cwe_name": {"type": "string"},
+}
+VULNERABILITY_REQUIRED = ["vulnerability_name", "location"]
+SECURITY_REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vulnerabilities": {
+            "type": "array",
+            "items": {"type": "object", "properties": VULNERABILITY_PROPERTIES, "required": VULNERABILITY_REQUIRED},
+        },
+    },
+    "required": ["vulnerabilities"],
+}
+# A list of findings with their file path: response schemas cannot express objects keyed by arbitrary paths.
+REFINED_REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "refined_vulnerabilities": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"file_path": {"type": "string"}, **VULNERABILITY_PROPERTIES},
+                "required": ["file_path", *VULNERABILITY_REQUIRED],
+            },
+        },
+    },
+    "required": ["refined_vulnerabilities"],
+}
 
 
 def validate_vulnerability(vuln: dict, file_path: str) -> dict:
@@ -159,13 +195,7 @@ def validate_vulnerability(vuln: dict, file_path: str) -> dict:
     return validated
 
 
-@retry(
-    stop=stop_after_attempt(MAX_RETRIES),
-    wait=wait_exponential(multiplier=1, min=4, max=30),
-    retry=retry_if_exception_type(Exception),
-)
-def generate_security_report(file_content: str, file_path: str, model=None) -> dict:
-    prompt = f"""
+FIRST_PASS_PROMPT = """
     You are a security expert analyzing the following code for potential security vulnerabilities:
 
     File: {file_path}
@@ -197,32 +227,170 @@ def generate_security_report(file_content: str, file_path: str, model=None) -> d
     }}
     Provide only the JSON data without any formatting or markdown.
     """
-    global gemini_stats_first
-    start_time = time.time()
+# Cached first-pass findings are reused only while the prompt and schema stay the same.
+FIRST_PASS_PROMPT_VERSION = prompt_version(FIRST_PASS_PROMPT, SECURITY_REPORT_SCHEMA)
+
+# Several small files in one first-pass request (see scan_code_files). Like the refined report,
+# findings come as a list per file path because response schemas cannot key objects by arbitrary paths.
+PACKED_REPORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "files": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "file_path": {"type": "string"},
+                    "vulnerabilities": SECURITY_REPORT_SCHEMA["properties"]["vulnerabilities"],
+                },
+                "required": ["file_path", "vulnerabilities"],
+            },
+        },
+    },
+    "required": ["files"],
+}
+PACKED_FILE_TEMPLATE = "=== File: {file_path} ===\n{file_content}\n=== End of file: {file_path} ===\n"
+PACKED_PROMPT = """
+    You are a security expert analyzing the following {file_count} files for potential security vulnerabilities.
+    Analyze each file on its own; line numbers are counted from the first line of each file.
+
+    {files}
+
+    Instructions:
+    - List each vulnerability with line numbers or code snippets showing exact location.
+    - For each vulnerability, include:
+      * Vulnerability name
+      * Detailed description
+      * Exact location (line numbers or code snippet)
+      * Suggested remediation steps
+      * Threat level (code quality issue/low/medium/high/critical)
+      * CWE number and name
+    - Return one entry for every file, using its path exactly as given, with an empty list when it has no vulnerabilities.
+
+    Response Format:
+    {{
+      "files": [
+        {{
+          "file_path": "repo/app/views.py",
+          "vulnerabilities": [
+            {{
+              "vulnerability_name": "XSS Vulnerability",
+              "vulnerability_description": "Detailed description...",
+              "location": "Line 42: user_input = request.GET.get('q')",
+              "remediation": "Sanitize input using...",
+              "threat_level": "high",
+              "cwe_id": "CWE-79",
+              "cwe_name": "Cross-site Scripting"
+            }}
+          ]
+        }}
+      ]
+    }}
+    Provide only the JSON data without any formatting or markdown.
+    """
+PACKED_PROMPT_VERSION = prompt_version(PACKED_PROMPT, PACKED_FILE_TEMPLATE, PACKED_REPORT_SCHEMA)
+
+# Large files are scanned in overlapping line ranges (see scan_large_file). Line numbers in the answer
+# count from the start of the excerpt and are remapped to file lines afterwards.
+EXCERPT_PROMPT = """
+    You are a security expert analyzing an excerpt of a large file for potential security vulnerabilities:
+
+    File: {file_path}
+    Code (excerpt; count line numbers from 1 at its first line): {file_content}
+
+    Instructions:
+    - Only report vulnerabilities visible in this excerpt; it may start or end in the middle of a block.
+    - List each vulnerability with line numbers or code snippets showing exact location.
+    - For each vulnerability, include:
+      * Vulnerability name
+      * Detailed description
+      * Exact location (line numbers or code snippet)
+      * Suggested remediation steps
+      * Threat level (code quality issue/low/medium/high/critical)
+      * CWE number and name
+
+    Response Format:
+    {{
+      "vulnerabilities": [
+        {{
+          "vulnerability_name": "XSS Vulnerability",
+          "vulnerability_description": "Detailed description...",
+          "location": "Line 42: user_input = request.GET.get('q')",
+          "remediation": "Sanitize input using...",
+          "threat_level": "high",
+          "cwe_id": "CWE-79",
+          "cwe_name": "Cross-site Scripting"
+        }}
+      ]
+    }}
+    Provide only the JSON data without any formatting or markdown.
+    """
+EXCERPT_PROMPT_VERSION = prompt_version(EXCERPT_PROMPT, SECURITY_REPORT_SCHEMA)
+# Recorded in the scan state; findings only carry over to a scan using the same prompts
+SCAN_PROMPT_VERSIONS = {"first_pass": FIRST_PASS_PROMPT_VERSION, "packed": PACKED_PROMPT_VERSION, "excerpt": EXCERPT_PROMPT_VERSION}
+# "Line 42", "lines 10-12"
+LINE_REFERENCE = re.compile(r"\b(lines?\s+)(\d+)(?:(\s*[-–]\s*)(\d+))?", re.IGNORECASE)
+
+
+@transient_retry()
+def send_gemini_request(model, contents, counted_contents=None, **kwargs):
+    """
+    Send one request; latency, tokens and errors are recorded by the metrics registry.
+    Only transient failures (rate limits, server errors, timeouts) are retried.
+    """
+    return generate_content(model, contents, counted_contents=counted_contents, **kwargs)
+
+
+def cached_findings(blob_sha: str, model_name: str, file_path: str, versions=None) -> list:
+    """
+    Findings cached for this content and model by a single-file or a packed first-pass request, or None.
+    """
+    for version in versions or (FIRST_PASS_PROMPT_VERSION, PACKED_PROMPT_VERSION):
+        cached = get_finding_cache().get(blob_sha, model_name, version, file_path)
+        if cached is not None:
+            return cached
+    return None
+
+
+def generate_security_report(file_content: str, file_path: str, model=None, blob_sha: str = None, excerpt: bool = False) -> dict:
+    """
+    First pass for one file. Findings for content already analysed with the same model and prompt
+    come from the finding cache instead of a request.
+    :param blob_sha: git blob SHA of the file, computed from file_content when not given.
+    :param excerpt: file_content is a range of lines of a large file; line numbers in the findings count from its start.
+    """
+    template, versions = (EXCERPT_PROMPT, (EXCERPT_PROMPT_VERSION,)) if excerpt else (FIRST_PASS_PROMPT, None)
+    prompt = template.format(file_path=file_path, file_content=file_content)
+    # Without an explicit model the router picks one by prompt size, so tiny files go to a fast model.
+    generation_config = None
+    if model is None:
+        model, generation_config = routed_model(FIRST_PASS_STAGE, prompt, MODEL_NAME)
+    if blob_sha is None:
+        blob_sha = git_blob_sha(file_content.encode("utf-8"))
+    cached = cached_findings(blob_sha, model_name_of(model), file_path, versions)
+    if cached is not None:
+        logging.info(f"Using cached findings for {file_path}")
+        return cached
     try:
-        model = model or gemini_model
-        response = model.generate_content(prompt)
-        elapsed_time = time.time() - start_time
-        gemini_stats_first["num_requests"] += 1
-        gemini_stats_first["total_response_time"] += elapsed_time
+        with pipeline_stage(FIRST_PASS_STAGE):
+            result = generate_json(
+                model, prompt, SECURITY_REPORT_SCHEMA, send=send_gemini_request, generation_config=generation_config
+            )
+    except PromptTooLargeError as e:
+        # Nothing was sent; report the reason instead of retrying.
+        logging.error(f"Skipping {file_path}: {e}")
+        raise
+    except StructuredOutputError as e:
+        logging.warning(f"Could not extract valid JSON from response for {file_path}: {e}")
+        logging.debug(f"Raw model response for {file_path}:\n{e.text}")
+        return {"error": "No valid JSON found in response"}
     except Exception as e:
-        gemini_stats_first["num_requests"] += 1
-        gemini_stats_first["num_errors"] += 1
         logging.error(f"API Error processing {file_path}: {str(e)}")
         raise
 
-    security_report = response.text.strip()
-    logging.debug(f"Raw model response for {file_path}:\n{security_report}")
-    security_data = extract_json(security_report)
-    if not security_data:
-        logging.warning(f"Could not extract valid JSON from response for {file_path}")
-        return {"vulnerabilities": []}
-    if "vulnerabilities" not in security_data:
-        logging.warning(f"No 'vulnerabilities' key found in JSON response for {file_path}")
-        return {"vulnerabilities": []}
-    vulnerabilities = security_data.get("vulnerabilities", [])
-    if not isinstance(vulnerabilities, list):
-        vulnerabilities = [vulnerabilities]
+    if result.status != "valid":
+        logging.info(f"Response for {file_path} was {result.status}")
+    vulnerabilities = result.data["vulnerabilities"]
     processed = []
     for vuln in vulnerabilities:
         try:
@@ -230,52 +398,590 @@ def generate_security_report(file_content: str, file_path: str, model=None) -> d
         except Exception as e:
             logging.error(f"Invalid vulnerability format in {file_path}: {str(e)}")
             continue
-    time.sleep(RATE_LIMIT_SECONDS)
+    # Repaired or salvaged responses may be missing findings, so only complete ones are cached.
+    if result.status == "valid":
+        version = EXCERPT_PROMPT_VERSION if excerpt else FIRST_PASS_PROMPT_VERSION
+        get_finding_cache().put(blob_sha, model_name_of(model), version, file_path, processed)
     return processed
 
 
-def analyze_security(repo: git.Repo, repo_name: str) -> dict:
-    security_output = {}
-    code_files = extract_code_files(repo)
-    if not code_files:
-        logging.info("No code-related files detected for security analysis.")
-        print("No code-related files detected for security analysis.")
-        return security_output
-    threat_summary = {
+def empty_threat_summary() -> dict:
+    return {
         "code quality issue": 0,
         "low": 0,
         "medium": 0,
         "high": 0,
         "critical": 0,
     }
-    for file_path in tqdm(code_files, desc="Analyzing security vulnerabilities"):
+
+
+def scan_file(repo: git.Repo, file_path: Path, repo_name: str, model=None):
+    """
+    First pass for one file.
+    Returns (relative path, list of vulnerabilities or an {"error": ...} dict).
+    """
+    relative_file_path = get_relative_path(repo, file_path, repo_name)
+    try:
+        data = Path(file_path).read_bytes()
+        file_content = data.decode("utf-8")
+    except Exception as e:
+        logging.error(f"Error reading file {file_path}: {e}")
+        return relative_file_path, {"error": f"Failed to read file: {e}"}
+    try:
+        security_report = generate_security_report(file_content, relative_file_path, model=model, blob_sha=git_blob_sha(data))
+    except Exception as e:
+        logging.error(f"Final error processing {file_path}: {str(e)}")
+        return relative_file_path, {"error": f"Failed to analyze: {str(e)}"}
+    if security_report == {"vulnerabilities": []}:
+        return relative_file_path, []
+    return relative_file_path, security_report
+
+
+def generate_packed_report(files: list, model=None) -> dict:
+    """
+    First pass for several small files in one request.
+    :param files: (relative path, content, blob SHA) per file.
+    :return: {relative path: validated vulnerabilities} for the files the response covers completely;
+        callers scan the others on their own. Raises StructuredOutputError when the response is unusable.
+    """
+    prompt = PACKED_PROMPT.format(
+        file_count=len(files),
+        files="\n".join(PACKED_FILE_TEMPLATE.format(file_path=path, file_content=content) for path, content, _ in files),
+    )
+    generation_config = None
+    if model is None:
+        # Routed as its largest file would be on its own, not by the combined size. plan_packs only packs
+        # files routed to the same model, so findings are cached under the model it looks them up with.
+        path, content, _ = max(files, key=lambda file: get_estimator().estimate(file[1]))
+        model, generation_config = routed_model(
+            FIRST_PASS_STAGE, FIRST_PASS_PROMPT.format(file_path=path, file_content=content), MODEL_NAME
+        )
+    with pipeline_stage(FIRST_PASS_STAGE):
+        result = generate_json(
+            model, prompt, PACKED_REPORT_SCHEMA, send=send_gemini_request, generation_config=generation_config
+        )
+    entries = result.data["files"]
+    if result.repaired and entries:
+        # The response was cut off (and possibly salvaged as well): the last file's list may be incomplete.
+        entries = entries[:-1]
+    requested = {path: blob_sha for path, _, blob_sha in files}
+    processed = {}
+    for entry in entries:
+        file_path = str(entry.get("file_path", "")).strip()
+        if file_path not in requested:
+            logging.warning(f"Ignoring findings for unexpected file {file_path!r} in a packed response")
+            continue
+        findings = processed.setdefault(file_path, [])
+        for vuln in entry["vulnerabilities"]:
+            try:
+                findings.append(validate_vulnerability(vuln, file_path))
+            except Exception as e:
+                logging.error(f"Invalid vulnerability format in {file_path}: {str(e)}")
+    if result.status == "valid":
+        for file_path, findings in processed.items():
+            get_finding_cache().put(requested[file_path], model_name_of(model), PACKED_PROMPT_VERSION, file_path, findings)
+    return processed
+
+
+def scan_pack(repo: git.Repo, pack: list, repo_name: str, model=None) -> list:
+    """
+    First pass for a pack of small files in one request; files the response does not cover,
+    or all of them when it cannot be parsed, are scanned one by one.
+    :param pack: (file path, relative path, content, blob SHA) per file.
+    :return: [(relative path, vulnerabilities or error), ...].
+    """
+    try:
+        processed = generate_packed_report([(rel, content, blob) for _, rel, content, blob in pack], model=model)
+    except (StructuredOutputError, PromptTooLargeError) as e:
+        logging.warning(f"Packed request for {len(pack)} files failed ({e}); scanning them one by one")
+        processed = {}
+    except Exception as e:
+        logging.error(f"Final error processing a pack of {len(pack)} files: {str(e)}")
+        return [(rel, {"error": f"Failed to analyze: {str(e)}"}) for _, rel, _, _ in pack]
+    missing = [file_path for file_path, rel, _, _ in pack if rel not in processed]
+    if processed and missing:
+        logging.info(f"Packed response left out {len(missing)} of {len(pack)} files; scanning them one by one")
+    return list(processed.items()) + [scan_file(repo, file_path, repo_name, model) for file_path in missing]
+
+
+def plan_packs(repo: git.Repo, repo_name: str, to_scan: list, model=None, results: dict = None, always_pack=()):
+    """
+    Groups small files into packs of up to security_scan.pack_token_budget tokens and pack_max_files files.
+    Small files whose findings are cached are answered right away in results.
+    Files in always_pack (low-risk files, see static triage) are packed up to the whole pack budget.
+    Only files routed to the same model share a pack (see generate_packed_report).
+    :return: (files to scan on their own, packs of (file path, relative path, content, blob SHA)).
+    """
+    max_file_tokens = int(get_setting("security_scan.pack_max_file_tokens", 1000))
+    token_budget = int(get_setting("security_scan.pack_token_budget", 6000))
+    max_files = int(get_setting("security_scan.pack_max_files", 20))
+    if not get_setting("security_scan.pack_small_files", True) or max_files < 2:
+        return list(to_scan), []
+    estimator = get_estimator()
+    singles, small = [], []
+    for file_path in to_scan:
+        file_tokens = token_budget if file_path in always_pack else max_file_tokens
+        try:
+            # Cheap size check first: UTF-8 takes at most 4 bytes per character
+            if os.path.getsize(file_path) > file_tokens * estimator.chars_per_token * 4:
+                singles.append(file_path)
+                continue
+            data = Path(file_path).read_bytes()
+            content = data.decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            singles.append(file_path)
+            continue
+        if estimator.estimate(content) > file_tokens:
+            singles.append(file_path)
+            continue
+        relative_file_path = get_relative_path(repo, file_path, repo_name)
+        blob_sha = git_blob_sha(data)
+        model_name = model_name_of(model) if model is not None else route(
+            FIRST_PASS_STAGE, FIRST_PASS_PROMPT.format(file_path=relative_file_path, file_content=content), MODEL_NAME
+        ).model_name
+        cached = cached_findings(blob_sha, model_name, relative_file_path)
+        if cached is not None and results is not None:
+            results[relative_file_path] = cached
+            continue
+        small.append((model_name, relative_file_path, file_path, content, blob_sha, estimator.estimate(content)))
+
+    # Neighbouring files (sorted by path) share a pack, which keeps related code in one prompt.
+    packs, pack, pack_tokens, pack_model = [], [], 0, None
+    for model_name, relative_file_path, file_path, content, blob_sha, tokens in sorted(small, key=lambda item: item[:2]):
+        if pack and (pack_tokens + tokens > token_budget or len(pack) >= max_files or model_name != pack_model):
+            packs.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append((file_path, relative_file_path, content, blob_sha))
+        pack_tokens += tokens
+        pack_model = model_name
+    if pack:
+        packs.append(pack)
+    singles.extend(pack[0][0] for pack in packs if len(pack) == 1)
+    return singles, [pack for pack in packs if len(pack) > 1]
+
+
+def remap_line_numbers(text: str, offset: int) -> str:
+    """
+    Shifts "Line N" / "Lines N-M" references in text by offset lines.
+    """
+    def shift(match):
+        shifted = f"{match.group(1)}{int(match.group(2)) + offset}"
+        if match.group(4):
+            shifted += f"{match.group(3)}{int(match.group(4)) + offset}"
+        return shifted
+    return LINE_REFERENCE.sub(shift, text)
+
+
+def merge_chunk_findings(chunk_findings: list) -> list:
+    """
+    Joins the remapped findings of overlapping chunks (in chunk order), dropping those reported
+    twice for the overlap: same vulnerability name and CWE at the same first line.
+    """
+    merged, seen = [], set()
+    for findings in chunk_findings:
+        for vuln in findings:
+            line = LINE_REFERENCE.search(vuln["location"])
+            key = (vuln["vulnerability_name"].strip().lower(), vuln["cwe_id"], line.group(2) if line else vuln["location"])
+            if key not in seen:
+                seen.add(key)
+                merged.append(vuln)
+    return merged
+
+
+def is_large_file(file_path: Path) -> bool:
+    max_tokens = int(get_setting("security_scan.large_file_tokens", 12000))
+    try:
+        return os.path.getsize(file_path) > max_tokens * get_estimator().chars_per_token
+    except OSError:
+        return False
+
+
+def estimated_chunks(file_path: Path) -> int:
+    chunk_bytes = int(get_setting("security_scan.chunk_max_tokens", 6000)) * get_estimator().chars_per_token
+    return max(1, math.ceil(os.path.getsize(file_path) / chunk_bytes))
+
+
+def large_file_chunks(index: LineIndex) -> list:
+    chunk_tokens = int(get_setting("security_scan.chunk_max_tokens", 6000))
+    return index.chunks(
+        max_lines=int(get_setting("security_scan.chunk_lines", 400)),
+        overlap=int(get_setting("security_scan.chunk_overlap_lines", 40)),
+        max_bytes=int(chunk_tokens * get_estimator().chars_per_token),
+    )
+
+
+def scan_chunk(index: LineIndex, relative_file_path: str, first_line: int, last_line: int, model=None,
+               journal: ScanJournal = None) -> list:
+    """
+    First pass for lines first_line..last_line of a large file, with line numbers remapped to the file.
+    Raises when the chunk could not be analysed.
+    :param journal: journal of the scan; chunks it holds are not requested again, new ones are recorded in it.
+    """
+    content = index.read_lines(first_line, last_line)
+    blob_sha = git_blob_sha(content.encode("utf-8"))
+    journal_key = f"{relative_file_path}:{first_line}-{last_line}"
+    if journal is not None:
+        journaled = journal.get(journal_key, blob_sha)
+        if journaled is not None:
+            return journaled
+    findings = generate_security_report(content, relative_file_path, model=model, blob_sha=blob_sha, excerpt=True)
+    if isinstance(findings, dict):
+        raise ValueError(findings.get("error", "Unexpected response"))
+    findings = [
+        {**vuln, "location": remap_line_numbers(vuln["location"], first_line - 1),
+         "vulnerability_description": remap_line_numbers(vuln["vulnerability_description"], first_line - 1)}
+        for vuln in findings
+    ]
+    if journal is not None:
+        journal.record(journal_key, blob_sha, findings)
+    return findings
+
+
+def scan_large_file(repo: git.Repo, file_path: Path, repo_name: str, model=None, executor=None, journal: ScanJournal = None):
+    """
+    First pass for a file too large for one prompt: overlapping line ranges are read through a memory-mapped
+    line index and scanned (concurrently on executor when given, otherwise one after the other),
+    then merged into one list of findings with file line numbers.
+    Returns (relative path, list of vulnerabilities or an {"error": ...} dict).
+    """
+    relative_file_path = get_relative_path(repo, file_path, repo_name)
+    try:
+        index = LineIndex(file_path)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading file {file_path}: {e}")
+        return relative_file_path, {"error": f"Failed to read file: {e}"}
+    with index:
+        chunks = large_file_chunks(index)
+        logging.info(f"Scanning {relative_file_path} ({index.line_count} lines) in {len(chunks)} chunks")
+        if executor is not None:
+            futures = [executor.submit(scan_chunk, index, relative_file_path, first, last, model, journal) for first, last in chunks]
+            outcomes = [(future.exception(), None) for future in futures]
+            outcomes = [(error, None if error else future.result()) for (error, _), future in zip(outcomes, futures)]
+        else:
+            outcomes = []
+            for first, last in chunks:
+                try:
+                    outcomes.append((None, scan_chunk(index, relative_file_path, first, last, model, journal)))
+                except Exception as e:
+                    outcomes.append((e, None))
+    failed = [(chunk, error) for chunk, (error, _) in zip(chunks, outcomes) if error is not None]
+    if failed:
+        (first, last), error = failed[0]
+        logging.error(f"Final error processing {file_path}: {len(failed)} of {len(chunks)} chunks failed, first at lines {first}-{last}: {error}")
+        # Chunks that succeeded are in the finding cache, so a rescan only pays for the failed ones.
+        return relative_file_path, {"error": f"Failed to analyze lines {first}-{last}: {error}"}
+    return relative_file_path, merge_chunk_findings([findings for _, findings in outcomes])
+
+
+def git_path(repo: git.Repo, file_path: Path) -> str:
+    return Path(file_path).relative_to(Path(repo.working_tree_dir)).as_posix()
+
+
+def head_commit(repo: git.Repo) -> str:
+    try:
+        return repo.head.commit.hexsha
+    except ValueError:
+        # No commits yet
+        return None
+
+
+def renamed_since(repo: git.Repo, commit: str) -> dict:
+    """
+    Files renamed between commit and the working tree, as {new path: old path}; {} when commit is unknown.
+    """
+    try:
+        output = repo.git.diff("--name-status", "-M", "-z", commit, "--")
+    except git.exc.GitCommandError as e:
+        logging.info(f"Cannot diff against {commit}, renames are not followed: {e}")
+        return {}
+    fields = output.split("\0")
+    renames = {}
+    index = 0
+    while index < len(fields) and fields[index]:
+        status = fields[index]
+        if status[0] in "RC":
+            renames[fields[index + 2]] = fields[index + 1]
+            index += 3
+        else:
+            index += 2
+    return renames
+
+
+def plan_incremental_scan(repo: git.Repo, repo_name: str, code_files: list, previous_report: dict, model_name: str):
+    """
+    Splits code_files into those that must be scanned and those whose findings carry over from previous_report.
+    A file carries over when its content hash equals the one recorded for it, or for the path it was renamed
+    from (git diff since the recorded commit), and its previous result was not an error; findings of a renamed
+    file are rewritten to its new path. Nothing carries over when the model or the prompts have changed.
+    Files deleted since are not in code_files and so drop out of the report.
+    :return: (files to scan, {relative path: carried findings}, {relative path: {"path", "blob"}} of every file).
+    """
+    previous_state = (previous_report or {}).get(SCAN_STATE_KEY) or {}
+    previous_files = {entry["path"]: (key, entry["blob"]) for key, entry in previous_state.get("files", {}).items()}
+    if previous_state.get("model") != model_name or previous_state.get("prompt_versions") != SCAN_PROMPT_VERSIONS:
+        previous_files = {}
+    renames = renamed_since(repo, previous_state["commit"]) if previous_files and previous_state.get("commit") else {}
+    to_scan, carried, files = [], {}, {}
+    for file_path in code_files:
         relative_file_path = get_relative_path(repo, file_path, repo_name)
+        path = git_path(repo, file_path)
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                file_content = f.read()
-        except Exception as e:
-            logging.error(f"Error reading file {file_path}: {e}")
-            security_output[relative_file_path] = {"error": f"Failed to read file: {e}"}
+            blob = git_blob_sha_of_file(file_path)
+        except OSError:
+            to_scan.append(file_path)
+            continue
+        files[relative_file_path] = {"path": path, "blob": blob}
+        previous_key, previous_blob = previous_files.get(renames.get(path, path), (None, None))
+        previous_result = previous_report.get(previous_key) if previous_key else None
+        if previous_blob == blob and isinstance(previous_result, list):
+            if previous_key != relative_file_path:
+                previous_result = rewrite_paths(previous_result, previous_key, relative_file_path)
+            carried[relative_file_path] = previous_result
+        else:
+            to_scan.append(file_path)
+    return to_scan, carried, files
+
+
+def load_previous_report(report_path: Path) -> dict:
+    """
+    The report of the previous scan, or None when there is none or it is unreadable.
+    """
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring previous report {report_path}: {e}")
+        return None
+
+
+def report_file_paths(report: dict) -> list:
+    return [key for key in report.keys() if key not in REPORT_METADATA_KEYS]
+
+
+def secret_scan(repo: git.Repo, repo_name: str, to_scan: list, results: dict, triaged: dict = None):
+    """
+    Local credential detection (see app.utils.secret_detector) for config and script files, which are sent to
+    the model mainly to find hard-coded credentials. Their findings are recorded without a request, unless
+    the file holds a high-entropy value the detector cannot classify or static triage flags other risks in it.
+    :param triaged: static triage of to_scan (see triage_scan); files missing from it are triaged here.
+    :return: (files still to scan, {relative path: local findings to merge with the model's for those files},
+        relative paths of the files resolved locally).
+    """
+    if not get_setting("security_scan.secrets.enabled", True) or not to_scan:
+        return to_scan, {}, []
+    extensions = set(get_setting("security_scan.secrets.extensions", [".json", ".sh", ".xml", ".yaml", ".yml"]))
+    remaining, escalated, resolved = [], {}, []
+    for file_path in to_scan:
+        if Path(file_path).suffix.lower() not in extensions:
+            remaining.append(file_path)
             continue
         try:
-            security_report = generate_security_report(file_content, relative_file_path)
-            if security_report == {"vulnerabilities": []}:
-                security_output[relative_file_path] = []
-            elif "error" in security_report and security_report["error"] == "No valid JSON found in response":
-                security_output[relative_file_path] = {"error": "No valid JSON found in response"}
-            elif isinstance(security_report, list):
-                security_output[relative_file_path] = security_report
-                for vuln in security_report:
-                    if "error" in vuln:
-                        continue
-                    level = vuln.get("threat_level", "code quality issue")
-                    threat_summary[level] = threat_summary.get(level, 0) + 1
-            else:
-                security_output[relative_file_path] = security_report
-        except Exception as e:
-            logging.error(f"Final error processing {file_path}: {str(e)}")
-            security_output[relative_file_path] = {"error": f"Failed to analyze: {str(e)}"}
+            detected = scan_secrets(file_path)
+        except OSError as e:
+            logging.info(f"Cannot check {file_path} for secrets: {e}")
+            remaining.append(file_path)
+            continue
+        relative_file_path = get_relative_path(repo, file_path, repo_name)
+        findings = [validate_vulnerability(vuln, relative_file_path) for vuln in detected.findings]
+        triage = (triaged or {}).get(file_path) or triage_file(file_path)
+        other_signals = [rule for rule, _ in triage.signals
+                         if rule not in ("hardcoded_credential", "private_key_block", "not_triaged_large_file")]
+        if detected.needs_review or other_signals:
+            escalated[relative_file_path] = findings
+            remaining.append(file_path)
+        else:
+            results[relative_file_path] = findings
+            resolved.append(relative_file_path)
+    logging.info(f"Secret detection: {len(resolved)} file(s) resolved locally, {len(escalated)} escalated to the model")
+    return remaining, escalated, sorted(resolved)
+
+
+def merge_secret_findings(local_findings: list, report):
+    """
+    Local credential findings followed by the model's, without the model's credential findings on lines
+    the detector already reported.
+    """
+    if not isinstance(report, list):
+        return report
+    local_lines = {line.group(2) for line in (LINE_REFERENCE.search(vuln["location"]) for vuln in local_findings) if line}
+    model_findings = []
+    for vuln in report:
+        line = LINE_REFERENCE.search(vuln.get("location", ""))
+        if vuln.get("cwe_id") == HARDCODED_CREDENTIALS_CWE and line and line.group(2) in local_lines:
+            continue
+        model_findings.append(vuln)
+    return local_findings + model_findings
+
+
+def triage_scan(repo: git.Repo, repo_name: str, to_scan: list, results: dict, triaged: dict = None, escalated=()):
+    """
+    Local static triage of the files to scan (see app.utils.static_triage). Files of a low-risk type without
+    any risk signal are skipped (recorded with no findings) or packed, per security_scan.triage.low_risk_action.
+    :param triaged: triage results already computed for to_scan; files missing from it are triaged here.
+    :param escalated: relative paths secret detection escalated to the model (see secret_scan); never skipped.
+    :return: (files still to scan, low-risk files to pack, relative paths of skipped files, {file path: risk score}).
+    """
+    if not get_setting("security_scan.triage.enabled", True) or not to_scan:
+        return to_scan, set(), [], {}
+    triaged = dict(triaged or {})
+    missing = [file_path for file_path in to_scan if file_path not in triaged]
+    if missing:
+        triaged.update(triage_files(missing))
+    triaged = {file_path: triaged[file_path] for file_path in to_scan}
+    action = get_setting("security_scan.triage.low_risk_action", "skip")
+    low_risk = {file_path for file_path, result in triaged.items() if result.low_risk_type and not result.has_signals
+                and get_relative_path(repo, file_path, repo_name) not in escalated}
+    skipped = []
+    if action == "skip":
+        for file_path in low_risk:
+            relative_file_path = get_relative_path(repo, file_path, repo_name)
+            results[relative_file_path] = []
+            skipped.append(relative_file_path)
+        to_scan = [file_path for file_path in to_scan if file_path not in low_risk]
+        low_risk = set()
+    elif action != "batch":
+        low_risk = set()
+    flagged = sum(1 for result in triaged.values() if result.has_signals)
+    logging.info(f"Static triage: {flagged} of {len(triaged)} files with risk signals, {len(skipped)} low-risk files skipped")
+    return to_scan, low_risk, sorted(skipped), {file_path: result.score for file_path, result in triaged.items()}
+
+
+def resume_from_journal(journal: ScanJournal, repo: git.Repo, repo_name: str, to_scan: list, results: dict, files: dict,
+                        model_name: str) -> list:
+    """
+    Starts or resumes journal for this scan and takes the files it already holds a result for
+    (with unchanged content) out of to_scan.
+    :return: files still to scan.
+    """
+    if not journal.start(repo_name, head_commit(repo), model_name):
+        return to_scan
+    remaining = []
+    for file_path in to_scan:
+        relative_file_path = get_relative_path(repo, file_path, repo_name)
+        journaled = journal.get(relative_file_path, files[relative_file_path]["blob"]) if relative_file_path in files else None
+        if journaled is None:
+            remaining.append(file_path)
+        else:
+            results[relative_file_path] = journaled
+    logging.info(f"Resumed {len(to_scan) - len(remaining)} file(s) from the scan journal")
+    return remaining
+
+
+def scan_code_files(repo: git.Repo, repo_name: str, code_files: list, model=None, workers: int = None, on_progress=None,
+                    previous_report: dict = None, journal: ScanJournal = None) -> dict:
+    """
+    Scans code_files concurrently. Throughput is bounded by the shared rate limiter and daily quota,
+    not by the worker count; workers only keep enough requests in flight to use the available slots.
+    The report lists files sorted by path, whatever order they finish in.
+    :param model: model for every file; None lets the router pick one per file.
+    :param workers: concurrent requests, default security_scan.first_pass_workers.
+    :param on_progress: called as on_progress(done, total, relative_path) from a worker thread as each file finishes.
+    :param previous_report: report of an earlier scan; only files changed since are scanned (see plan_incremental_scan).
+    :param journal: every result is appended to it as it arrives; results it already holds for this repository,
+        commit, model and content are reused, so an interrupted scan continues where it stopped.
+    :return: {relative path: vulnerabilities or error, ..., "threat_summary": counts per level,
+        "scan_state": commit, model, prompt versions and content hash of every file the report was produced from}.
+    """
+    model_name = MODEL_NAME if model is None else model_name_of(model)
+    to_scan, results, files = plan_incremental_scan(repo, repo_name, code_files, previous_report, model_name)
+    if previous_report:
+        logging.info(f"Incremental scan: {len(to_scan)} changed file(s) to scan, {len(results)} carried over")
+    # One static triage of the changed files, shared by secret detection and the triage skip
+    triaged = triage_files(to_scan) if to_scan and get_setting("security_scan.triage.enabled", True) else None
+    to_scan, local_findings, resolved_locally = secret_scan(repo, repo_name, to_scan, results, triaged)
+    to_scan, low_risk, skipped, priority = triage_scan(repo, repo_name, to_scan, results, triaged, escalated=local_findings)
+    resumed = 0
+    if journal is not None:
+        remaining = resume_from_journal(journal, repo, repo_name, to_scan, results, files, model_name)
+        resumed, to_scan = len(to_scan) - len(remaining), remaining
+    chunk_executor = None
+    try:
+        cached_before = len(results)
+        large_files = [file_path for file_path in to_scan if is_large_file(file_path)]
+        singles, packs = plan_packs(repo, repo_name, [f for f in to_scan if f not in large_files], model, results, low_risk)
+        if packs:
+            logging.info(f"Packed {sum(len(pack) for pack in packs)} small files into {len(packs)} requests")
+        pending = len(to_scan) - (len(results) - cached_before)
+        for candidate in candidate_models(FIRST_PASS_STAGE, model_name):
+            planned = len(singles) + len(packs) + sum(estimated_chunks(file_path) for file_path in large_files)
+            get_rate_limiter().check_quota(candidate, planned, get_key_pool().key_ids())
+        workers = max(1, int(workers or get_setting("security_scan.first_pass_workers", 8)))
+        done = 0
+        # Chunks of large files run on their own pool: a file waiting for its chunks must not hold the slot they need.
+        chunk_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="security-scan-chunk") if (
+            large_files and get_setting("security_scan.concurrent_chunks", True)) else None
+        # One work list, files with the most risk signals first, whether they are scanned alone, packed or in chunks
+        work = [(priority.get(file_path, 0), lambda file_path=file_path: [scan_file(repo, file_path, repo_name, model)])
+                for file_path in singles]
+        work += [(max(priority.get(file_path, 0) for file_path, _, _, _ in pack),
+                  lambda pack=pack: scan_pack(repo, pack, repo_name, model)) for pack in packs]
+        work += [(priority.get(file_path, 0),
+                  lambda file_path=file_path: [scan_large_file(repo, file_path, repo_name, model, chunk_executor, journal)])
+                 for file_path in large_files]
+        work.sort(key=lambda item: -item[0])
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="security-scan") as executor:
+            futures = [executor.submit(task) for _, task in work]
+            for future in as_completed(futures):
+                for relative_file_path, report in future.result():
+                    results[relative_file_path] = report
+                    if journal is not None and isinstance(report, list) and relative_file_path in files:
+                        journal.record(relative_file_path, files[relative_file_path]["blob"], report)
+                    done += 1
+                    if on_progress:
+                        on_progress(done, pending, relative_file_path)
+    finally:
+        if chunk_executor is not None:
+            chunk_executor.shutdown()
+        if journal is not None:
+            # Also when the quota check or a request raises, so the journal file is not left open
+            journal.close()
+    for relative_file_path, findings in local_findings.items():
+        if relative_file_path in results:
+            results[relative_file_path] = merge_secret_findings(findings, results[relative_file_path])
+
+    security_output = {}
+    threat_summary = empty_threat_summary()
+    for relative_file_path in sorted(results):
+        report = results[relative_file_path]
+        security_output[relative_file_path] = report
+        if isinstance(report, list):
+            for vuln in report:
+                if "error" in vuln:
+                    continue
+                level = str(vuln.get("threat_level", "code quality issue")).lower()
+                if level not in threat_summary:
+                    level = "code quality issue"
+                threat_summary[level] += 1
     security_output["threat_summary"] = threat_summary
+    security_output[SCAN_STATE_KEY] = {
+        "commit": head_commit(repo),
+        "model": model_name,
+        "prompt_versions": SCAN_PROMPT_VERSIONS,
+        "scanned": len(to_scan),
+        "carried_over": len(code_files) - len(to_scan) - len(skipped) - len(resolved_locally) - resumed,
+        "resumed": resumed,
+        "skipped_by_triage": skipped,
+        "resolved_locally": resolved_locally,
+        "files": {key: files[key] for key in sorted(files)},
+    }
+    return security_output
+
+
+def analyze_security(repo: git.Repo, repo_name: str, previous_report: dict = None, journal: ScanJournal = None) -> dict:
+    code_files = extract_code_files(repo)
+    if not code_files:
+        logging.info("No code-related files detected for security analysis.")
+        print("No code-related files detected for security analysis.")
+        return {}
+    with tqdm(desc="Analyzing security vulnerabilities") as progress:
+        def on_progress(done, total, relative_file_path):
+            progress.total = total
+            progress.update(1)
+        security_output = scan_code_files(
+            repo, repo_name, code_files, on_progress=on_progress, previous_report=previous_report, journal=journal
+        )
     logging.info("Security analysis completed.")
     return security_output
 
@@ -288,13 +994,15 @@ def get_relative_path(repo: git.Repo, file_path: Path, repo_name: str) -> str:
         return str(file_path)
 
 
-def save_json(data: dict, file_path: Path, description: str):
+def save_json(data: dict, file_path: Path, description: str) -> bool:
     try:
         with open(file_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
         logging.info(f"Successfully wrote {description} to {file_path}")
+        return True
     except Exception as e:
         logging.error(f"Error writing to {file_path}: {e}")
+        return False
 
 
 def load_repo_content_to_text(repo: git.Repo, repo_name: str, output_file_path: Path):
@@ -311,11 +1019,18 @@ def load_repo_content_to_text(repo: git.Repo, repo_name: str, output_file_path:
         return None
 
 
-@retry(
-    stop=stop_after_attempt(MAX_RETRIES),
-    wait=wait_exponential(multiplier=1, min=4, max=30),
-    retry=retry_if_exception_type(Exception),
-)
+def split_vulnerability_batch(vulnerability_batch: dict) -> tuple:
+    """
+    Split a batch into two halves by vulnerability count, keeping each file's entries in order.
+    """
+    items = [(file_path, vuln) for file_path, vulns in vulnerability_batch.items() for vuln in vulns]
+    halves = ({}, {})
+    for index, (file_path, vuln) in enumerate(items):
+        half = halves[0] if index < len(items) // 2 else halves[1]
+        half.setdefault(file_path, []).append(vuln)
+    return halves
+
+
 def refine_vulnerability_report_gemini_batch(vulnerability_batch: dict, repo_content: str, uploaded_repo: str, model=None) -> dict:
     """
     Refine a batch of vulnerability reports using the Gemini API.
@@ -355,30 +1070,51 @@ def refine_vulnerability_report_gemini_batch(vulnerability_batch: dict, repo_con
       "cwe_name": (string, same as the input( Correct the CWE name if applicable))
     }}
     
-    Output a JSON dictionary keyed by file paths, where each key's value is a list of refined vulnerability reports.
+    Output a JSON object with a single key "refined_vulnerabilities" whose value is a list of refined reports,
+    each with an additional "file_path" field set to the file path of the input vulnerability.
     Do not include any vulnerabilities that are false positives.
     Provide only the JSON response without any markdown formatting or additional explanations.
     """
-    global gemini_stats_second
-    start_time = time.time()
     try:
-        model = model or gemini_model
-        response = model.generate_content([uploaded_repo, "\n\n", prompt])
-        elapsed_time = time.time() - start_time
-        gemini_stats_second["num_requests"] += 1
-        gemini_stats_second["total_response_time"] += elapsed_time
-        refinement_report = response.text.strip()
-        logging.debug(f"Batch refinement model response:\n{refinement_report}")
-        refined_data_batch = extract_json(refinement_report)
-        if not refined_data_batch:
-            logging.warning("Could not extract valid JSON from batch refinement response.")
-            return {}
+        # Reference the repository through a provider-side cache when available,
+        # so each batch does not resend the whole snapshot.
+        generation_config = None
+        if model is None:
+            model, generation_config = routed_model(SECOND_PASS_STAGE, [uploaded_repo, prompt], SECOND_PASS_MODEL)
+        context = get_context_cache().bind(model, uploaded_repo)
+        with pipeline_stage(SECOND_PASS_STAGE):
+            result = generate_json(
+                context.model, context.contents(prompt), REFINED_REPORT_SCHEMA,
+                send=send_gemini_request, counted_contents=context.counted_contents(prompt),
+                generation_config=generation_config,
+            )
+        if result.status != "valid":
+            logging.info(f"Batch refinement response was {result.status}")
+        # An empty dict means every vulnerability in the batch was judged a false positive.
+        refined_data_batch = {}
+        for refined in result.data["refined_vulnerabilities"]:
+            file_path = refined["file_path"]
+            refined_data_batch.setdefault(file_path, []).append(validate_vulnerability(refined, file_path))
         return refined_data_batch
+    except StructuredOutputError as e:
+        logging.error(f"Could not extract valid JSON from batch refinement response: {e}")
+        logging.debug(f"Batch refinement model response:\n{e.text}")
+        raise
+    except PromptTooLargeError as e:
+        repository_too_large = get_estimator().estimate([uploaded_repo]) >= e.limit
+        if repository_too_large or sum(len(vulns) for vulns in vulnerability_batch.values()) < 2:
+            logging.error(f"Vulnerability report cannot be refined within the token budget: {e}")
+            raise
+        # Too large to send at once: refine both halves separately and merge the results.
+        logging.info(f"Splitting refinement batch: {e}")
+        merged = {}
+        for half in split_vulnerability_batch(vulnerability_batch):
+            for file_path, refined in refine_vulnerability_report_gemini_batch(half, repo_content, uploaded_repo, model=model).items():
+                merged.setdefault(file_path, []).extend(refined if isinstance(refined, list) else [refined])
+        return merged
     except Exception as e:
-        gemini_stats_second["num_requests"] += 1
-        gemini_stats_second["num_errors"] += 1
         logging.error(f"API Error during batch refinement: {str(e)}")
-        return {}
+        raise
 
 
 def refine_security_report(security_report: dict, repo_content: str, repo_name: str, model=None, uploaded_repo: str = None) -> dict:
@@ -396,8 +1132,11 @@ def refine_security_report(security_report: dict, repo_content: str, repo_name:
         "high": 0,
         "critical": 0,
     }}
-    file_paths = [key for key in security_report.keys() if key != "threat_summary"]
+    file_paths = report_file_paths(security_report)
     valid_levels = ["code quality issue", "low", "medium", "high", "critical"]
+    batch_count = -(-len(file_paths) // BATCH_SIZE)
+    for model_name in candidate_models(SECOND_PASS_STAGE, SECOND_PASS_MODEL if model is None else model_name_of(model)):
+        get_rate_limiter().check_quota(model_name, batch_count, get_key_pool().key_ids())
     # We ignore the first pass reports and solely use the refined reports from the second pass.
     for i in tqdm(range(0, len(file_paths), BATCH_SIZE), desc="Refining Security Report (Batches)"):
         logging.info(f"Starting batch: {i // BATCH_SIZE}")
@@ -423,8 +1162,15 @@ def refine_security_report(security_report: dict, repo_content: str, repo_name:
                 improved_security_output[file_path] = refined_vulnerabilities
         except Exception as e:
             logging.error(f"Exception in refine_security_report loop (batch {i+1}-{min(i+BATCH_SIZE, len(file_paths))}): {e}", exc_info=True)
+            # The batch was not refined: keep the first pass findings, counted like refined ones, and say so.
+            logging.warning(f"Keeping unrefined first pass results for: {', '.join(vulnerability_batch) or 'no files'}")
             for file_path_error in batch_files:
-                improved_security_output[file_path_error] = vulnerability_batch.get(file_path_error, [])
+                if file_path_error not in vulnerability_batch:
+                    continue
+                improved_security_output[file_path_error] = vulnerability_batch[file_path_error]
+                for vuln in vulnerability_batch[file_path_error]:
+                    level = vuln.get("threat_level", "code quality issue")
+                    improved_security_output["threat_summary"][level if level in valid_levels else "code quality issue"] += 1
     logging.info("=== Exiting refine_security_report function ===")
     return improved_security_output
 
@@ -440,8 +1186,6 @@ def main():
         sys.exit(1)
     try:
         configure_genai_api(API_KEY)
-        global gemini_model
-        gemini_model = genai.GenerativeModel(MODEL_NAME)
     except Exception as e:
         logging.error(f"Failed to configure Gemini API: {e}")
         sys.exit(1)
@@ -471,34 +1215,27 @@ def main():
 
     analysis_mode = get_analysis_mode()
 
-    security_report = analyze_security(repo, repo_name)
     security_report_path = script_dir / SECURITY_OUTPUT_FILE
-    save_json(security_report, security_report_path, "security vulnerabilities (first pass)")
+    previous_report = load_previous_report(security_report_path) if get_setting("security_scan.incremental", True) else None
+    # Results are journaled as they arrive; rerunning after an interruption continues from the journal.
+    journal = ScanJournal(journal_path(security_report_path)) if get_setting("security_scan.journal", True) else None
+    security_report = analyze_security(repo, repo_name, previous_report, journal)
+    saved = save_json(security_report, security_report_path, "security vulnerabilities (first pass)")
+    if journal is not None and saved:
+        journal.finish()
 
-    if gemini_stats_first["num_requests"] > 0:
-        avg_response_time_first = gemini_stats_first["total_response_time"] / gemini_stats_first["num_requests"]
-    else:
-        avg_response_time_first = 0.0
-    logging.info(f"Gemini First Pass Stats: Requests sent: {gemini_stats_first['num_requests']}, Errors: {gemini_stats_first['num_errors']}, Average response time: {avg_response_time_first:.2f} seconds")
+    logging.info(f"Gemini First Pass Stats: {get_metrics().summary(FIRST_PASS_STAGE)}")
 
     if analysis_mode == "2":
-        try:
-            gemini_model_second = genai.GenerativeModel(SECOND_PASS_MODEL)
-            logging.info(f"Using model '{SECOND_PASS_MODEL}' for second pass refinement.")
-        except Exception as e:
-            logging.error(f"Failed to configure second pass model '{SECOND_PASS_MODEL}': {e}")
-            sys.exit(1)
-        improved_security_report = refine_security_report(security_report, repo_content, repo_name, model=gemini_model_second, uploaded_repo=uploaded_repo)
+        logging.info(f"Using model '{SECOND_PASS_MODEL}' for second pass refinement.")
+        improved_security_report = refine_security_report(security_report, repo_content, repo_name, uploaded_repo=uploaded_repo)
         improved_security_report_path = script_dir / IMPROVED_SECURITY_OUTPUT_FILE
         save_json(improved_security_report, improved_security_report_path, "improved security vulnerabilities (second pass)")
         logging.info("Security analysis and refinement process completed with two agents.")
-        if gemini_stats_second["num_requests"] > 0:
-            avg_response_time_second = gemini_stats_second["total_response_time"] / gemini_stats_second["num_requests"]
-        else:
-            avg_response_time_second = 0.0
-        logging.info(f"Gemini Second Pass Stats: Requests sent: {gemini_stats_second['num_requests']}, Errors: {gemini_stats_second['num_errors']}, Average response time: {avg_response_time_second:.2f} seconds")
+        logging.info(f"Gemini Second Pass Stats: {get_metrics().summary(SECOND_PASS_STAGE)}")
     else:
         logging.info("Security analysis completed using single-agent approach. Second pass refinement skipped.")
+    get_metrics().export()
 
 
 if __name__ == "__main__":
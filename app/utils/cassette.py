@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from app.utils.llm_settings import get_setting, resolve_path
+from app.utils.upload_registry import get_upload_registry
+
+
+class CassetteMissError(KeyError):
+    """
+    Raised in replay mode when no recording exists for a prompt.
+    """
+
+
+class ReplayResponse:
+    """
+    Minimal stand-in for a provider response: replayed calls only need `.text`.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def _content_key(part):
+    if isinstance(part, str):
+        return part
+    # Uploaded files are identified by content, so a re-upload of the same snapshot replays identically.
+    content_hash = get_upload_registry().content_hash(part)
+    if content_hash:
+        return {"file_sha256": content_hash}
+    return {"file": getattr(part, "display_name", None) or getattr(part, "name", repr(part))}
+
+
+def prompt_hash(model_name: str, contents, generation_config=None) -> str:
+    """
+    Stable hash of a request: model name, prompt parts and generation config.
+    """
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    payload = {
+        "model": (model_name or "").removeprefix("models/"),
+        "contents": [_content_key(part) for part in parts],
+        "config": generation_config,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Prompt/response recordings stored as JSON lines, one file per cassette name.
+    Repeated identical prompts are replayed in recording order; the last answer is reused after that.
+    """
+
+    def __init__(self, directory: Path, name: str = "default"):
+        self.directory = Path(directory)
+        self.name = name
+        self._entries = None
+        self._served = {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"{self.name}.jsonl"
+
+    def record(self, key: str, model_name: str, contents, text: str, latency: float):
+        entry = {
+            "key": key,
+            "model": model_name,
+            "prompt_preview": _preview(contents),
+            "text": text,
+            "latency": round(latency, 3),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if self._entries is not None:
+                self._entries.setdefault(key, []).append(entry)
+
+    def lookup(self, key: str) -> dict:
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError(key)
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            return entries[min(index, len(entries) - 1)]
+
+    def _load(self) -> dict:
+        entries = {}
+        for path in sorted(self.directory.glob("*.jsonl")):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries.setdefault(entry["key"], []).append(entry)
+        logging.info(f"Loaded {sum(len(v) for v in entries.values())} recorded responses from {self.directory}")
+        return entries
+
+
+def _preview(contents, limit: int = 200) -> str:
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    text = " ".join(part if isinstance(part, str) else f"<file {getattr(part, 'name', '?')}>" for part in parts)
+    return " ".join(text.split())[:limit]
+
+
+class RecordingModel:
+    """
+    Wraps a live model and writes every successful generate_content call to the cassette.
+    Other attributes (count_tokens, model_name, ...) are passed through.
+    """
+
+    def __init__(self, model, cassette: Cassette):
+        self._model = model
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def generate_content(self, contents, **kwargs):
+        start = time.monotonic()
+        response = self._model.generate_content(contents, **kwargs)
+        latency = time.monotonic() - start
+        try:
+            text = response.text
+        except Exception:
+            # Blocked or empty responses are not recorded; replay will report a miss for them.
+            return response
+        model_name = self._model.model_name
+        key = prompt_hash(model_name, contents, _config_of(self._model, kwargs))
+        self._cassette.record(key, model_name, contents, text, latency)
+        return response
+
+
+class ReplayModel:
+    """
+    Serves generate_content calls from a cassette, optionally sleeping to simulate latency.
+    """
+
+    def __init__(self, model_name: str, cassette: Cassette, generation_config=None):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self._cassette = cassette
+        self._generation_config = generation_config
+
+    def generate_content(self, contents, **kwargs):
+        key = prompt_hash(self.model_name, contents, kwargs.get("generation_config", self._generation_config))
+        entry = self._cassette.lookup(key)
+        latency = get_setting("backend.replay_latency", 0)
+        delay = entry.get("latency", 0) if latency == "recorded" else float(latency or 0)
+        if delay:
+            time.sleep(delay)
+        return ReplayResponse(entry["text"])
+
+
+def _config_of(model, kwargs):
+    if "generation_config" in kwargs:
+        return kwargs["generation_config"]
+    return getattr(model, "_generation_config", None) or None
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    """
+    Returns the cassette configured in the backend settings.
+    """
+    global _cassette
+    directory = resolve_path(get_setting("backend.cassette_dir", "data/cassettes"))
+    name = get_setting("backend.cassette_name", "default")
+    with _cassette_lock:
+        if _cassette is None or _cassette.directory != directory or _cassette.name != name:
+            _cassette = Cassette(directory, name)
+        return _cassette
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from app.utils.key_pool import KeyPoolExhaustedError
+from app.utils.llm_settings import get_setting
+from app.utils.rate_limiter import QuotaExceededError
+from app.utils.retry_policy import is_transient_error, status_code_of
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without sending a request while the provider's circuit is open.
+    """
+
+    def __init__(self, provider: str, retry_in: float):
+        self.provider = provider
+        self.retry_in = retry_in
+        super().__init__(f"{provider} is failing; requests are paused for another {retry_in:.0f}s")
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """
+    Failures that say the provider (or our access to it) is unhealthy, as opposed to a bad request.
+    """
+    if isinstance(exc, (QuotaExceededError, KeyPoolExhaustedError)):
+        return True
+    return is_transient_error(exc) or status_code_of(exc) in (401, 403, 429)
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent requests to one provider.
+    The circuit opens when, within window_seconds, at least min_requests were sent and failure_rate
+    of them failed; requests are then rejected with CircuitOpenError. After open_seconds a single
+    probe request is let through: success closes the circuit, failure reopens it for twice as long.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.state = CLOSED
+        self._outcomes = deque()   # (time, failed)
+        self._opened_at = 0.0
+        self._open_seconds = 0.0
+        self._probe_in_flight = False
+        self._probe_id = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raises CircuitOpenError unless a request may be sent now.
+        :return: a probe token when the request is the half-open probe, otherwise None; pass it to record.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            retry_in = self._opened_at + self._open_seconds - time.monotonic()
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+                logging.info(f"Circuit for {self.provider} half-open; sending a probe request")
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._probe_id += 1
+                return self._probe_id
+            raise CircuitOpenError(self.provider, max(retry_in, 0))
+
+    def record(self, error: BaseException = None, probe=None):
+        """
+        Records the outcome of a request let through by before_request.
+        :param probe: the token before_request returned. Only the probe's outcome closes or reopens a
+            half-open circuit; a slow request admitted before the circuit opened cannot.
+        """
+        failed = error is not None and is_provider_failure(error)
+        now = time.monotonic()
+        with self._lock:
+            if probe is not None and probe == self._probe_id and self.state == HALF_OPEN and self._probe_in_flight:
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now, min(self._open_seconds * 2, float(get_setting("circuit_breaker.max_open_seconds", 600))))
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    logging.info(f"Circuit for {self.provider} closed; the provider is responding again")
+                return
+            self._outcomes.append((now, failed))
+            window = float(get_setting("circuit_breaker.window_seconds", 60))
+            while self._outcomes and self._outcomes[0][0] < now - window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            if (self.state == CLOSED and len(self._outcomes) >= int(get_setting("circuit_breaker.min_requests", 5))
+                    and failures / len(self._outcomes) >= float(get_setting("circuit_breaker.failure_rate", 0.5))):
+                self._open(now, float(get_setting("circuit_breaker.open_seconds", 30)))
+
+    def _open(self, now: float, seconds: float):
+        self.state = OPEN
+        self._opened_at = now
+        self._open_seconds = seconds
+        logging.warning(f"Circuit for {self.provider} opened: requests fail fast for {seconds:.0f}s")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = _breakers[provider] = CircuitBreaker(provider)
+        return breaker
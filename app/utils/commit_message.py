@@ -1,70 +1,67 @@
-import yaml
 import re
 import utils.llm_api as llm_api
+from app.utils.model_router import resolve_model
+from app.utils.prompt_registry import get_prompt_registry
+from app.utils.token_budget import fit_text
+
+GENERAL_PROMPT_KEYS = ("steps", "definition", "guideline", "example_output")
 
 def generate_general_prompt():
     '''
     Since there's prompts of Generation task and Improvement task have a lot in common. This function generate part in common to avoid duplicate
     '''
-    with open("app/prompts/commit_message.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
-
-    steps = prompts_repo["steps"]
-    definition = prompts_repo["definition"]
-    guideline = prompts_repo["guideline"]
-    example_output = prompts_repo["example_output"]
-
-    prompt = (steps + "\n\n" + 
-              definition + "\n\n" + 
-              guideline + "\n\n" + 
-              example_output)
-    
-    return prompt
+    return get_prompt_registry().compose("commit_message", *GENERAL_PROMPT_KEYS)
 
 def generate_CM(code_diff, model):
     '''
     Generate CM from code diff.
+    :param: model: model instance, or model name ("auto" included) routed for the size of the diff.
     '''
-    with open("app/prompts/commit_message.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    registry = get_prompt_registry()
+    prompt_prefix = registry.compose("commit_message", "meta-prompt_generate", *GENERAL_PROMPT_KEYS)
+    prompts_repo = registry.get("commit_message")
 
-    meta_prompt = prompts_repo["meta-prompt_generate"]
-    general_prompt = generate_general_prompt()
     instruction = prompts_repo["instruction_generate"]
     code_diff_instruction = prompts_repo["code_diff"]
+    model, generation_config = resolve_model("commit_message", [prompt_prefix, code_diff_instruction, code_diff, instruction], model)
+    # Large diffs are shortened to fit the model instead of failing after a long wait.
+    code_diff = fit_text(code_diff, model, [prompt_prefix, code_diff_instruction, instruction])
 
-    prompt = (meta_prompt + "\n\n" + 
-              general_prompt + "\n\n"+ 
+    prompt = (prompt_prefix + "\n\n"+ 
               code_diff_instruction + "\n\n" + 
               code_diff + "\n\n" +
               instruction
               )
     
-    raw_result = llm_api.gemini_api(prompt, model)
+    raw_result = llm_api.gemini_api(prompt, model, generation_config=generation_config)
 
     return extract_result(raw_result)
 
-def improve_CM(code_diff, commit_message, model):
+def improve_CM(code_diff, commit_message, model, task=None):
     '''
     Generate CM from code diff and original CM.
+    :param: model: model instance, or model name ("auto" included) routed for the size of the diff.
+    :param: task: set for interactive use so slow requests are hedged (see llm_api.gemini_api).
     '''
-    with open("app/prompts/commit_message.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    registry = get_prompt_registry()
+    prompt_prefix = registry.compose("commit_message", "meta-prompt_improve", *GENERAL_PROMPT_KEYS)
+    prompts_repo = registry.get("commit_message")
 
-    meta_prompt = prompts_repo["meta-prompt_improve"]
-    general_prompt = generate_general_prompt()
     instruction = prompts_repo["instruction_improve"]
     original_CM = prompts_repo["original_CM"]
+    model, generation_config = resolve_model(
+        "commit_message", [prompt_prefix, instruction, code_diff, original_CM, commit_message], model
+    )
+    code_diff = fit_text(code_diff, model, [prompt_prefix, instruction, original_CM, commit_message])
 
-    prompt = (meta_prompt + "\n\n" + 
-              general_prompt + "\n\n"+ 
+    prompt = (prompt_prefix + "\n\n"+ 
               instruction + "\n\n" + 
               code_diff + "\n\n" +
               original_CM + "\n\n" +
               commit_message
               )
     
-    raw_result = llm_api.gemini_api(prompt, model)
+    raw_result = llm_api.gemini_api(prompt, model, task=task, generation_config=generation_config)
 
     return extract_result(raw_result)
 
@@ -0,0 +1,261 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+import google.generativeai as genai
+
+from app.utils import llm_api
+from app.utils.llm_settings import backend_mode
+from app.utils.retry_policy import status_code_of
+from app.utils.upload_registry import get_upload_registry
+
+# Set REPO_SHEPHERD_CONTEXT_CACHE=0 to always attach the repository to each request.
+ENABLE_CONTEXT_CACHING = os.environ.get("REPO_SHEPHERD_CONTEXT_CACHE", "1") != "0"
+CACHE_TTL = timedelta(minutes=30)
+# A cache that expires within this margin is replaced instead of being referenced.
+CACHE_EXPIRY_MARGIN = timedelta(minutes=2)
+# Providers reject caches below a minimum token count; skip the round trip for small snapshots
+# (roughly 32k tokens at ~4 characters per token).
+MIN_CACHE_BYTES = 128 * 1024
+# 400 responses meaning this model or snapshot cannot be cached at all (as opposed to a transient failure).
+CACHING_UNSUPPORTED_PATTERN = re.compile(r"cach|not supported", re.IGNORECASE)
+
+
+def is_caching_unsupported(exc: BaseException) -> bool:
+    return status_code_of(exc) == 400 and bool(CACHING_UNSUPPORTED_PATTERN.search(str(exc)))
+
+
+class GeminiContextBackend:
+    """
+    Provider-side context caching through google.generativeai.caching.
+    """
+
+    def create_cache(self, model_name: str, contents: list, ttl: timedelta):
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_name,
+            display_name="repo-shepherd-context",
+            contents=contents,
+            ttl=ttl,
+        )
+
+    def model_for_cache(self, handle):
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+    def model_for(self, model_name: str):
+        return llm_api.get_model(model_name)
+
+    def expires_at(self, handle) -> datetime:
+        expire_time = getattr(handle, "expire_time", None)
+        if expire_time is not None and expire_time.tzinfo is None:
+            expire_time = expire_time.replace(tzinfo=timezone.utc)
+        return expire_time
+
+    def delete_cache(self, handle):
+        handle.delete()
+
+
+class _PrefixedModel:
+    """
+    Model stand-in that prepends cached contents to every request it sends to the wrapped model.
+    """
+
+    def __init__(self, model, contents):
+        self._model = model
+        self._contents = list(contents)
+        self.model_name = getattr(model, "model_name", None)
+
+    def generate_content(self, contents, **kwargs):
+        if not isinstance(contents, list):
+            contents = [contents]
+        return self._model.generate_content(self._contents + contents, **kwargs)
+
+
+class LocalContextBackend:
+    """
+    Local stand-in for a caching provider, used for offline runs and tests.
+    Handles live in memory and requests are served by models from model_factory
+    with the cached contents prepended, so call sites behave exactly as with Gemini.
+    """
+
+    def __init__(self, model_factory):
+        self._model_factory = model_factory
+        self.handles = {}
+        self._next_id = 0
+
+    def create_cache(self, model_name: str, contents: list, ttl: timedelta):
+        self._next_id += 1
+        handle = {
+            "name": f"cachedContents/local-{self._next_id}",
+            "model_name": model_name,
+            "contents": list(contents),
+            "expire_time": datetime.now(timezone.utc) + ttl,
+        }
+        self.handles[handle["name"]] = handle
+        return handle
+
+    def model_for_cache(self, handle):
+        return _PrefixedModel(self._model_factory(handle["model_name"]), handle["contents"])
+
+    def model_for(self, model_name: str):
+        return self._model_factory(model_name)
+
+    def expires_at(self, handle) -> datetime:
+        return handle["expire_time"]
+
+    def delete_cache(self, handle):
+        self.handles.pop(handle["name"], None)
+
+
+class BoundContext:
+    """
+    A model paired with a repository snapshot.
+    `contents(...)` returns the request parts to send: only the prompt when the snapshot
+    is cached provider-side, otherwise the uploaded file followed by the prompt.
+    """
+
+    def __init__(self, model, context_file, cached: bool):
+        self.model = model
+        self.context_file = context_file
+        self.cached = cached
+
+    def contents(self, *parts) -> list:
+        if self.cached:
+            return list(parts)
+        return [self.context_file, "\n\n", *parts]
+
+    def counted_contents(self, *parts) -> list:
+        """
+        The request as the model sees it, cached snapshot included; used for token budgeting.
+        """
+        return [self.context_file, "\n\n", *parts]
+
+
+class ContextCache:
+    """
+    Creates one cached-content handle per (model, snapshot) and hands out models bound to it.
+    Providers or models without caching support fall back to attaching the file inline.
+    """
+
+    def __init__(self, backend=None, ttl: timedelta = CACHE_TTL, enabled: bool = ENABLE_CONTEXT_CACHING):
+        self.backend = backend or GeminiContextBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+        self._handles = {}      # (model_name, snapshot key) -> handle
+        self._unsupported = set()
+        self._pending = {}      # (model_name, snapshot key) -> Future of the handle being created
+        self._lock = threading.Lock()
+
+    def bind(self, model, context_file, create: bool = True) -> BoundContext:
+        """
+        :param model: model instance or model name
+        :param context_file: uploaded repository snapshot
+        :param create: False only reuses a cache that already exists for the model and otherwise attaches
+            the file inline, e.g. for a one-off hedge request that should not pay for a second cache.
+        """
+        model_name = model if isinstance(model, str) else getattr(model, "model_name", None)
+        fallback_model = self.backend.model_for(model) if isinstance(model, str) else model
+
+        # Recorded sessions attach the snapshot inline so record and replay send identical prompts.
+        # Local inference servers have no provider-side cache.
+        caching_possible = self.enabled and backend_mode() == "live" and llm_api.provider_of(model_name) == "gemini"
+        if not caching_possible or not model_name or not self._worth_caching(context_file):
+            return BoundContext(fallback_model, context_file, cached=False)
+
+        key = (model_name, self._snapshot_key(context_file))
+        stale, creating, pending = None, False, None
+        with self._lock:
+            if key in self._unsupported:
+                return BoundContext(fallback_model, context_file, cached=False)
+            handle = self._handles.get(key)
+            if handle is not None and not self._is_fresh(handle):
+                stale, handle = self._handles.pop(key), None
+            if handle is None and create:
+                # One thread creates the cache; the others binding the same snapshot wait for its result.
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = Future()
+                    creating = True
+        if stale is not None:
+            self._delete(stale)
+        if handle is None:
+            if pending is None:
+                return BoundContext(fallback_model, context_file, cached=False)
+            handle = self._create(key, context_file, pending) if creating else pending.result()
+            if handle is None:
+                return BoundContext(fallback_model, context_file, cached=False)
+        return BoundContext(self.backend.model_for_cache(handle), context_file, cached=True)
+
+    def _create(self, key: tuple, context_file, pending: Future):
+        """
+        Creates the cache for key outside the lock and publishes it to the threads waiting on pending.
+        Returns None when it could not be created; only a permanent refusal disables caching for the snapshot.
+        """
+        model_name = key[0]
+        handle, unsupported = None, False
+        try:
+            handle = self.backend.create_cache(model_name, [context_file], self.ttl)
+            logging.info(f"Created context cache for {model_name}")
+        except Exception as e:
+            unsupported = is_caching_unsupported(e)
+            reason = "unavailable" if unsupported else "failed for this request"
+            logging.info(f"Context caching {reason} for {model_name}, attaching file inline: {e}")
+        with self._lock:
+            if handle is not None:
+                self._handles[key] = handle
+            elif unsupported:
+                self._unsupported.add(key)
+            self._pending.pop(key, None)
+        pending.set_result(handle)
+        return handle
+
+    def clear(self):
+        """
+        Deletes every cache created by this instance.
+        """
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self._unsupported.clear()
+        for handle in handles:
+            self._delete(handle)
+
+    def _is_fresh(self, handle) -> bool:
+        expires_at = self.backend.expires_at(handle)
+        return expires_at is None or datetime.now(timezone.utc) + CACHE_EXPIRY_MARGIN < expires_at
+
+    def _delete(self, handle):
+        try:
+            self.backend.delete_cache(handle)
+        except Exception as e:
+            logging.warning(f"Failed to delete context cache: {e}")
+
+    @staticmethod
+    def _snapshot_key(context_file) -> str:
+        return get_upload_registry().content_hash(context_file) or getattr(context_file, "name", str(id(context_file)))
+
+    @staticmethod
+    def _worth_caching(context_file) -> bool:
+        local_path = get_upload_registry().local_path(context_file)
+        try:
+            return local_path is None or os.path.getsize(local_path) >= MIN_CACHE_BYTES
+        except OSError:
+            return True
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache() -> ContextCache:
+    """
+    Returns the process-wide context cache.
+    """
+    global _context_cache
+    with _context_cache_lock:
+        if _context_cache is None:
+            _context_cache = ContextCache()
+        return _context_cache
@@ -1,8 +1,9 @@
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import yaml
 import utils.llm_api as llm_api
+from app.utils.model_router import resolve_model
+from app.utils.prompt_registry import get_prompt_registry
 
 def convert_repo_to_txt():
     pass
@@ -15,8 +16,7 @@ def create_part(part_name, info, file_tree, model):
     btw, it seems that parameter can be improved. This will be done once UI is designed.
     :return: improved section
     '''
-    with open("app/prompts/creation_prompt.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    prompts_repo = get_prompt_registry().get("creation_prompt")
 
     meta_prompt = prompts_repo["meta-prompt"]
     output_prompt = prompts_repo["output-meta"]
@@ -34,8 +34,9 @@ def create_part(part_name, info, file_tree, model):
         + file_tree_prompt + "\n\n"
         + output_prompt + "\n\n"
     )
+    model, generation_config = resolve_model("readme_section", prompt, model)
     # During development I use together_ai since it's faster.
-    result = llm_api.gemini_api(prompt, model)
+    result = llm_api.gemini_api(prompt, model, generation_config=generation_config)
 
     # add section name if LLM misses it.
     if not result.startswith("##") and not part_name == "title":
@@ -44,8 +45,7 @@ def create_part(part_name, info, file_tree, model):
     return result
 
 def create_feature(existed_feature, file_tree, model):
-    with open("app/prompts/creation_prompt.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    prompts_repo = get_prompt_registry().get("creation_prompt")
     features = [entry for entry in existed_feature if entry.strip()]
     
     if file_tree:
@@ -58,17 +58,18 @@ def create_feature(existed_feature, file_tree, model):
     output_format = "You should only return feature and its description without any other sentences."
 
     prompt = meta_prompt + feature_prompt + str(features) + "\n\n" + file_tree_prompt + "\n\n" + output_format
-    result = llm_api.gemini_api(prompt, model)
+    model, generation_config = resolve_model("readme_section", prompt, model)
+    result = llm_api.gemini_api(prompt, model, generation_config=generation_config)
     return result
 
 
 def structure_markdown(ordered_text, model):
-    with open("app/prompts/creation_prompt.yaml", 'r') as file:
-        prompts_repo = yaml.safe_load(file)
+    prompts_repo = get_prompt_registry().get("creation_prompt")
 
     instruction = prompts_repo["structure"]
     prompt = instruction + "\n\n" + ordered_text
 
-    result = llm_api.gemini_api(prompt, model)
+    model, generation_config = resolve_model("readme_section", prompt, model)
+    result = llm_api.gemini_api(prompt, model, generation_config=generation_config)
     return result
     
\ No newline at end of file
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.utils.llm_settings import backend_mode, get_setting, resolve_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS findings (
+    blob_sha TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    findings TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (blob_sha, model, prompt_version)
+);
+"""
+# Seconds a process waits for another one holding the database lock.
+LOCK_TIMEOUT_SECONDS = 30
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def git_blob_sha(data: bytes) -> str:
+    """
+    Object id git gives this content (`git hash-object`), also for files that are not committed.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def git_blob_sha_of_file(file_path) -> str:
+    """
+    git_blob_sha of a file's content, hashed in chunks so large files are never loaded at once.
+    """
+    digest = hashlib.sha1(b"blob %d\0" % os.path.getsize(file_path))
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_version(*parts) -> str:
+    """
+    Fingerprint of a prompt template and response schema; changing either invalidates cached findings.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def rewrite_paths(value, old_path: str, new_path: str):
+    """
+    Replaces old_path by new_path in every string of a cached finding.
+    """
+    if isinstance(value, str):
+        return value.replace(old_path, new_path)
+    if isinstance(value, list):
+        return [rewrite_paths(item, old_path, new_path) for item in value]
+    if isinstance(value, dict):
+        return {key: rewrite_paths(item, old_path, new_path) for key, item in value.items()}
+    return value
+
+
+class FindingCache:
+    """
+    Validated first-pass findings per (git blob SHA, model, prompt version), kept in SQLite so that
+    identical file content is analysed once across re-runs, branches, forks and vendored copies.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = resolve_path(db_file or get_setting("finding_cache.db_file", "data/finding_cache.sqlite"))
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads; each thread opens its own.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.db_file, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def enabled(self) -> bool:
+        # Recording and replaying sessions must see every request, so the cache only serves live runs.
+        return bool(get_setting("finding_cache.enabled", True)) and backend_mode() == "live"
+
+    def get(self, blob_sha: str, model: str, version: str, file_path: str) -> list:
+        """
+        Cached findings for this content, with the path they were produced for replaced by file_path; None on a miss.
+        """
+        if not self.enabled():
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT file_path, findings FROM findings WHERE blob_sha = ? AND model = ? AND prompt_version = ?",
+                (blob_sha, model, version),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Finding cache unavailable: {e}")
+            return None
+        if row is None:
+            return None
+        cached_path, findings = row
+        findings = json.loads(findings)
+        return rewrite_paths(findings, cached_path, file_path) if cached_path != file_path else findings
+
+    def put(self, blob_sha: str, model: str, version: str, file_path: str, findings: list):
+        if not self.enabled():
+            return
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO findings (blob_sha, model, prompt_version, file_path, findings, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (blob_sha, model, version, file_path, json.dumps(findings), time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"Could not cache findings for {file_path}: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_finding_cache() -> FindingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FindingCache()
+        return _cache
@@ -0,0 +1,93 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.utils.llm_settings import get_setting
+from app.utils.token_budget import model_name_of
+
+HEDGE_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return _executor
+
+
+def hedge_model_name(task: str, primary_model) -> str:
+    """
+    Model that receives the hedge for task, or None when the task is not hedged.
+    """
+    if not task or not get_setting("hedging.enabled", False):
+        return None
+    if get_setting(f"hedging.slo_seconds.{task}") is None:
+        return None
+    fallback = get_setting("hedging.fallback_model")
+    if not fallback or model_name_of(fallback) == model_name_of(primary_model):
+        return None
+    return fallback
+
+
+def is_valid_response(response) -> bool:
+    """
+    A response counts as valid when it carries non-empty text.
+    Blocked or empty candidates raise on `.text`, which also counts as invalid.
+    """
+    try:
+        return bool(response.text.strip())
+    except Exception:
+        return False
+
+
+def hedged_call(task: str, primary_model, send_primary, send_hedge):
+    """
+    Runs send_primary() and, if it has not returned within the task's latency SLO,
+    sends send_hedge(model_name) to the configured faster model. The first valid response wins.
+    The losing request is cancelled if it has not started yet; one already in flight
+    cannot be interrupted by the synchronous client, so its result is simply discarded.
+    :param task: task name with an entry in hedging.slo_seconds, e.g. "chat".
+    :param primary_model: model (or name) used by send_primary.
+    :param send_primary: zero-argument callable sending the primary request.
+    :param send_hedge: callable taking the hedge model name and sending the same request to it.
+    :return: the winning response.
+    """
+    fallback = hedge_model_name(task, primary_model)
+    if fallback is None:
+        return send_primary()
+
+    slo = float(get_setting(f"hedging.slo_seconds.{task}"))
+    executor = _get_executor()
+    start = time.monotonic()
+    # Run in a copy of the caller's context so metrics keep the caller's pipeline stage.
+    primary = executor.submit(contextvars.copy_context().run, send_primary)
+    done, _ = wait([primary], timeout=slo)
+    if done:
+        return primary.result()
+
+    logging.info(f"{task}: primary request exceeded {slo:.1f}s SLO, hedging with {fallback}")
+    hedge = executor.submit(contextvars.copy_context().run, send_hedge, fallback)
+    pending = {primary, hedge}
+    errors = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                errors.append(future.exception())
+                continue
+            response = future.result()
+            if is_valid_response(response):
+                winner = "hedge" if future is hedge else "primary"
+                logging.info(f"{task}: {winner} response won after {time.monotonic() - start:.1f}s")
+                for loser in pending:
+                    loser.cancel()
+                return response
+            errors.append(ValueError(f"{task}: empty response from {'hedge' if future is hedge else 'primary'} model"))
+    # Neither request produced a usable answer; surface the first failure.
+    raise errors[0]
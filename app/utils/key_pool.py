@@ -0,0 +1,228 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from app.utils.llm_settings import get_setting
+from app.utils.rate_limiter import QuotaExceededError, get_rate_limiter, key_id_of, seconds_until_quota_reset
+from app.utils.retry_policy import server_retry_delay, status_code_of
+
+# A 403 may also concern a single resource (e.g. an uploaded file), so only key errors park a key.
+AUTH_ERROR_NAMES = {"Unauthenticated", "Unauthorized"}
+AUTH_ERROR_PATTERN = re.compile(r"API[_ ]key (?:not valid|invalid|expired)|API_KEY_INVALID|API key .*(?:suspended|revoked)", re.IGNORECASE)
+# Gemini names the exhausted quota in 429 messages, e.g. "GenerateRequestsPerDayPerProjectPerModel".
+DAILY_QUOTA_PATTERN = re.compile(r"PerDay", re.IGNORECASE)
+
+
+class KeyPoolExhaustedError(RuntimeError):
+    """
+    Raised when every key that could serve a request is parked.
+    """
+
+
+_active_key = contextvars.ContextVar("gemini_api_key", default=None)
+
+
+def split_api_keys(api_key: str) -> list:
+    """
+    Keys from a setting that may hold several, separated by commas, semicolons or whitespace.
+    """
+    return [key for key in re.split(r"[,;\s]+", api_key or "") if key]
+
+
+class ApiKey:
+    """
+    One key of the pool with its load and health state.
+    """
+
+    def __init__(self, api_key: str, primary: bool = False):
+        self.api_key = api_key
+        self.key_id = key_id_of(api_key)
+        self.primary = primary
+        self.in_flight = 0
+        self.requests = 0
+        self.parked_until = 0.0
+        self.park_reason = ""
+        self._client = None
+
+    @property
+    def client(self):
+        """
+        Generative client for this key; the primary key uses the globally configured client.
+        """
+        if self.primary:
+            return genai_client.get_default_generative_client()
+        if self._client is None:
+            self._client = glm.GenerativeServiceClient(client_options={"api_key": self.api_key})
+        return self._client
+
+    def is_healthy(self) -> bool:
+        return time.time() >= self.parked_until
+
+    def __repr__(self):
+        return f"ApiKey({self.key_id}{', parked' if not self.is_healthy() else ''})"
+
+
+class KeyLease:
+    """
+    A reserved request slot on a key; returned to the pool with KeyPool.release.
+    """
+
+    def __init__(self, key: ApiKey, model, waited: float):
+        self.key = key
+        self.model = model
+        self.waited = waited
+
+
+class PooledGenerativeModel(genai.GenerativeModel):
+    """
+    GenerativeModel that sends each request with the key the pool chose for it (see KeyPool.use).
+    Outside a pool dispatch it behaves exactly like genai.GenerativeModel.
+    """
+
+    uses_key_pool = True
+
+    @property
+    def _client(self):
+        key = _active_key.get()
+        return key.client if key is not None else genai_client.get_default_generative_client()
+
+    @_client.setter
+    def _client(self, value):
+        # GenerativeModel caches its client; here it is chosen per request instead.
+        pass
+
+
+class KeyPool:
+    """
+    Spreads Gemini requests over several API keys.
+    Each key has its own slots in the shared rate limiter and ledger. Requests go to the healthy key
+    with the shortest limiter backlog (then the fewest requests in flight); keys that fail authentication
+    or run out of daily quota are parked and skipped until they are usable again.
+    Requests referencing uploaded files or cached contents stay on the primary key, whose project owns them.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def configure(self, api_keys: list):
+        """
+        Sets the keys of the pool. The first key is the primary key passed to genai.configure.
+        Extra keys come from the GEMINI_API_KEYS environment variable.
+        """
+        api_keys = list(dict.fromkeys([*api_keys, *split_api_keys(os.environ.get("GEMINI_API_KEYS", ""))]))
+        with self._lock:
+            # Keys that stay in the pool keep their load and health state.
+            existing = {(key.api_key, key.primary): key for key in self._keys}
+            self._keys = [existing.get((key, index == 0)) or ApiKey(key, primary=index == 0)
+                          for index, key in enumerate(api_keys)]
+        if len(api_keys) > 1:
+            logging.info(f"Gemini key pool configured with {len(api_keys)} keys")
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._keys)
+
+    def key_ids(self) -> list:
+        """
+        Ids of the healthy keys, for quota checks over the whole pool.
+        """
+        return [key.key_id for key in self.keys() if key.is_healthy()] or None
+
+    def _candidates(self, pooled: bool) -> list:
+        keys = self.keys()
+        if not pooled:
+            keys = [key for key in keys if key.primary]
+        return [key for key in keys if key.is_healthy()]
+
+    def reserve(self, model, pooled: bool = True) -> KeyLease:
+        """
+        Picks a key for one request and reserves a rate-limiter slot on it, waiting until the slot is due.
+        Keys whose daily quota turns out to be spent are parked and the next one is tried.
+        :param pooled: False pins the request to the primary key.
+        """
+        limiter = get_rate_limiter()
+        if not self.keys():
+            # No key configured through configure_genai_api: the limiter's default key applies.
+            return KeyLease(None, model, limiter.acquire(model))
+        last_error = None
+        while True:
+            candidates = self._candidates(pooled)
+            if not candidates:
+                reasons = "; ".join(f"{key.key_id}: {key.park_reason}" for key in self.keys())
+                raise last_error or KeyPoolExhaustedError(f"Every usable Gemini API key is parked ({reasons})")
+            with self._lock:
+                key = min(candidates, key=lambda k: (round(limiter.pending_wait(model, k.key_id), 1), k.in_flight, k.requests))
+                key.in_flight += 1
+                key.requests += 1
+            try:
+                waited = limiter.acquire(model, key.key_id)
+            except QuotaExceededError as e:
+                self._release_slot(key)
+                self.park(key, seconds_until_quota_reset(), "daily quota spent")
+                last_error = e
+                continue
+            except BaseException:
+                self._release_slot(key)
+                raise
+            return KeyLease(key, model, waited)
+
+    def release(self, lease: KeyLease, error: BaseException = None):
+        """
+        Returns a lease after its request; a failure parks the key or delays its next request.
+        """
+        if lease.key is None:
+            if error is not None and status_code_of(error) == 429:
+                get_rate_limiter().penalize(lease.model, server_retry_delay(error))
+            return
+        self._release_slot(lease.key)
+        if error is None:
+            return
+        status = status_code_of(error)
+        if status == 401 or any(cls.__name__ in AUTH_ERROR_NAMES for cls in type(error).__mro__) \
+                or AUTH_ERROR_PATTERN.search(str(error)):
+            self.park(lease.key, float(get_setting("key_pool.auth_park_seconds", 3600)), f"authentication failed: {error}")
+        elif status == 429:
+            delay = server_retry_delay(error)
+            if DAILY_QUOTA_PATTERN.search(str(error)):
+                self.park(lease.key, seconds_until_quota_reset(), "daily quota spent")
+            elif delay is not None and delay > float(get_setting("retry.max_server_delay_seconds", 90)):
+                self.park(lease.key, delay, f"rate limited for {delay:.0f}s")
+            else:
+                get_rate_limiter().penalize(lease.model, delay, lease.key.key_id)
+
+    def park(self, key: ApiKey, seconds: float, reason: str):
+        with self._lock:
+            key.parked_until = max(key.parked_until, time.time() + seconds)
+            key.park_reason = reason
+        logging.warning(f"Parking Gemini API key {key.key_id} for {seconds / 60:.0f} min: {reason}")
+
+    def _release_slot(self, key: ApiKey):
+        with self._lock:
+            key.in_flight -= 1
+
+    @contextmanager
+    def use(self, lease: KeyLease):
+        """
+        Sends requests made inside the block (by PooledGenerativeModel) with the leased key.
+        """
+        token = _active_key.set(lease.key if lease is not None else None)
+        try:
+            yield
+        finally:
+            _active_key.reset(token)
+
+
+_key_pool = KeyPool()
+
+
+def get_key_pool() -> KeyPool:
+    return _key_pool
@@ -0,0 +1,78 @@
+import mmap
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+
+class LineIndex:
+    """
+    Byte offsets of the lines of a memory-mapped file, so line ranges can be read without
+    loading the whole file. Lines are numbered from 1, like editors and scanner findings.
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = Path(file_path)
+        self._file = open(self.file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._file.close()
+            raise
+        self.size = len(self._map)
+        self._offsets = array("q", [0])
+        position = self._map.find(b"\n")
+        while position != -1:
+            self._offsets.append(position + 1)
+            position = self._map.find(b"\n", position + 1)
+        if self._offsets[-1] == self.size and len(self._offsets) > 1:
+            # Final newline: no empty last line
+            self._offsets.pop()
+
+    @property
+    def line_count(self) -> int:
+        return len(self._offsets)
+
+    def _end_offset(self, line: int) -> int:
+        return self._offsets[line] if line < len(self._offsets) else self.size
+
+    def byte_range(self, first_line: int, last_line: int) -> tuple:
+        return self._offsets[first_line - 1], self._end_offset(last_line)
+
+    def read_lines(self, first_line: int, last_line: int) -> str:
+        """
+        Text of lines first_line..last_line (inclusive); undecodable bytes are replaced.
+        """
+        start, end = self.byte_range(first_line, last_line)
+        return self._map[start:end].decode("utf-8", errors="replace")
+
+    def chunks(self, max_lines: int, overlap: int, max_bytes: int = None) -> list:
+        """
+        Overlapping line ranges covering the file, as (first line, last line) pairs.
+        A range ends after max_lines lines or before it would exceed max_bytes (but holds at least one line);
+        the next one starts overlap lines before its end, so findings spanning a boundary are seen whole.
+        The overlap is capped at half a range, so ranges cut short by max_bytes still advance through the file.
+        """
+        ranges = []
+        first = 1
+        while first <= self.line_count:
+            last = min(first + max_lines - 1, self.line_count)
+            if max_bytes and self._end_offset(last) - self._offsets[first - 1] > max_bytes:
+                # The last line ending within max_bytes; line n ends where line n + 1 starts
+                fitting = bisect_right(self._offsets, self._offsets[first - 1] + max_bytes) - 1
+                last = max(first, min(last, fitting))
+            ranges.append((first, last))
+            if last >= self.line_count:
+                break
+            first = max(last - min(overlap, (last - first + 1) // 2) + 1, first + 1)
+        return ranges
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
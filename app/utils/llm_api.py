@@ -1,17 +1,152 @@
+import logging
 import time
 
-def gemini_api(prompt: str, model) -> str:
+from app.utils.cassette import RecordingModel, ReplayModel, get_cassette
+from app.utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from app.utils.hedging import hedged_call
+from app.utils.llm_settings import backend_mode, get_setting
+from app.utils.key_pool import PooledGenerativeModel, get_key_pool
+from app.utils.metrics import current_stage, get_metrics, pipeline_stage
+from app.utils.rate_limiter import get_rate_limiter
+from app.utils.scheduler import get_scheduler
+from app.utils.token_budget import check_budget, model_name_of
+
+LOCAL_PROVIDERS = ("ollama", "openai")
+
+def provider_of(model_name: str) -> str:
+    """
+    Provider of a model name: "ollama:<model>" and "openai:<model>" select a local inference server, anything else is Gemini.
+    """
+    prefix, separator, _ = (model_name or "").partition(":")
+    return prefix if separator and prefix in LOCAL_PROVIDERS else "gemini"
+
+def get_model(model_name: str, **kwargs):
+    """
+    Create the model for model_name according to the configured backend mode.
+    Every call site should use this instead of instantiating genai.GenerativeModel directly.
+    :param model_name: provider model name, optionally prefixed with a local provider (see provider_of).
+    :param kwargs: passed to genai.GenerativeModel (e.g. generation_config).
+    :return: a live, recording or replaying model; all expose generate_content.
+    """
+    mode = backend_mode()
+    if mode == "replay":
+        return ReplayModel(model_name, get_cassette(), kwargs.get("generation_config"))
+    provider = provider_of(model_name)
+    if provider == "gemini":
+        model = PooledGenerativeModel(model_name, **kwargs)
+    else:
+        from app.llm_handler import HandlerModel, get_handler
+        model = HandlerModel(get_handler(provider, model_name.partition(":")[2]), model_name)
+    if mode == "record":
+        return RecordingModel(model, get_cassette())
+    return model
+
+def generate_content(model, contents, counted_contents=None, max_input_tokens=None, **kwargs):
+    """
+    Send a request through the provider layer.
+    The prompt is checked against the model context and the configured token budget first,
+    so requests that can never fit fail immediately with PromptTooLargeError.
+    Gemini requests then queue by priority (see scheduler.current_priority) and are dispatched to a key
+    of the key pool, waiting for its slot in the shared rate limiter and counting against its daily quota
+    (QuotaExceededError once every key's is spent).
+    While the provider's circuit breaker is open, requests fail fast with CircuitOpenError,
+    or go to circuit_breaker.failover_model when one is configured. Requests with counted_contents are bound
+    to a repository snapshot the failover model does not have, so they fail fast instead.
+    :param model: model instance to call.
+    :param contents: prompt string or list of prompt parts.
+    :param counted_contents: parts to count instead of contents, e.g. including a cached repository.
+    :param max_input_tokens: per-call budget overriding the configured one.
+    :return: the provider response.
+    """
+    check_budget(model, counted_contents if counted_contents is not None else contents, max_input_tokens)
+    breaker = get_circuit_breaker(provider_of(model_name_of(model))) if get_setting("circuit_breaker.enabled", True) else None
+    probe = None
+    if breaker is not None:
+        try:
+            probe = breaker.before_request()
+        except CircuitOpenError as e:
+            failover_model = _failover_model(model)
+            if failover_model is None or counted_contents is not None:
+                raise
+            logging.info(f"{e}; sending the request to {failover_model} instead")
+            return generate_content(get_model(failover_model), contents, counted_contents, max_input_tokens, **kwargs)
+    try:
+        response = _send(model, contents, **kwargs)
+    except Exception as e:
+        if breaker is not None:
+            breaker.record(e, probe)
+        raise
+    if breaker is not None:
+        breaker.record(probe=probe)
+    return response
+
+def _send(model, contents, **kwargs):
+    lease = None
+    if _is_rate_limited(model):
+        queued_at = time.monotonic()
+        # Requests take turns for limiter slots by priority, so interactive work is not stuck behind batch work.
+        with get_scheduler().turn(model):
+            lease = get_key_pool().reserve(model, pooled=_can_use_key_pool(model, contents))
+        waited = time.monotonic() - queued_at
+        if waited >= 0.01:
+            get_metrics().record_limiter_wait(waited, model_name_of(model))
+    start = time.monotonic()
+    try:
+        with get_key_pool().use(lease):
+            response = model.generate_content(contents, **kwargs)
+    except Exception as e:
+        get_metrics().record_error(model_name_of(model), e, time.monotonic() - start)
+        if lease is not None:
+            get_key_pool().release(lease, e)
+        raise
+    usage = getattr(response, "usage_metadata", None)
+    if lease is not None:
+        get_key_pool().release(lease)
+        get_rate_limiter().record_usage(
+            model, getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0),
+            lease.key.key_id if lease.key else None,
+        )
+    get_metrics().record_request(
+        model_name_of(model),
+        time.monotonic() - start,
+        input_tokens=getattr(usage, "prompt_token_count", 0),
+        output_tokens=getattr(usage, "candidates_token_count", 0),
+        cache_hit=bool(getattr(usage, "cached_content_token_count", 0)),
+    )
+    return response
+
+def _failover_model(model) -> str:
+    failover_model = get_setting("circuit_breaker.failover_model")
+    if not failover_model or provider_of(failover_model) == provider_of(model_name_of(model)):
+        return None
+    return failover_model
+
+def _is_rate_limited(model) -> bool:
+    # Replayed responses and local inference servers are not subject to provider quotas.
+    return backend_mode() != "replay" and provider_of(model_name_of(model)) == "gemini"
+
+def _can_use_key_pool(model, contents) -> bool:
+    # Uploaded files belong to the primary key's project, so requests referencing them stay there.
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    return bool(getattr(model, "uses_key_pool", False)) and all(isinstance(part, str) for part in parts)
+
+def gemini_api(prompt: str, model, task: str = None, generation_config: dict = None) -> str:
     """
     Get answer via API of gemini.
-    NOTICE: time.sleep(5) is to avoid reach rate limit per minutes, this can be deleted if there's a pro account.
+    Requests are paced by the shared rate limiter (rate_limit in app/config/llm_settings.yaml).
     :param prompt: the given prompt to LLM-gemini.
+    :param task: interactive task name (see hedging.slo_seconds); the request is hedged with a faster model when it misses its SLO.
+    :param generation_config: config of the routed profile (see model_router.resolve_model), sent with the primary request.
     :return: the answer from LLM.
     """
-    response = model.generate_content(prompt)
-    result = response.text.strip()
-    # Request per minute is 15, sleep for 5 seconds can avoid crash.
-    time.sleep(5)
-    return result
+    kwargs = {"generation_config": generation_config} if generation_config else {}
+    with pipeline_stage(task or current_stage()):
+        response = hedged_call(
+            task, model,
+            lambda: generate_content(model, prompt, **kwargs),
+            lambda hedge_model: generate_content(get_model(hedge_model), prompt),
+        )
+    return response.text.strip()
 
 def together_api(prompt: str) -> str:
     from together import Together
@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+from app.utils.prompt_registry import YamlFile
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+SETTINGS_FILE = Path(
+    os.environ.get(
+        "REPO_SHEPHERD_LLM_SETTINGS",
+        Path(__file__).resolve().parent.parent / "config" / "llm_settings.yaml",
+    )
+)
+
+_settings_file = YamlFile(SETTINGS_FILE)
+
+
+def get_settings() -> dict:
+    """
+    Returns the parsed LLM settings, reloaded when the file changes.
+    """
+    return _settings_file.get()
+
+
+def get_setting(path: str, default=None):
+    """
+    Looks up a dotted path such as "token_budget.max_input_tokens".
+    Returns default when any part of the path is missing.
+    """
+    value = get_settings()
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
+
+
+def backend_mode() -> str:
+    """
+    "live", "record" or "replay"; see the backend section of the settings file.
+    """
+    return (os.environ.get("REPO_SHEPHERD_LLM_MODE") or get_setting("backend.mode", "live")).lower()
+
+
+def resolve_path(path) -> Path:
+    """
+    Resolves a path from the settings file; relative paths are taken from the repository root.
+    """
+    path = Path(path)
+    return path if path.is_absolute() else REPO_ROOT / path
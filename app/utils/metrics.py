@@ -0,0 +1,252 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from app.utils.llm_settings import get_setting, resolve_path
+
+# Latency histogram buckets in seconds (Prometheus "le" bounds).
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300)
+# Percentiles are computed over the most recent samples of each series.
+LATENCY_WINDOW = 2048
+PERCENTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "repo_shepherd_llm"
+
+_current_stage = contextvars.ContextVar("llm_pipeline_stage", default="default")
+
+
+@contextmanager
+def pipeline_stage(name: str):
+    """
+    Attributes LLM requests made inside the block (in this thread or context) to the named stage.
+    """
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    return _current_stage.get()
+
+
+class SeriesMetrics:
+    """
+    Counters and latency distribution for one (stage, model) pair.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = Counter()
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_hits = 0
+        self.limiter_wait_seconds = 0.0
+        self.latency_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.recent_latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def observe_latency(self, seconds: float):
+        self.latency_sum += seconds
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.recent_latencies.append(seconds)
+
+    def percentiles(self) -> dict:
+        samples = sorted(self.recent_latencies)
+        if not samples:
+            return {}
+        return {f"p{int(q * 100)}": _percentile(samples, q) for q in PERCENTILES}
+
+    def to_dict(self) -> dict:
+        observed = sum(self.bucket_counts)
+        return {
+            "requests": self.requests,
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_hits": self.cache_hits,
+            "limiter_wait_seconds": round(self.limiter_wait_seconds, 3),
+            "latency_seconds": {
+                "mean": round(self.latency_sum / observed, 3) if observed else None,
+                **{name: round(value, 3) for name, value in self.percentiles().items()},
+            },
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe LLM request metrics keyed by pipeline stage and model,
+    exported periodically as JSON and as a Prometheus textfile.
+    """
+
+    def __init__(self):
+        self._series = {}   # (stage, model) -> SeriesMetrics
+        self._lock = threading.Lock()
+        self._exporter = None
+        self.started_at = time.time()
+
+    def _get(self, stage: str, model: str) -> SeriesMetrics:
+        key = (stage or current_stage(), model or "")
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = SeriesMetrics()
+        return series
+
+    def record_request(self, model: str, latency: float, input_tokens: int = 0, output_tokens: int = 0,
+                       cache_hit: bool = False, stage: str = None):
+        with self._lock:
+            series = self._get(stage, model)
+            series.requests += 1
+            series.observe_latency(latency)
+            series.input_tokens += input_tokens or 0
+            series.output_tokens += output_tokens or 0
+            series.cache_hits += 1 if cache_hit else 0
+        self._ensure_exporter()
+
+    def record_error(self, model: str, error: BaseException, latency: float = None, stage: str = None):
+        with self._lock:
+            series = self._get(stage, model)
+            series.requests += 1
+            series.errors[type(error).__name__] += 1
+            if latency is not None:
+                series.observe_latency(latency)
+        self._ensure_exporter()
+
+    def record_retry(self, model: str = None, stage: str = None):
+        with self._lock:
+            self._get(stage, model).retries += 1
+
+    def record_limiter_wait(self, seconds: float, model: str = None, stage: str = None):
+        with self._lock:
+            self._get(stage, model).limiter_wait_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = [
+                {"stage": stage, "model": model, **metrics.to_dict()}
+                for (stage, model), metrics in sorted(self._series.items())
+            ]
+        return {"started_at": self.started_at, "exported_at": time.time(), "series": series}
+
+    def summary(self, stage: str) -> str:
+        """
+        One log line for a stage, aggregated over its models.
+        """
+        with self._lock:
+            matching = [metrics for (name, _), metrics in self._series.items() if name == stage]
+            requests = sum(m.requests for m in matching)
+            errors = sum(sum(m.errors.values()) for m in matching)
+            retries = sum(m.retries for m in matching)
+            tokens = sum(m.input_tokens + m.output_tokens for m in matching)
+            latencies = sorted(value for m in matching for value in m.recent_latencies)
+        if not latencies:
+            return f"{stage}: Requests sent: {requests}, Errors: {errors}, Retries: {retries}"
+        return (f"{stage}: Requests sent: {requests}, Errors: {errors}, Retries: {retries}, Tokens: {tokens}, "
+                f"Latency p50: {_percentile(latencies, 0.5):.2f}s, p95: {_percentile(latencies, 0.95):.2f}s, "
+                f"p99: {_percentile(latencies, 0.99):.2f}s")
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format (for node_exporter's textfile collector).
+        """
+        counters = [
+            ("requests_total", "LLM requests sent.", lambda m: m.requests),
+            ("retries_total", "Retries of transient LLM errors.", lambda m: m.retries),
+            ("input_tokens_total", "Prompt tokens reported by the provider.", lambda m: m.input_tokens),
+            ("output_tokens_total", "Response tokens reported by the provider.", lambda m: m.output_tokens),
+            ("cache_hits_total", "Requests served from a provider-side context cache.", lambda m: m.cache_hits),
+            ("limiter_wait_seconds_total", "Time spent waiting for the rate limiter.", lambda m: round(m.limiter_wait_seconds, 3)),
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            lines = []
+            for name, help_text, value_of in counters:
+                lines += [f"# HELP {METRIC_PREFIX}_{name} {help_text}", f"# TYPE {METRIC_PREFIX}_{name} counter"]
+                lines += [f"{METRIC_PREFIX}_{name}{_labels(stage, model)} {value_of(m)}" for (stage, model), m in items]
+
+            lines += [f"# HELP {METRIC_PREFIX}_errors_total Failed LLM requests by error class.",
+                      f"# TYPE {METRIC_PREFIX}_errors_total counter"]
+            for (stage, model), m in items:
+                lines += [f"{METRIC_PREFIX}_errors_total{_labels(stage, model, error=error)} {count}"
+                          for error, count in sorted(m.errors.items())]
+
+            lines += [f"# HELP {METRIC_PREFIX}_request_duration_seconds LLM request latency.",
+                      f"# TYPE {METRIC_PREFIX}_request_duration_seconds histogram"]
+            for (stage, model), m in items:
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), m.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{METRIC_PREFIX}_request_duration_seconds_bucket{_labels(stage, model, le=bound)} {cumulative}")
+                lines.append(f"{METRIC_PREFIX}_request_duration_seconds_sum{_labels(stage, model)} {round(m.latency_sum, 3)}")
+                lines.append(f"{METRIC_PREFIX}_request_duration_seconds_count{_labels(stage, model)} {cumulative}")
+
+            lines += [f"# HELP {METRIC_PREFIX}_request_latency_seconds Latency percentiles over recent requests.",
+                      f"# TYPE {METRIC_PREFIX}_request_latency_seconds gauge"]
+            for (stage, model), m in items:
+                samples = sorted(m.recent_latencies)
+                for q in PERCENTILES if samples else ():
+                    lines.append(f"{METRIC_PREFIX}_request_latency_seconds{_labels(stage, model, quantile=q)} {round(_percentile(samples, q), 3)}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """
+        Writes the configured JSON and Prometheus files. Each file is replaced atomically.
+        """
+        json_file = get_setting("metrics.json_file")
+        prometheus_file = get_setting("metrics.prometheus_file")
+        if json_file:
+            _write_atomic(resolve_path(json_file), json.dumps(self.snapshot(), indent=2))
+        if prometheus_file:
+            _write_atomic(resolve_path(prometheus_file), self.to_prometheus())
+
+    def _ensure_exporter(self):
+        if self._exporter is not None or not get_setting("metrics.export_interval_seconds"):
+            return
+        with self._lock:
+            if self._exporter is None:
+                self._exporter = threading.Thread(target=self._export_loop, name="llm-metrics-exporter", daemon=True)
+                self._exporter.start()
+
+    def _export_loop(self):
+        while True:
+            time.sleep(float(get_setting("metrics.export_interval_seconds", 60) or 60))
+            try:
+                self.export()
+            except Exception as e:
+                logging.error(f"Metrics export failed: {e}")
+
+
+def _percentile(sorted_samples: list, q: float) -> float:
+    return sorted_samples[min(int(q * len(sorted_samples)), len(sorted_samples) - 1)]
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(stage: str, model: str, **extra) -> str:
+    labels = {"stage": stage, "model": model, **extra}
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _write_atomic(path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
@@ -0,0 +1,108 @@
+import logging
+
+from google.generativeai import protos
+
+from app.utils.llm_api import get_model
+from app.utils.llm_settings import get_setting
+from app.utils.token_budget import context_window, get_estimator
+
+AUTO_MODEL = "auto"
+DEFAULT_MODEL = "gemini-2.0-flash"
+# thinking_budget is only sent when the installed SDK knows the field.
+THINKING_SUPPORTED = "thinking_config" in protos.GenerationConfig.meta.fields
+
+
+class Route:
+    """
+    The model and generation config chosen for one request.
+    """
+
+    def __init__(self, task: str, profile: str, model_name: str, generation_config: dict):
+        self.task = task
+        self.profile = profile
+        self.model_name = model_name
+        self.generation_config = generation_config or None
+
+    def create_model(self):
+        return get_model(self.model_name)
+
+    def __repr__(self):
+        return f"Route({self.task!r} -> {self.profile}: {self.model_name})"
+
+
+def is_auto(selected_model) -> bool:
+    return not selected_model or str(selected_model).strip().lower() == AUTO_MODEL
+
+
+def _generation_config(profile: dict) -> dict:
+    config = {key: profile[key] for key in ("max_output_tokens", "temperature") if profile.get(key) is not None}
+    if profile.get("thinking_budget") is not None and THINKING_SUPPORTED:
+        config["thinking_config"] = {"thinking_budget": int(profile["thinking_budget"])}
+    return config
+
+
+def _rules(task: str) -> list:
+    rules = get_setting(f"model_routing.tasks.{task}")
+    if rules is None:
+        return [{"profile": get_setting("model_routing.default_profile", "balanced")}]
+    if isinstance(rules, str):
+        return [{"profile": rules}]
+    return rules
+
+
+def route(task: str, contents=None, selected_model: str = None) -> Route:
+    """
+    Picks the model for a task from the model_routing profiles in app/config/llm_settings.yaml.
+    Rules are tried in order; the first whose max_input_tokens covers the prompt, and whose model
+    context window fits it, wins. A selected model other than "auto" always takes precedence.
+    :param task: task name, e.g. "commit_message" or "security_first_pass".
+    :param contents: the prompt (string or parts), used to size the request; optional.
+    :param selected_model: the model chosen in the GUI or on the command line.
+    """
+    if not is_auto(selected_model):
+        return Route(task, "selected", selected_model, None)
+    profiles = get_setting("model_routing.profiles", {}) or {}
+    input_tokens = get_estimator().estimate(contents) if contents is not None else 0
+    rules = _rules(task)
+    for rule in rules:
+        limit = rule.get("max_input_tokens")
+        profile = profiles.get(rule.get("profile"))
+        if profile is None or (limit is not None and input_tokens > limit):
+            continue
+        if input_tokens > context_window(profile["model"]):
+            continue
+        return Route(task, rule["profile"], profile["model"], _generation_config(profile))
+    # Nothing fits: the last rule's profile (or the default model) lets the token budget report the problem.
+    profile_name = rules[-1].get("profile") if rules else None
+    profile = profiles.get(profile_name) or {"model": DEFAULT_MODEL}
+    logging.info(f"No routing rule for {task} fits {input_tokens} input tokens; using {profile['model']}")
+    return Route(task, profile_name or "default", profile["model"], _generation_config(profile))
+
+
+def candidate_models(task: str, selected_model: str = None) -> list:
+    """
+    Every model a task can be routed to, e.g. for checking quotas before batch work.
+    """
+    if not is_auto(selected_model):
+        return [selected_model]
+    profiles = get_setting("model_routing.profiles", {}) or {}
+    models = [profiles[rule["profile"]]["model"] for rule in _rules(task) if rule.get("profile") in profiles]
+    return list(dict.fromkeys(models)) or [DEFAULT_MODEL]
+
+
+def routed_model(task: str, contents=None, selected_model: str = None) -> tuple:
+    """
+    Convenience for call sites that need a model instance: returns (model, generation_config).
+    """
+    selected = route(task, contents, selected_model)
+    return selected.create_model(), selected.generation_config
+
+
+def resolve_model(task: str, contents, model) -> tuple:
+    """
+    (model, generation_config) for one request. A model name, "auto" included, is routed with the actual
+    prompt; a model instance is used as it is.
+    """
+    if model is None or isinstance(model, str):
+        return routed_model(task, contents, model)
+    return model, None
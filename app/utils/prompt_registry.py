@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+import yaml
+
+# Resolved from this file, so prompts load no matter which directory the tools are started from.
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / "prompts"
+
+
+class YamlFile:
+    """
+    A YAML file that is parsed once and re-parsed only when its mtime changes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = {}
+        self.version = ""
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self) -> dict:
+        self.refresh()
+        return self.data
+
+    def refresh(self) -> bool:
+        """
+        Reloads the file if it changed on disk. Returns True when a reload happened.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime is None:
+                raise
+            # Keep serving the last good copy while an editor replaces the file.
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            raw = self.path.read_bytes()
+            self.data = yaml.safe_load(raw) or {}
+            self.version = hashlib.sha256(raw).hexdigest()[:12]
+            self._mtime = mtime
+            logging.info(f"Loaded {self.path.name} (version {self.version})")
+            return True
+
+
+class PromptRegistry:
+    """
+    Loads every prompt file in the prompts directory once and keeps pre-composed prompt prefixes.
+    Files are addressed by their stem, e.g. "commit_message" for commit_message.yaml.
+    """
+
+    def __init__(self, prompts_dir: Path = PROMPTS_DIR):
+        self.prompts_dir = Path(prompts_dir)
+        self._files = {
+            path.stem: YamlFile(path) for path in sorted(self.prompts_dir.glob("*.yaml"))
+        }
+        self._composed = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> dict:
+        """
+        Returns the parsed prompt file, reloading it if it was modified.
+        """
+        try:
+            prompt_file = self._files[name]
+        except KeyError:
+            raise KeyError(f"Unknown prompt file '{name}' in {self.prompts_dir}")
+        return prompt_file.get()
+
+    def version(self, name: str = None) -> str:
+        """
+        Content hash of one prompt file, or of all prompt files when name is None.
+        Meant to be part of cache keys for results produced from these prompts.
+        """
+        if name is not None:
+            self.get(name)
+            return self._files[name].version
+        for key in self._files:
+            self.get(key)
+        combined = "".join(f"{key}:{self._files[key].version}" for key in sorted(self._files))
+        return hashlib.sha256(combined.encode("utf-8")).hexdigest()[:12]
+
+    def compose(self, name: str, *keys: str, separator: str = "\n\n") -> str:
+        """
+        Joins the given prompt entries of one file. The result is memoised per file version.
+        """
+        prompts = self.get(name)
+        cache_key = (name, self._files[name].version, keys, separator)
+        with self._lock:
+            composed = self._composed.get(cache_key)
+            if composed is None:
+                composed = separator.join(prompts[key] for key in keys)
+                # Drop prefixes composed from an older version of this file.
+                for old_key in [k for k in self._composed if k[0] == name and k[1] != cache_key[1]]:
+                    del self._composed[old_key]
+                self._composed[cache_key] = composed
+        return composed
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """
+    Returns the process-wide prompt registry.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = PromptRegistry()
+        return _registry
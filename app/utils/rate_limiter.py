@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.utils.llm_settings import get_setting, resolve_path
+from app.utils.token_budget import model_name_of
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_slots (
+    key_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    next_slot REAL NOT NULL,
+    PRIMARY KEY (key_id, model)
+);
+CREATE TABLE IF NOT EXISTS daily_usage (
+    key_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    day TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key_id, model, day)
+);
+"""
+# Seconds a process waits for another one holding the database lock.
+LOCK_TIMEOUT_SECONDS = 30
+
+
+class QuotaExceededError(RuntimeError):
+    """
+    Raised instead of sending a request when the daily request quota of a model is spent.
+    """
+
+    def __init__(self, model: str, used: int, limit: int, day: str):
+        self.model = model
+        self.used = used
+        self.limit = limit
+        self.day = day
+        super().__init__(f"Daily quota for {model} is spent ({used}/{limit} requests on {day}).")
+
+
+def limit_for(setting: str, model) -> int:
+    """
+    Limit for a model from a settings table keyed by model-name prefix (longest match, "default" otherwise).
+    Returns None when the model is unlimited.
+    """
+    table = get_setting(setting, {}) or {}
+    name = model_name_of(model)
+    matches = [prefix for prefix in table if prefix != "default" and name.startswith(prefix)]
+    value = table[max(matches, key=len)] if matches else table.get("default")
+    return int(value) if value else None
+
+
+def _pacing(per_minute: int) -> tuple:
+    """
+    (seconds between requests, how far ahead of schedule a request may run) for a requests-per-minute limit.
+    """
+    interval = 60.0 / per_minute
+    return interval, (max(int(get_setting("rate_limit.burst", 1)), 1) - 1) * interval
+
+
+def key_id_of(api_key: str) -> str:
+    """
+    Fingerprint identifying an API key in the ledger; the key itself is never stored.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else "default"
+
+
+def _quota_now() -> datetime:
+    return datetime.now(ZoneInfo(get_setting("rate_limit.quota_timezone", "UTC")))
+
+
+def quota_day() -> str:
+    """
+    The current quota day; daily quotas reset at midnight in the configured time zone.
+    """
+    return _quota_now().date().isoformat()
+
+
+def seconds_until_quota_reset() -> float:
+    now = _quota_now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=now.tzinfo)
+    return (midnight - now).total_seconds()
+
+
+class SharedRateLimiter:
+    """
+    Request pacing and a daily request/token ledger per API key and model, kept in SQLite
+    so that every Repo Shepherd process on the host (GUI and scripts) draws from the same limits.
+    Pacing is a generic cell rate algorithm: each request reserves the next free slot,
+    at most `burst` requests run back to back, and 429 responses push the next slot out for everyone.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = resolve_path(db_file or get_setting("rate_limit.db_file", "data/llm_quota.sqlite"))
+        self._key_id = "default"
+        self._local = threading.local()
+
+    def set_api_key(self, api_key: str):
+        """
+        Selects the key whose limits apply when no key_id is passed.
+        """
+        self._key_id = key_id_of(api_key)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads; each thread opens its own.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.db_file, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction holding the database lock, so read-modify-write is atomic across processes.
+        """
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def acquire(self, model, key_id: str = None) -> float:
+        """
+        Reserves a request slot for model, sleeping until it is due.
+        The request is counted against the daily quota when the slot is reserved.
+        :param key_id: key to charge (see key_id_of); the configured key by default.
+        :return: seconds waited.
+        """
+        key_id = key_id or self._key_id
+        name = model_name_of(model)
+        per_minute = limit_for("rate_limit.requests_per_minute", name)
+        per_day = limit_for("rate_limit.requests_per_day", name)
+        day = quota_day()
+        wait = 0.0
+        with self._transaction() as db:
+            if per_day:
+                used = self._usage(db, key_id, name, day)[0]
+                if used >= per_day:
+                    raise QuotaExceededError(name, used, per_day, day)
+            self._add_usage(db, key_id, name, day, requests=1)
+            if per_minute:
+                interval, tolerance = _pacing(per_minute)
+                now = time.time()
+                slot = max(self._next_slot(db, key_id, name) or now, now)
+                wait = max(slot - tolerance - now, 0.0)
+                self._set_next_slot(db, key_id, name, slot + interval)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def pending_wait(self, model, key_id: str = None) -> float:
+        """
+        Seconds the next request for model on this key would wait, without reserving a slot.
+        """
+        per_minute = limit_for("rate_limit.requests_per_minute", model)
+        if not per_minute:
+            return 0.0
+        next_slot = self._next_slot(self._connect(), key_id or self._key_id, model_name_of(model)) or 0
+        return max(next_slot - _pacing(per_minute)[1] - time.time(), 0.0)
+
+    def record_usage(self, model, input_tokens: int = 0, output_tokens: int = 0, key_id: str = None):
+        """
+        Adds the tokens reported for a completed request to today's ledger.
+        """
+        if not input_tokens and not output_tokens:
+            return
+        with self._transaction() as db:
+            self._add_usage(db, key_id or self._key_id, model_name_of(model), quota_day(),
+                            input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def penalize(self, model, delay: float = None, key_id: str = None):
+        """
+        Holds back every process's next request for model after the provider answered 429.
+        :param delay: seconds requested by the server; one pacing interval when unknown.
+        """
+        name = model_name_of(model)
+        per_minute = limit_for("rate_limit.requests_per_minute", name)
+        delay = delay if delay is not None else (60.0 / per_minute if per_minute else 0)
+        if not delay:
+            return
+        tolerance = _pacing(per_minute)[1] if per_minute else 0.0
+        with self._transaction() as db:
+            # The burst allowance is added so that the next request really waits for the full delay.
+            until = time.time() + delay + tolerance
+            if until > (self._next_slot(db, key_id or self._key_id, name) or 0):
+                self._set_next_slot(db, key_id or self._key_id, name, until)
+        logging.info(f"Rate limited on {name}; all processes pause its requests for {delay:.1f}s")
+
+    def remaining(self, model, key_ids: list = None) -> dict:
+        """
+        Today's usage of model and the requests left (None when unlimited).
+        :param key_ids: keys to add up, e.g. every key of a pool; the configured key by default.
+        """
+        name = model_name_of(model)
+        day = quota_day()
+        key_ids = key_ids or [self._key_id]
+        per_day = limit_for("rate_limit.requests_per_day", name)
+        usages = [self._usage(self._connect(), key_id, name, day) for key_id in key_ids]
+        requests, input_tokens, output_tokens = (sum(column) for column in zip(*usages))
+        per_day = per_day * len(key_ids) if per_day else None
+        return {
+            "model": name,
+            "day": day,
+            "requests": requests,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "requests_per_day": per_day,
+            "remaining_requests": max(per_day - requests, 0) if per_day else None,
+        }
+
+    def check_quota(self, model, planned_requests: int, key_ids: list = None) -> bool:
+        """
+        For batch work: True when today's remaining quota covers planned_requests; logs a warning otherwise.
+        """
+        usage = self.remaining(model, key_ids)
+        left = usage["remaining_requests"]
+        if left is None or left >= planned_requests:
+            return True
+        logging.warning(f"Only {left} of {usage['requests_per_day']} daily requests left for {usage['model']}, "
+                        f"but {planned_requests} are planned; the remainder will fail until the quota resets.")
+        return False
+
+    def _usage(self, db, key_id: str, model: str, day: str) -> tuple:
+        row = db.execute(
+            "SELECT requests, input_tokens, output_tokens FROM daily_usage WHERE key_id = ? AND model = ? AND day = ?",
+            (key_id, model, day),
+        ).fetchone()
+        return row or (0, 0, 0)
+
+    def _add_usage(self, db, key_id: str, model: str, day: str, requests: int = 0, input_tokens: int = 0, output_tokens: int = 0):
+        db.execute(
+            "INSERT INTO daily_usage (key_id, model, day, requests, input_tokens, output_tokens) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (key_id, model, day) DO UPDATE SET requests = requests + excluded.requests, "
+            "input_tokens = input_tokens + excluded.input_tokens, output_tokens = output_tokens + excluded.output_tokens",
+            (key_id, model, day, requests, input_tokens or 0, output_tokens or 0),
+        )
+
+    def _next_slot(self, db, key_id: str, model: str) -> float:
+        row = db.execute(
+            "SELECT next_slot FROM request_slots WHERE key_id = ? AND model = ?", (key_id, model)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_next_slot(self, db, key_id: str, model: str, next_slot: float):
+        db.execute(
+            "INSERT INTO request_slots (key_id, model, next_slot) VALUES (?, ?, ?) "
+            "ON CONFLICT (key_id, model) DO UPDATE SET next_slot = excluded.next_slot",
+            (key_id, model, next_slot),
+        )
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> SharedRateLimiter:
+    """
+    Returns the process-wide rate limiter.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = SharedRateLimiter()
+        return _rate_limiter
@@ -0,0 +1,177 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from tenacity import retry, retry_if_exception, stop_after_attempt, stop_any
+
+from app.utils.llm_settings import get_setting
+from app.utils.metrics import get_metrics
+from app.utils.token_budget import PromptTooLargeError, model_name_of
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_EXCEPTION_NAMES = {
+    # google.api_core.exceptions
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted",
+    # requests / urllib3 / httpx
+    "Timeout", "ReadTimeout", "ConnectTimeout", "ConnectionError", "RemoteDisconnected",
+}
+RETRY_DELAY_PATTERN = re.compile(r"retry (?:in|after) (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+def status_code_of(exc) -> int:
+    """
+    HTTP status of a provider error, from google.api_core (`code`) or HTTP client errors (`response.status_code`).
+    """
+    for candidate in (getattr(exc, "code", None), getattr(exc, "status_code", None),
+                      getattr(getattr(exc, "response", None), "status_code", None)):
+        if isinstance(candidate, int):
+            return candidate
+    return None
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    True for failures worth retrying: rate limits, server errors, timeouts and dropped connections.
+    Programming errors, auth failures and invalid or oversized requests are permanent.
+    """
+    if isinstance(exc, PromptTooLargeError):
+        return False
+    status = status_code_of(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_EXCEPTION_NAMES for cls in type(exc).__mro__)
+
+
+def server_retry_delay(exc: BaseException) -> float:
+    """
+    Retry delay requested by the server, in seconds, or None.
+    Reads a Retry-After header, google.rpc.RetryInfo details, or a "retry in Ns" hint in the message.
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After") if hasattr(headers, "get") else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    for detail in getattr(exc, "details", None) or []:
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            try:
+                return float(str(detail["retryDelay"]).rstrip("s"))
+            except ValueError:
+                continue
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+    match = RETRY_DELAY_PATTERN.search(str(exc))
+    return float(match.group(1)) if match else None
+
+
+class RetryBudget:
+    """
+    Process-wide cap on retries: within a sliding window, retries may not exceed
+    min_retries + ratio * requests. Once spent, failures are returned to the caller instead of retried,
+    so a failing batch cannot hold a scan in backoff.
+    """
+
+    def __init__(self, window_seconds: float = None, min_retries: int = None, ratio: float = None):
+        self.window_seconds = window_seconds
+        self.min_retries = min_retries
+        self.ratio = ratio
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        window = self.window_seconds or get_setting("retry.budget_window_seconds", 60)
+        min_retries = self.min_retries if self.min_retries is not None else get_setting("retry.budget_min_retries", 5)
+        ratio = self.ratio if self.ratio is not None else get_setting("retry.budget_ratio", 0.2)
+        now = time.monotonic()
+        with self._lock:
+            for timestamps in (self._requests, self._retries):
+                while timestamps and now - timestamps[0] > window:
+                    timestamps.popleft()
+            if len(self._retries) >= min_retries + ratio * len(self._requests):
+                return False
+            self._retries.append(now)
+            return True
+
+
+_budget = RetryBudget()
+
+
+def get_retry_budget() -> RetryBudget:
+    return _budget
+
+
+def _record_attempt(retry_state):
+    _budget.record_request()
+
+
+def _stop_on_long_server_delay(retry_state) -> bool:
+    delay = server_retry_delay(retry_state.outcome.exception())
+    limit = get_setting("retry.max_server_delay_seconds", 90)
+    if delay is not None and delay > limit:
+        logging.warning(f"Server asked to retry in {delay:.0f}s, above {limit}s; giving up on this request.")
+        return True
+    return False
+
+
+def _stop_when_budget_exhausted(retry_state) -> bool:
+    if _budget.try_acquire():
+        return False
+    logging.warning("Retry budget exhausted; returning the error without retrying.")
+    return True
+
+
+def _stop_after_configured_attempts(retry_state) -> bool:
+    return stop_after_attempt(get_setting("retry.max_attempts", 3))(retry_state)
+
+
+def _wait_server_delay_or_jitter(retry_state) -> float:
+    exc = retry_state.outcome.exception()
+    delay = server_retry_delay(exc)
+    if delay is not None:
+        return delay + random.uniform(0, get_setting("retry.server_delay_jitter_seconds", 2))
+    base = get_setting("retry.base_delay_seconds", 2)
+    cap = get_setting("retry.max_delay_seconds", 30)
+    # Full jitter: uniform over the exponential window.
+    return random.uniform(0, min(cap, base * 2 ** retry_state.attempt_number))
+
+
+def _log_retry(retry_state):
+    exc = retry_state.outcome.exception()
+    # Provider call wrappers take the model as their first argument.
+    model = retry_state.args[0] if retry_state.args else None
+    get_metrics().record_retry(model_name_of(model) if hasattr(model, "model_name") else None)
+    logging.info(
+        f"Transient error in {retry_state.fn.__name__} (attempt {retry_state.attempt_number}): {exc}; "
+        f"retrying in {retry_state.next_action.sleep:.1f}s"
+    )
+
+
+def transient_retry():
+    """
+    Tenacity retry decorator that only retries transient provider errors, waits for the
+    server-provided delay when there is one (with jitter), and draws on the shared retry budget.
+    Permanent errors are raised on the first attempt.
+    """
+    return retry(
+        retry=retry_if_exception(is_transient_error),
+        # Evaluated in order, so the budget is only drawn on when a retry would otherwise happen.
+        stop=stop_any(_stop_after_configured_attempts, _stop_on_long_server_delay, _stop_when_budget_exhausted),
+        wait=_wait_server_delay_or_jitter,
+        before=_record_attempt,
+        before_sleep=_log_retry,
+        reraise=True,
+    )
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+HEADER_TYPE = "header"
+ENTRY_TYPE = "result"
+# Header fields that must match for a journal to be resumed.
+RESUME_KEYS = ("repo", "commit", "model")
+
+
+def journal_path(report_path) -> Path:
+    """
+    Journal of the scan writing report_path, next to it (security_vulnerabilities.journal.jsonl).
+    """
+    report_path = Path(report_path)
+    return report_path.with_name(f"{report_path.stem}.journal.jsonl")
+
+
+def _read_lines(path: Path) -> list:
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The last line of a journal interrupted mid-write
+                    logging.warning(f"Ignoring unreadable line {number} of scan journal {path}")
+    except FileNotFoundError:
+        return []
+    return records
+
+
+def read_journal(path) -> tuple:
+    """
+    Header and number of recorded results of the journal at path; (None, 0) when there is none.
+    """
+    records = _read_lines(Path(path))
+    if not records or records[0].get("type") != HEADER_TYPE:
+        return None, 0
+    return records[0], sum(1 for record in records if record.get("type") == ENTRY_TYPE)
+
+
+class ScanJournal:
+    """
+    Append-only JSONL record of a first-pass scan: a header (repository, commit, model) followed by one line
+    per file or large-file chunk as its result arrives, each flushed to disk before the scan moves on.
+    A scan interrupted by a crash, a network drop or a closed window is resumed from it: results recorded
+    for the same repository, commit and model, and for the same content, are reused instead of requested again.
+    """
+
+    def __init__(self, path, details: dict = None):
+        """
+        :param path: journal file, see journal_path.
+        :param details: extra header fields, e.g. how the GUI opened the repository, so it can offer to resume.
+        """
+        self.path = Path(path)
+        self.details = details or {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start(self, repo_name: str, commit: str, model_name: str) -> int:
+        """
+        Resumes the journal when it belongs to the same repository, commit and model, otherwise starts a new one.
+        :return: number of results recovered.
+        """
+        header = {"type": HEADER_TYPE, "repo": repo_name, "commit": commit, "model": model_name,
+                  "started_at": time.time(), **self.details}
+        records = _read_lines(self.path)
+        resumable = records and records[0].get("type") == HEADER_TYPE and all(
+            records[0].get(key) == header[key] for key in RESUME_KEYS)
+        with self._lock:
+            self._entries = {}
+            if resumable:
+                for record in records[1:]:
+                    if record.get("type") == ENTRY_TYPE:
+                        self._entries[record["key"]] = (record["blob"], record["report"])
+                logging.info(f"Resuming scan of {repo_name} at {commit}: {len(self._entries)} results in {self.path}")
+            else:
+                if records:
+                    logging.info(f"Discarding scan journal {self.path} of another repository, commit or model")
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(header) + "\n")
+            self._file = open(self.path, "a", encoding="utf-8")
+        return len(self._entries)
+
+    def get(self, key: str, blob: str):
+        """
+        Result recorded under key for content with this blob SHA; None when there is none.
+        """
+        with self._lock:
+            recorded_blob, report = self._entries.get(key, (None, None))
+        return report if recorded_blob == blob else None
+
+    def record(self, key: str, blob: str, report):
+        """
+        Appends a result and forces it to disk, so it survives the process being killed right after.
+        """
+        line = json.dumps({"type": ENTRY_TYPE, "key": key, "blob": blob, "report": report}) + "\n"
+        with self._lock:
+            self._entries[key] = (blob, report)
+            if self._file is None:
+                return
+            try:
+                self._file.write(line)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                logging.warning(f"Could not write scan journal {self.path}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        """
+        Removes the journal once the report it was building has been saved.
+        """
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,94 @@
+import contextvars
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+
+from app.utils.llm_settings import get_setting
+from app.utils.metrics import current_stage
+from app.utils.token_budget import model_name_of
+
+# Lower rank is admitted first.
+PRIORITIES = {"interactive": 0, "normal": 1, "background": 2}
+
+_current_priority = contextvars.ContextVar("llm_request_priority", default=None)
+
+
+@contextmanager
+def request_priority(name: str):
+    """
+    Sends LLM requests made inside the block (in this thread or context) with the given priority class.
+    """
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown request priority {name!r}; expected one of {', '.join(PRIORITIES)}")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> str:
+    """
+    Priority class of the current request: set by request_priority, else derived from the pipeline stage.
+    """
+    explicit = _current_priority.get()
+    if explicit:
+        return explicit
+    priority = get_setting(f"scheduling.stage_priorities.{current_stage()}")
+    return priority if priority in PRIORITIES else get_setting("scheduling.default_priority", "normal")
+
+
+class PriorityScheduler:
+    """
+    Admission queue in front of the rate limiter.
+    Requests for a model take turns reserving their limiter slot, highest priority class first
+    (first come, first served within a class). Only the request holding the turn can be waiting
+    for a slot, so an interactive request queues behind at most one reservation instead of every
+    pending batch request, and background work yields whenever anything else is waiting.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiting = {}   # model name -> heap of (rank, sequence number)
+        self._busy = set()   # model names whose turn is taken
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def turn(self, model, priority: str = None):
+        """
+        Blocks until the caller may reserve a slot for model, then holds the turn for the duration of the block.
+        """
+        name = model_name_of(model)
+        entry = (PRIORITIES.get(priority or current_priority(), PRIORITIES["normal"]), next(self._sequence))
+        with self._condition:
+            queue = self._waiting.setdefault(name, [])
+            heapq.heappush(queue, entry)
+            while name in self._busy or queue[0] != entry:
+                self._condition.wait()
+            heapq.heappop(queue)
+            self._busy.add(name)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy.discard(name)
+                self._condition.notify_all()
+
+    def queued(self) -> dict:
+        """
+        Number of waiting requests per model and priority class.
+        """
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        with self._condition:
+            return {
+                model: {names[rank]: sum(1 for r, _ in queue if r == rank) for rank in sorted({r for r, _ in queue})}
+                for model, queue in self._waiting.items() if queue
+            }
+
+
+_scheduler = PriorityScheduler()
+
+
+def get_scheduler() -> PriorityScheduler:
+    return _scheduler
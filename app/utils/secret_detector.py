@@ -0,0 +1,237 @@
+import logging
+import mmap
+import re
+from pathlib import Path
+
+import numpy as np
+
+from app.utils.llm_settings import get_setting
+
+# Files are processed in blocks of this size, cut at a separator so no token spans two blocks.
+BLOCK_BYTES = 8 * 1024 * 1024
+# Runs are scored in groups of this many, bounding the (runs x 256) histogram.
+RUN_GROUP = 8192
+# Unclassified values kept per file; one is enough to escalate it, the rest only go to the log.
+MAX_AMBIGUOUS = 20
+
+CWE_ID = "CWE-798"
+CWE_NAME = "Use of Hard-coded Credentials"
+
+# Known credential formats: (name, threat level, anchors, pattern). Patterns only run on lines containing
+# one of their anchors (lowercase literals found with bytes.find), which keeps the scan at memory speed.
+CREDENTIAL_PATTERNS = [
+    ("AWS Access Key ID", "critical", (b"akia", b"asia"), re.compile(rb"\b(?:AKIA|ASIA)[0-9A-Z]{16}\b")),
+    ("AWS Secret Access Key", "critical", (b"aws",), re.compile(
+        rb"(?i)aws_?secret_?access_?key[\"']?\s*[:=]\s*[\"']?[A-Za-z0-9/+=]{40}")),
+    ("GitHub Token", "critical", (b"ghp_", b"gho_", b"ghu_", b"ghs_", b"ghr_", b"github_pat_"), re.compile(
+        rb"\bgh[pousr]_[A-Za-z0-9]{36,255}\b|\bgithub_pat_[A-Za-z0-9_]{60,}")),
+    ("Google API Key", "high", (b"aiza",), re.compile(rb"\bAIza[0-9A-Za-z_\-]{35}")),
+    ("Slack Token", "high", (b"xox",), re.compile(rb"\bxox[abposr]-[0-9A-Za-z\-]{10,}")),
+    ("Stripe Secret Key", "critical", (b"_live_",), re.compile(rb"\b[rs]k_live_[0-9A-Za-z]{24,}")),
+    ("Private Key", "critical", (b"private key",), re.compile(
+        rb"-----BEGIN (?:RSA |EC |DSA |OPENSSH |PGP )?PRIVATE KEY(?: BLOCK)?-----")),
+    ("JSON Web Token", "medium", (b"eyj",), re.compile(
+        rb"\beyJ[A-Za-z0-9_\-]{10,}\.eyJ[A-Za-z0-9_\-]{10,}\.[A-Za-z0-9_\-]{10,}")),
+    ("Credentials in URL", "high", (b"://",), re.compile(rb"[a-z][a-z0-9+.\-]*://[^\s:/@\"']+:[^\s:/@\"']{3,}@[^\s\"']+")),
+    ("Password", "high", (b"pass", b"pwd", b"secret"), re.compile(
+        rb"(?i)\b(?:password|passwd|pwd|secret|client_secret)\b[\"']?\s*[:=]\s*[\"']([^\"'\s$%{}<>]{6,})[\"']")),
+]
+# Key names that make a high-entropy value a credential rather than, say, a checksum.
+SECRET_CONTEXT = re.compile(rb"(?i)pass|secret|token|api[_-]?key|apikey|access[_-]?key|auth|credential|private|signing")
+# Contexts where long random-looking values are expected.
+BENIGN_CONTEXT = re.compile(rb"(?i)integrity|checksum|sha\d*|md5|hash|digest|fingerprint|uuid|guid|nonce|example|sample|placeholder")
+
+# Byte classes, as bit flags, of the characters that make up candidate tokens ([A-Za-z0-9+/=_-]).
+DIGIT, UPPER, LOWER, HEX = 1, 2, 4, 8
+_classes = np.zeros(256, dtype=np.uint8)
+_classes[np.frombuffer(b"+/=_-", dtype=np.uint8)] = 16
+_classes[ord("0"):ord("9") + 1] = DIGIT | HEX
+_classes[ord("A"):ord("Z") + 1] = UPPER
+_classes[ord("a"):ord("z") + 1] = LOWER
+_classes[np.frombuffer(b"abcdefABCDEF", dtype=np.uint8)] |= HEX
+# bytes.translate table mapping token characters to 1 and everything else to 0.
+TOKEN_TRANSLATION = bytes(1 if value else 0 for value in _classes)
+
+
+class SecretScanResult:
+    """
+    Outcome of scanning one file: findings in the scanner's vulnerability schema, and high-entropy values
+    that could not be classified locally (the file should then also go to the LLM).
+    """
+
+    def __init__(self, file_path: str, findings: list, ambiguous: list):
+        self.file_path = file_path
+        self.findings = findings
+        self.ambiguous = ambiguous   # [(line, redacted value), ...]
+
+    @property
+    def needs_review(self) -> bool:
+        return bool(self.ambiguous)
+
+
+def redact(value: bytes) -> str:
+    text = value.decode("utf-8", errors="replace")
+    return f"{text[:4]}…({len(text)} chars)" if len(text) > 8 else "****"
+
+
+def _run_positions(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Indexes of every byte of the runs [start, start + length), run after run.
+    """
+    first_index = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(int(lengths.sum())) - first_index + np.repeat(starts, lengths)
+
+
+def shannon_entropy(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Shannon entropy in bits per byte of each run data[start:start + length], computed for all runs at once
+    from a (runs x 256) byte histogram.
+    """
+    entropy = np.empty(len(starts), dtype=np.float64)
+    for group in range(0, len(starts), RUN_GROUP):
+        group_starts = starts[group:group + RUN_GROUP]
+        group_lengths = lengths[group:group + RUN_GROUP]
+        run_ids = np.repeat(np.arange(len(group_starts)), group_lengths)
+        values = data[_run_positions(group_starts, group_lengths)]
+        counts = np.bincount(run_ids * 256 + values, minlength=len(group_starts) * 256).reshape(-1, 256)
+        probabilities = counts / group_lengths[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entropy[group:group + RUN_GROUP] = -np.where(counts > 0, probabilities * np.log2(probabilities), 0.0).sum(axis=1)
+    return entropy
+
+
+def high_entropy_runs(block: bytes, min_length: int, max_length: int, hex_threshold: float, base64_threshold: float):
+    """
+    Runs of token characters ([A-Za-z0-9+/=_-]) whose entropy is high for their alphabet.
+    Hex-only runs are held to hex_threshold (at most 4 bits per character) and must mix digits and letters;
+    the others are held to base64_threshold and must mix digits, upper- and lowercase letters, which random
+    keys almost always do and paths, identifiers and prose almost never do.
+    :return: (starts, lengths) of the candidate runs in block.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    mask = np.frombuffer(block.translate(TOKEN_TRANSLATION), dtype=np.bool_)
+    boundaries = np.concatenate(([0], np.flatnonzero(mask[1:] != mask[:-1]) + 1, [len(mask)]))
+    starts, lengths = boundaries[:-1], np.diff(boundaries)
+    keep = mask[starts] & (lengths >= min_length) & (lengths <= max_length)
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(starts):
+        return starts, lengths
+    # Character classes present in every run (OR), and whether all of its characters are hex digits (AND)
+    classes = _classes[data[_run_positions(starts, lengths)]]
+    offsets = np.cumsum(lengths) - lengths
+    present = np.bitwise_or.reduceat(classes, offsets)
+    is_hex = np.bitwise_and.reduceat(classes, offsets) & HEX > 0
+    has_digit = present & DIGIT > 0
+    mixed = np.where(is_hex, has_digit & (present & (UPPER | LOWER) > 0) & (lengths >= 32),
+                     has_digit & (present & UPPER > 0) & (present & LOWER > 0))
+    starts, lengths, is_hex = starts[mixed], lengths[mixed], is_hex[mixed]
+    entropy = shannon_entropy(data, starts, lengths)
+    candidate = np.where(is_hex, entropy >= hex_threshold, entropy >= base64_threshold)
+    return starts[candidate], lengths[candidate]
+
+
+def _blocks(buffer, size: int):
+    """
+    (start, end) blocks of the buffer, each ending just after a separator byte when one is near the end.
+    """
+    start = 0
+    while start < size:
+        end = min(start + BLOCK_BYTES, size)
+        if end < size:
+            separator = max(buffer.rfind(b"\n", start, end), buffer.rfind(b" ", start, end))
+            if separator > start:
+                end = separator + 1
+        yield start, end
+        start = end
+
+
+def _anchored_lines(block: bytes, lowered: bytes, anchors: tuple) -> list:
+    """
+    (start, end) offsets of the distinct lines of block containing any of the anchors.
+    """
+    lines = set()
+    for anchor in anchors:
+        position = lowered.find(anchor)
+        while position != -1:
+            line_start = block.rfind(b"\n", 0, position) + 1
+            line_end = block.find(b"\n", position)
+            lines.add((line_start, len(block) if line_end == -1 else line_end))
+            position = lowered.find(anchor, position + len(anchor))
+    return sorted(lines)
+
+
+def _finding(name: str, level: str, line: int, line_text: bytes, value: bytes, description: str) -> dict:
+    snippet = line_text.replace(value, redact(value).encode("utf-8")).decode("utf-8", errors="replace").strip()
+    return {
+        "vulnerability_name": f"Hard-coded {name}",
+        "vulnerability_description": description,
+        "location": f"Line {line}: {snippet[:160]}",
+        "remediation": "Remove the value from the repository, rotate it, and load it from a secret store or the environment at run time.",
+        "threat_level": level,
+        "cwe_id": CWE_ID,
+        "cwe_name": CWE_NAME,
+    }
+
+
+def scan_secrets(file_path) -> SecretScanResult:
+    """
+    Finds hard-coded credentials in a file: known credential formats, and high-entropy values
+    assigned to credential-like keys. High-entropy values without such context are reported as ambiguous.
+    The file is memory-mapped and processed in blocks, so its size is not limited by memory.
+    """
+    file_path = str(file_path)
+    min_length = int(get_setting("security_scan.secrets.min_length", 20))
+    max_length = int(get_setting("security_scan.secrets.max_length", 256))
+    hex_threshold = float(get_setting("security_scan.secrets.hex_entropy", 3.0))
+    base64_threshold = float(get_setting("security_scan.secrets.base64_entropy", 4.2))
+    findings, ambiguous, reported, reported_lines = [], [], set(), set()
+    with open(file_path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return SecretScanResult(file_path, [], [])
+    with buffer:
+        line_base = 1
+        for start, end in _blocks(buffer, len(buffer)):
+            block = buffer[start:end]
+            data = np.frombuffer(block, dtype=np.uint8)
+            newlines = np.flatnonzero(data == 10)
+
+            def line_of(offset: int):
+                index = int(np.searchsorted(newlines, offset))
+                line_start = newlines[index - 1] + 1 if index else 0
+                line_end = newlines[index] if index < len(newlines) else len(block)
+                return line_base + index, block[line_start:line_end], block[line_start:offset]
+
+            lowered = block.lower()
+            for name, level, anchors, pattern in CREDENTIAL_PATTERNS:
+                for line_start, line_end in _anchored_lines(block, lowered, anchors):
+                    for match in pattern.finditer(block, line_start, line_end):
+                        line, line_text, _ = line_of(match.start())
+                        value = match.group(1) if match.groups() else match.group(0)
+                        if (line, name) in reported or BENIGN_CONTEXT.search(value):
+                            continue
+                        reported.add((line, name))
+                        reported_lines.add(line)
+                        findings.append(_finding(name, level, line, line_text, value,
+                                                 f"A {name.lower()} is stored in plain text in {Path(file_path).name}."))
+
+            starts, lengths = high_entropy_runs(block, min_length, max_length, hex_threshold, base64_threshold)
+            for run_start, length in zip(starts.tolist(), lengths.tolist()):
+                line, line_text, prefix = line_of(run_start)
+                if line in reported_lines:
+                    continue
+                value = block[run_start:run_start + length]
+                if BENIGN_CONTEXT.search(prefix) or BENIGN_CONTEXT.search(value[:8]):
+                    continue
+                if SECRET_CONTEXT.search(prefix):
+                    reported_lines.add(line)
+                    findings.append(_finding("Secret", "high", line, line_text, value,
+                                             "A high-entropy value is assigned to a credential-like key."))
+                elif len(ambiguous) < MAX_AMBIGUOUS:
+                    ambiguous.append((line, redact(value)))
+            line_base += len(newlines)
+    if ambiguous:
+        logging.info(f"{len(ambiguous)} unclassified high-entropy value(s) in {file_path}")
+    return SecretScanResult(file_path, findings, ambiguous)
@@ -0,0 +1,42 @@
+import json
+import logging
+import os
+import threading
+
+from app.utils.llm_settings import get_setting, resolve_path
+
+_lock = threading.Lock()
+
+
+def _session_file():
+    return resolve_path(get_setting("warmup.session_file", "data/session.json"))
+
+
+def load_session() -> dict:
+    """
+    State kept between launches (last repository, recently validated keys). Never holds API keys.
+    """
+    with _lock:
+        try:
+            with open(_session_file(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable session file: {e}")
+            return {}
+
+
+def update_session(**values):
+    """
+    Merges values into the session file, replacing it atomically.
+    """
+    session = load_session()
+    session.update(values)
+    path = _session_file()
+    with _lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(session, f, indent=2)
+        os.replace(temporary, path)
@@ -0,0 +1,192 @@
+import ast
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.utils.llm_settings import get_setting
+
+# Larger files are not parsed; they are scanned in chunks anyway (see the scanner's large-file mode).
+MAX_TRIAGE_BYTES = 4 * 1024 * 1024
+
+SQL_KEYWORDS = re.compile(r"^\s*(select|insert|update|delete|replace|merge|create|drop|alter)\b", re.IGNORECASE)
+
+# Regex rules for every language: (rule, weight, file extensions or None for all, pattern).
+REGEX_RULES = [
+    ("hardcoded_credential", 3, None, re.compile(
+        r"""(?i)\b(?:password|passwd|secret|api[_-]?key|access[_-]?token|auth[_-]?token|private[_-]?key)\b["']?\s*[:=]\s*["'][^"'\s]{8,}["']""")),
+    ("private_key_block", 5, None, re.compile(r"-----BEGIN (?:RSA |EC |DSA |OPENSSH )?PRIVATE KEY-----")),
+    ("tls_verification_disabled", 3, None, re.compile(
+        r"(?i)verify\s*[=:]\s*false|rejectUnauthorized\s*:\s*false|InsecureSkipVerify\s*:\s*true|CURLOPT_SSL_VERIFYPEER\s*,\s*(?:0|false)")),
+    ("sql_concatenation", 3, None, re.compile(
+        r"""(?i)["']\s*(?:select|insert|update|delete)\b[^"'\n]*["']\s*(?:\+|\.|%)\s*\$?\w""")),
+    ("js_eval", 3, {".js", ".ts", ".html"}, re.compile(r"\beval\s*\(|\bnew\s+Function\s*\(|setTimeout\s*\(\s*[\"'`]")),
+    ("js_dom_injection", 2, {".js", ".ts", ".html"}, re.compile(r"\.innerHTML\s*=|\.outerHTML\s*=|document\.write\s*\(|dangerouslySetInnerHTML")),
+    ("js_command_execution", 4, {".js", ".ts"}, re.compile(r"child_process|\bexecSync\s*\(|\bspawn\s*\([^)]*shell\s*:\s*true")),
+    ("php_command_execution", 4, {".php"}, re.compile(r"\b(?:eval|system|exec|shell_exec|passthru|popen|proc_open|assert)\s*\(")),
+    ("php_request_input", 2, {".php"}, re.compile(r"\$_(?:GET|POST|REQUEST|COOKIE|FILES)\b")),
+    ("java_command_execution", 4, {".java", ".kt", ".scala"}, re.compile(r"Runtime\.getRuntime\(\)\.exec|new\s+ProcessBuilder\s*\(")),
+    ("java_deserialization", 3, {".java", ".kt", ".scala"}, re.compile(r"new\s+ObjectInputStream\s*\(|\.readObject\s*\(")),
+    ("c_unsafe_function", 3, {".c", ".cpp"}, re.compile(r"\b(?:gets|strcpy|strcat|sprintf|vsprintf|scanf)\s*\(|\bsystem\s*\(")),
+    ("go_command_execution", 3, {".go"}, re.compile(r"exec\.Command\s*\(|\"unsafe\"")),
+    ("ruby_command_execution", 4, {".rb"}, re.compile(r"\beval\s*\(|\bsystem\s*\(|`[^`]*#\{|\bMarshal\.load|YAML\.load\s*\(")),
+    ("csharp_command_execution", 4, {".cs"}, re.compile(r"Process\.Start\s*\(|BinaryFormatter|SqlCommand\s*\([^)]*\+")),
+    ("rust_unsafe", 2, {".rs"}, re.compile(r"\bunsafe\s*\{|Command::new\s*\(")),
+    ("shell_remote_execution", 4, {".sh", ".bat", ".ps1"}, re.compile(
+        r"(?i)(?:curl|wget)[^|\n]*\|\s*(?:ba|z)?sh\b|\beval\s|Invoke-Expression|\biex\b|chmod\s+(?:-R\s+)?777")),
+    ("xml_external_entity", 3, {".xml"}, re.compile(r"<!ENTITY\s+\S+\s+SYSTEM", re.IGNORECASE)),
+]
+
+# Python calls flagged by the AST rules: (rule, weight) by dotted call name.
+PYTHON_CALL_RULES = {
+    "eval": ("python_eval", 4),
+    "exec": ("python_exec", 4),
+    "os.system": ("python_shell_command", 4),
+    "os.popen": ("python_shell_command", 4),
+    "pickle.loads": ("python_unsafe_deserialization", 4),
+    "pickle.load": ("python_unsafe_deserialization", 4),
+    "cPickle.loads": ("python_unsafe_deserialization", 4),
+    "marshal.loads": ("python_unsafe_deserialization", 3),
+    "shelve.open": ("python_unsafe_deserialization", 2),
+    "tempfile.mktemp": ("python_insecure_tempfile", 2),
+    "hashlib.md5": ("python_weak_hash", 1),
+    "hashlib.sha1": ("python_weak_hash", 1),
+}
+SUBPROCESS_CALLS = {"subprocess.run", "subprocess.call", "subprocess.check_call", "subprocess.check_output", "subprocess.Popen"}
+SAFE_YAML_LOADERS = {"SafeLoader", "CSafeLoader", "BaseLoader"}
+
+
+class TriageResult:
+    """
+    Local risk assessment of one file: a score (sum of rule weights) and the signals behind it.
+    """
+
+    def __init__(self, file_path: str, score: int, signals: list, low_risk_type: bool, parsed: bool = True):
+        self.file_path = file_path
+        self.score = score
+        self.signals = signals   # [(rule, line), ...]
+        self.low_risk_type = low_risk_type
+        self.parsed = parsed
+
+    @property
+    def has_signals(self) -> bool:
+        return bool(self.signals)
+
+    def __repr__(self):
+        return f"TriageResult({self.file_path!r}, score={self.score}, signals={len(self.signals)})"
+
+
+def _call_name(node: ast.AST) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = _call_name(node.value)
+        return f"{parent}.{node.attr}" if parent else node.attr
+    return ""
+
+
+def _is_built_string(node: ast.AST) -> bool:
+    """
+    Strings assembled at run time: f-strings, concatenation, % formatting or str.format.
+    """
+    if isinstance(node, ast.JoinedStr):
+        return any(isinstance(value, ast.FormattedValue) for value in node.values)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        return True
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "format"
+
+
+def _looks_like_sql(node: ast.AST) -> bool:
+    for child in ast.walk(node):
+        if isinstance(child, ast.Constant) and isinstance(child.value, str) and SQL_KEYWORDS.match(child.value):
+            return True
+    return False
+
+
+class PythonRiskVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.signals = []
+
+    def _flag(self, rule: str, weight: int, node: ast.AST):
+        self.signals.append((rule, weight, getattr(node, "lineno", 0)))
+
+    def visit_Call(self, node: ast.Call):
+        name = _call_name(node.func)
+        keywords = {keyword.arg: keyword.value for keyword in node.keywords if keyword.arg}
+        if name in PYTHON_CALL_RULES:
+            self._flag(*PYTHON_CALL_RULES[name], node)
+        if name in SUBPROCESS_CALLS or name.endswith((".run", ".call", ".Popen", ".check_output", ".check_call")):
+            shell = keywords.get("shell")
+            if isinstance(shell, ast.Constant) and shell.value is True:
+                self._flag("python_shell_true", 4, node)
+        if name == "yaml.load" or name.endswith(".yaml.load"):
+            loader = keywords.get("Loader") if "Loader" in keywords else (node.args[1] if len(node.args) > 1 else None)
+            if loader is None or _call_name(loader).split(".")[-1] not in SAFE_YAML_LOADERS:
+                self._flag("python_unsafe_yaml_load", 3, node)
+        verify = keywords.get("verify")
+        if isinstance(verify, ast.Constant) and verify.value is False:
+            self._flag("tls_verification_disabled", 3, node)
+        if name.split(".")[-1] in ("execute", "executemany", "executescript", "raw") and node.args:
+            query = node.args[0]
+            if _is_built_string(query) and _looks_like_sql(query):
+                self._flag("sql_string_building", 4, node)
+        self.generic_visit(node)
+
+
+def _regex_signals(text: str, suffix: str, skip_rules=()) -> list:
+    signals = []
+    for rule, weight, suffixes, pattern in REGEX_RULES:
+        if rule in skip_rules or (suffixes is not None and suffix not in suffixes):
+            continue
+        for match in pattern.finditer(text):
+            signals.append((rule, weight, text.count("\n", 0, match.start()) + 1))
+    return signals
+
+
+def triage_file(file_path) -> TriageResult:
+    """
+    Scores one file with the AST rules (Python) and the regex rules (every language).
+    Runs in a worker process, so it only depends on its argument and the module constants.
+    """
+    file_path = str(file_path)
+    suffix = Path(file_path).suffix.lower()
+    low_risk_type = suffix in set(get_setting("security_scan.triage.low_risk_extensions", [".css", ".json", ".xml", ".yaml", ".yml"]))
+    try:
+        if os.path.getsize(file_path) > MAX_TRIAGE_BYTES:
+            return TriageResult(file_path, 1, [("not_triaged_large_file", 0)], low_risk_type, parsed=False)
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    except OSError as e:
+        logging.info(f"Cannot triage {file_path}: {e}")
+        return TriageResult(file_path, 1, [("unreadable", 0)], low_risk_type, parsed=False)
+
+    signals, parsed = [], True
+    if suffix == ".py":
+        visitor = PythonRiskVisitor()
+        try:
+            visitor.visit(ast.parse(text, filename=file_path))
+            signals.extend(visitor.signals)
+            # The AST rules cover these precisely for Python
+            signals.extend(_regex_signals(text, suffix, skip_rules=("tls_verification_disabled", "sql_concatenation")))
+        except (SyntaxError, ValueError, RecursionError):
+            parsed = False
+            signals.extend(_regex_signals(text, suffix))
+    else:
+        signals.extend(_regex_signals(text, suffix))
+    score = sum(weight for _, weight, _ in signals)
+    return TriageResult(file_path, score, [(rule, line) for rule, _, line in signals], low_risk_type, parsed)
+
+
+def triage_files(file_paths: list, workers: int = None) -> dict:
+    """
+    Triages files on a thread pool (security_scan.triage.workers, default one per CPU), which overlaps
+    reading the files. Worker processes are not used: the GUI entry script would run again in each of them.
+    :return: {file path as given: TriageResult}.
+    """
+    file_paths = list(file_paths)
+    workers = int(workers or get_setting("security_scan.triage.workers", 0) or os.cpu_count() or 1)
+    if workers < 2 or len(file_paths) < 2:
+        return {file_path: triage_file(file_path) for file_path in file_paths}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="triage") as executor:
+        return dict(zip(file_paths, executor.map(triage_file, file_paths)))
@@ -0,0 +1,256 @@
+import json
+import logging
+import re
+import threading
+
+from app.utils.llm_api import generate_content, provider_of
+from app.utils.retry_policy import status_code_of
+from app.utils.token_budget import model_name_of
+
+JSON_MIME_TYPE = "application/json"
+CODE_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+# Provider errors that mean "this model cannot do JSON mode", as opposed to a bad prompt.
+UNSUPPORTED_PATTERN = re.compile(r"json|schema|mime|response_format|\bformat\b", re.IGNORECASE)
+# Local inference servers reject an unknown response_format/format option with a 400 or a 422.
+LOCAL_UNSUPPORTED_STATUS_CODES = {400, 422}
+# Truncated output is repaired by cutting back to a complete element; only the last cut points are tried.
+MAX_REPAIR_CANDIDATES = 200
+
+TYPE_CHECKS = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+}
+
+
+class StructuredOutputError(ValueError):
+    """
+    Raised when a response contains no JSON that can be used, even after repair and salvage.
+    """
+
+    def __init__(self, message: str, text: str = ""):
+        self.text = text
+        super().__init__(message)
+
+
+class StructuredResult:
+    """
+    Parsed response data and how it was obtained: "valid", "repaired" (truncated JSON was closed)
+    or "salvaged" (elements not matching the schema were dropped).
+    `repaired` stays set when truncated JSON was also salvaged, so callers can tell the last element may be incomplete.
+    """
+
+    def __init__(self, data, status: str, errors: list = None, repaired: bool = False):
+        self.data = data
+        self.status = status
+        self.errors = errors or []
+        self.repaired = repaired or status == "repaired"
+
+
+def schema_config(schema: dict) -> dict:
+    """
+    Generation config asking the provider for JSON constrained to schema.
+    """
+    return {"response_mime_type": JSON_MIME_TYPE, "response_schema": schema}
+
+
+def _json_start(text: str) -> int:
+    starts = [index for index in (text.find("{"), text.find("[")) if index != -1]
+    return min(starts) if starts else None
+
+
+def parse_json(text: str):
+    """
+    Parses the first JSON value in text, ignoring code fences and surrounding prose. Returns None on failure.
+    """
+    text = CODE_FENCE_PATTERN.sub("", text or "")
+    start = _json_start(text)
+    if start is None:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value
+    except json.JSONDecodeError:
+        return None
+
+
+def repair_json(text: str):
+    """
+    Recovers truncated JSON by cutting back to the last complete element and closing open brackets.
+    Returns None when nothing complete precedes the cut.
+    """
+    text = CODE_FENCE_PATTERN.sub("", text or "")
+    start = _json_start(text)
+    if start is None:
+        return None
+    stack = []
+    cuts = []   # (end index, closing brackets needed at that point)
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cuts.append((index + 1, "".join(reversed(stack))))
+            if not stack:
+                break
+        elif char == ",":
+            cuts.append((index, "".join(reversed(stack))))
+    for end, closing in reversed(cuts[-MAX_REPAIR_CANDIDATES:]):
+        try:
+            return json.loads(text[start:end] + closing)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def validate(data, schema: dict, path: str = "$") -> list:
+    """
+    Checks data against the schema subset used for response schemas
+    (type, properties, required, items, enum). Returns a list of error messages.
+    """
+    expected = str(schema.get("type", "")).lower()
+    check = TYPE_CHECKS.get(expected)
+    if check and not check(data):
+        return [f"{path}: expected {expected}, got {type(data).__name__}"]
+    errors = []
+    if "enum" in schema and str(data).lower() not in {str(option).lower() for option in schema["enum"]}:
+        errors.append(f"{path}: {data!r} is not one of {schema['enum']}")
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing required property '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate(data[key], subschema, f"{path}.{key}"))
+    elif expected == "array" and "items" in schema:
+        for index, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def salvage(data, schema: dict):
+    """
+    Keeps the parts of data that match the schema: invalid array items and optional properties are dropped.
+    Returns None when data itself cannot be made valid.
+    """
+    expected = str(schema.get("type", "")).lower()
+    if expected == "array" and isinstance(data, list):
+        items_schema = schema.get("items", {})
+        return [item for item in (salvage(item, items_schema) for item in data) if item is not None]
+    if expected == "object" and isinstance(data, dict):
+        required = schema.get("required", [])
+        if any(key not in data for key in required):
+            return None
+        cleaned = dict(data)
+        for key, subschema in schema.get("properties", {}).items():
+            if key not in cleaned:
+                continue
+            value = salvage(cleaned[key], subschema)
+            if value is not None:
+                cleaned[key] = value
+            elif key in required:
+                return None
+            else:
+                del cleaned[key]
+        return cleaned
+    return None if validate(data, schema) else data
+
+
+def parse_structured(text: str, schema: dict) -> StructuredResult:
+    """
+    Parses a response against schema, repairing truncated JSON and salvaging partially valid data.
+    Raises StructuredOutputError if nothing usable remains.
+    """
+    status = "valid"
+    data = parse_json(text)
+    repaired = data is None
+    if repaired:
+        data = repair_json(text)
+        status = "repaired"
+    if data is None:
+        raise StructuredOutputError("No valid JSON found in response", text)
+    errors = validate(data, schema)
+    if errors:
+        data = salvage(data, schema)
+        if data is None:
+            raise StructuredOutputError(f"Response does not match the schema: {errors[0]}", text)
+        status = "salvaged"
+        logging.warning(f"Dropped parts of a response that did not match the schema ({len(errors)} errors, first: {errors[0]})")
+    elif status == "repaired":
+        logging.warning("Recovered truncated JSON response; trailing incomplete elements were dropped.")
+    return StructuredResult(data, status, errors, repaired=repaired)
+
+
+_unsupported_models = set()
+_unsupported_lock = threading.Lock()
+
+
+def supports_structured_output(model) -> bool:
+    with _unsupported_lock:
+        return model_name_of(model) not in _unsupported_models
+
+
+def _error_text(exc: BaseException) -> str:
+    """
+    Message of a provider error, including the response body of HTTP client errors.
+    """
+    response = getattr(exc, "response", None)
+    try:
+        body = getattr(response, "text", "") or ""
+    except Exception:
+        body = ""
+    return f"{exc} {body}"
+
+
+def _is_unsupported_error(exc: BaseException, model) -> bool:
+    # Only errors about the JSON options count: a context overflow or a malformed prompt must not
+    # turn JSON mode off for the model for the rest of the process.
+    status_codes = {400} if provider_of(model_name_of(model)) == "gemini" else LOCAL_UNSUPPORTED_STATUS_CODES
+    return status_code_of(exc) in status_codes and bool(UNSUPPORTED_PATTERN.search(_error_text(exc)))
+
+
+def generate_json(model, contents, schema: dict, send=None, **kwargs) -> StructuredResult:
+    """
+    Requests JSON matching schema and returns the parsed result.
+    Models that reject schema-constrained output are remembered and asked through the prompt alone.
+    :param send: request function called as send(model, contents, **kwargs); defaults to llm_api.generate_content.
+    :param kwargs: passed on to send (e.g. counted_contents); a generation_config is merged with the schema settings.
+    """
+    send = send or generate_content
+    generation_config = kwargs.pop("generation_config", None) or {}
+    response = None
+    if supports_structured_output(model):
+        try:
+            response = send(model, contents, generation_config={**generation_config, **schema_config(schema)}, **kwargs)
+        except Exception as e:
+            if not _is_unsupported_error(e, model):
+                raise
+            logging.info(f"{model_name_of(model)} does not support schema-constrained output, using prompt-only JSON: {e}")
+            with _unsupported_lock:
+                _unsupported_models.add(model_name_of(model))
+    if response is None:
+        if generation_config:
+            kwargs["generation_config"] = generation_config
+        response = send(model, contents, **kwargs)
+    try:
+        text = response.text
+    except ValueError as e:
+        # Blocked or empty candidates have no text part.
+        raise StructuredOutputError(f"Response has no text: {e}")
+    return parse_structured(text, schema)
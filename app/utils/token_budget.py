@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+
+from app.utils.llm_settings import get_setting
+from app.utils.upload_registry import get_upload_registry
+
+# Starting point for the local heuristic; refined from the provider's count endpoint.
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# Weight of each new endpoint measurement in the running calibration.
+CALIBRATION_WEIGHT = 0.2
+# Texts shorter than this are too noisy to calibrate from.
+MIN_CALIBRATION_CHARS = 2000
+
+
+class PromptTooLargeError(ValueError):
+    """
+    Raised before sending a request whose prompt cannot fit the model context or the configured budget.
+    """
+
+    def __init__(self, estimated_tokens: int, limit: int, model_name: str, reason: str):
+        self.estimated_tokens = estimated_tokens
+        self.limit = limit
+        self.model_name = model_name
+        super().__init__(
+            f"Prompt for {model_name} is about {estimated_tokens} tokens, above the limit of {limit} ({reason})."
+        )
+
+
+class TokenEstimator:
+    """
+    Estimates prompt tokens locally from character counts and, near the limit,
+    confirms with the provider's count endpoint. Every endpoint result recalibrates the local ratio.
+    """
+
+    def __init__(self, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self._lock = threading.Lock()
+
+    def estimate(self, contents) -> int:
+        """
+        Local estimate for a prompt given as a string or a list of strings and uploaded files.
+        """
+        return int(self._char_count(contents) / self.chars_per_token) + 1
+
+    def count(self, model, contents, limit: int = None) -> int:
+        """
+        Returns the local estimate, or the provider's exact count when the estimate is
+        close enough to limit that the heuristic error matters.
+        """
+        estimate = self.estimate(contents)
+        ratio = get_setting("token_budget.count_endpoint_ratio", 0.8)
+        if limit is None or estimate < limit * ratio or not hasattr(model, "count_tokens"):
+            return estimate
+        try:
+            counted = model.count_tokens(contents).total_tokens
+        except Exception as e:
+            logging.info(f"Token count endpoint unavailable, using local estimate: {e}")
+            return estimate
+        self._calibrate(contents, counted)
+        return counted
+
+    def _calibrate(self, contents, counted: int):
+        if counted <= 0 or not all(isinstance(part, str) for part in _as_list(contents)):
+            return
+        chars = self._char_count(contents)
+        if chars < MIN_CALIBRATION_CHARS:
+            return
+        with self._lock:
+            measured = chars / counted
+            self.chars_per_token += CALIBRATION_WEIGHT * (measured - self.chars_per_token)
+
+    @staticmethod
+    def _char_count(contents) -> int:
+        total = 0
+        for part in _as_list(contents):
+            if isinstance(part, str):
+                total += len(part)
+                continue
+            # Uploaded files: use the local copy when known, else the size reported by the server.
+            local_path = get_upload_registry().local_path(part)
+            try:
+                total += os.path.getsize(local_path) if local_path else int(getattr(part, "size_bytes", 0) or 0)
+            except OSError:
+                total += int(getattr(part, "size_bytes", 0) or 0)
+        return total
+
+
+def _as_list(contents) -> list:
+    return contents if isinstance(contents, (list, tuple)) else [contents]
+
+
+_estimator = TokenEstimator()
+
+
+def get_estimator() -> TokenEstimator:
+    return _estimator
+
+
+def model_name_of(model) -> str:
+    name = model if isinstance(model, str) else getattr(model, "model_name", "") or ""
+    return name.removeprefix("models/")
+
+
+def context_window(model) -> int:
+    """
+    Input token limit of a model, matched by longest prefix in the configured table.
+    Models served by a local handler report their own window.
+    """
+    if getattr(model, "context_tokens", None):
+        return int(model.context_tokens)
+    windows = get_setting("context_windows", {}) or {}
+    name = model_name_of(model)
+    matches = [prefix for prefix in windows if prefix != "default" and name.startswith(prefix)]
+    if matches:
+        return int(windows[max(matches, key=len)])
+    return int(windows.get("default", 32768))
+
+
+def input_limit(model, max_input_tokens: int = None) -> tuple[int, str]:
+    """
+    Effective input limit for a request and a short description of what imposes it.
+    """
+    reserved = getattr(model, "output_tokens", None) or get_setting("token_budget.reserve_output_tokens", 0)
+    window = context_window(model) - int(reserved)
+    budget = max_input_tokens or get_setting("token_budget.max_input_tokens")
+    if budget and int(budget) < window:
+        return int(budget), "configured token budget"
+    return window, "model context window"
+
+
+def check_budget(model, contents, max_input_tokens: int = None) -> int:
+    """
+    Raises PromptTooLargeError when contents cannot fit; returns the token count otherwise.
+    """
+    limit, reason = input_limit(model, max_input_tokens)
+    tokens = _estimator.count(model, contents, limit)
+    if tokens > limit:
+        raise PromptTooLargeError(tokens, limit, model_name_of(model), reason)
+    return tokens
+
+
+def fit_text(text: str, model, other_contents=(), max_input_tokens: int = None, marker: str = "\n[... truncated ...]\n") -> str:
+    """
+    Truncates text so that it fits next to other_contents within the input limit.
+    Keeps the head and tail of the text, which carry most context in diffs and logs.
+    """
+    limit, _ = input_limit(model, max_input_tokens)
+    available = limit - _estimator.estimate(list(other_contents))
+    if available <= 0:
+        return ""
+    if _estimator.estimate(text) <= available:
+        return text
+    keep_chars = max(int(available * _estimator.chars_per_token) - len(marker), 0)
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    logging.info(f"Truncating prompt text from {len(text)} to {keep_chars} characters for {model_name_of(model)}")
+    return text[:head] + marker + (text[-tail:] if tail else "")
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import google.generativeai as genai
+
+from app.utils.llm_settings import backend_mode
+
+# Gemini keeps uploaded files for 48 hours. Handles are re-uploaded a little
+# before they expire so a request never references a file that vanishes mid-call.
+DEFAULT_FILE_TTL = timedelta(hours=48)
+EXPIRY_MARGIN = timedelta(minutes=15)
+
+# An upload that was replaced by newer content for the same file name is only
+# deleted after it has not been handed out for this long (other tabs may still hold it).
+STALE_GRACE_SECONDS = 30 * 60
+JANITOR_INTERVAL_SECONDS = 5 * 60
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: Path) -> str:
+    """
+    Hashes a file in chunks so multi-MB repository dumps are never loaded at once.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalUpload:
+    """
+    Handle returned instead of a real upload while replaying recorded sessions offline.
+    """
+
+    def __init__(self, file_path: Path, content_hash: str):
+        self.name = f"local/{content_hash[:16]}"
+        self.display_name = Path(file_path).name
+        self.size_bytes = os.path.getsize(file_path)
+        self.expiration_time = None
+
+
+def upload_file(file_path: Path):
+    """
+    Uploads a file to Gemini, or returns a LocalUpload in replay mode.
+    """
+    if backend_mode() == "replay":
+        return LocalUpload(file_path, file_sha256(file_path))
+    return genai.upload_file(file_path)
+
+
+def delete_file(remote_file):
+    if not isinstance(remote_file, LocalUpload):
+        genai.delete_file(remote_file.name)
+
+
+class UploadEntry:
+    def __init__(self, remote_file, content_hash: str, local_path: Path, expires_at: datetime):
+        self.remote_file = remote_file
+        self.content_hash = content_hash
+        self.local_path = local_path
+        self.expires_at = expires_at
+        self.last_used = time.monotonic()
+        self.superseded = False
+
+    def is_valid(self) -> bool:
+        return datetime.now(timezone.utc) + EXPIRY_MARGIN < self.expires_at
+
+
+class UploadRegistry:
+    """
+    Keeps one remote Gemini file per (API key, content hash).
+    Uploading the same content again returns the existing handle while it is still valid,
+    expired handles are re-uploaded, and superseded or expired files are deleted in the background.
+    """
+
+    def __init__(self, upload_func=None, delete_func=None):
+        self._upload_func = upload_func or upload_file
+        self._delete_func = delete_func or delete_file
+        self._entries = {}        # (namespace, content_hash) -> UploadEntry
+        self._latest_by_name = {} # (namespace, file name) -> content_hash
+        self._hash_by_remote = {} # remote file name -> content_hash
+        self._namespace = ""
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._janitor = None
+
+    def set_api_key(self, api_key: str):
+        """
+        Uploads are only visible to the project of the key that created them,
+        so handles are partitioned by a fingerprint of the configured key.
+        """
+        with self._lock:
+            self._namespace = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+
+    def get_or_upload(self, file_path: Path):
+        """
+        Returns a remote file handle for the content of file_path, uploading only when needed.
+        """
+        file_path = Path(file_path)
+        content_hash = file_sha256(file_path)
+        with self._lock:
+            key = (self._namespace, content_hash)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Per-content lock: concurrent tabs asking for the same dump wait for one upload.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry.is_valid():
+                    entry.last_used = time.monotonic()
+                    entry.superseded = False
+                    self._latest_by_name[(key[0], file_path.name)] = content_hash
+                    logging.info(f"Reusing uploaded file for {file_path.name} ({entry.remote_file.name})")
+                    return entry.remote_file
+
+            remote_file = self._upload_func(file_path)
+            expires_at = getattr(remote_file, "expiration_time", None) or datetime.now(timezone.utc) + DEFAULT_FILE_TTL
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            new_entry = UploadEntry(remote_file, content_hash, file_path, expires_at)
+
+            with self._lock:
+                if entry is not None:
+                    # Expired handles are removed by the server itself; only forget them.
+                    self._hash_by_remote.pop(entry.remote_file.name, None)
+                previous_hash = self._latest_by_name.get((key[0], file_path.name))
+                if previous_hash and previous_hash != content_hash:
+                    previous = self._entries.get((key[0], previous_hash))
+                    if previous:
+                        previous.superseded = True
+                self._entries[key] = new_entry
+                self._latest_by_name[(key[0], file_path.name)] = content_hash
+                self._hash_by_remote[remote_file.name] = content_hash
+            self._ensure_janitor()
+            return remote_file
+
+    def content_hash(self, remote_file) -> str:
+        """
+        Returns the content hash of a handle produced by this registry, or None.
+        """
+        with self._lock:
+            return self._hash_by_remote.get(getattr(remote_file, "name", None))
+
+    def local_path(self, remote_file) -> Path:
+        """
+        Returns the local file a handle was uploaded from, or None.
+        """
+        with self._lock:
+            content_hash = self._hash_by_remote.get(getattr(remote_file, "name", None))
+            for (_, key_hash), entry in self._entries.items():
+                if key_hash == content_hash:
+                    return entry.local_path
+        return None
+
+    def invalidate(self, remote_file):
+        """
+        Forgets a handle the server reported as missing so the next call re-uploads it.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.remote_file.name == getattr(remote_file, "name", None):
+                    del self._entries[key]
+
+    def purge_stale(self) -> int:
+        """
+        Deletes superseded uploads that are idle past the grace period and forgets expired ones.
+        Returns the number of remote files deleted.
+        """
+        now = time.monotonic()
+        to_delete = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not entry.is_valid():
+                    del self._entries[key]
+                    self._hash_by_remote.pop(entry.remote_file.name, None)
+                elif entry.superseded and now - entry.last_used > STALE_GRACE_SECONDS:
+                    del self._entries[key]
+                    self._hash_by_remote.pop(entry.remote_file.name, None)
+                    to_delete.append(entry.remote_file)
+
+        deleted = 0
+        for remote_file in to_delete:
+            try:
+                self._delete_func(remote_file)
+                deleted += 1
+                logging.info(f"Deleted stale upload {remote_file.name}")
+            except Exception as e:
+                logging.warning(f"Failed to delete stale upload {remote_file.name}: {e}")
+        return deleted
+
+    def _ensure_janitor(self):
+        with self._lock:
+            if self._janitor and self._janitor.is_alive():
+                return
+            self._janitor = threading.Thread(target=self._janitor_loop, name="upload-janitor", daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self):
+        while True:
+            time.sleep(JANITOR_INTERVAL_SECONDS)
+            try:
+                self.purge_stale()
+            except Exception as e:
+                logging.error(f"Upload janitor failed: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_upload_registry() -> UploadRegistry:
+    """
+    Returns the process-wide upload registry shared by all tabs.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = UploadRegistry()
+        return _registry
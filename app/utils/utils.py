@@ -5,8 +5,15 @@ import logging
 from pathlib import Path
 import tempfile
 import subprocess
+import time
 import google.generativeai as genai
 
+from app.utils.key_pool import get_key_pool, split_api_keys
+from app.utils.llm_settings import backend_mode, get_setting
+from app.utils.rate_limiter import get_rate_limiter, key_id_of
+from app.utils.session_state import load_session, update_session
+from app.utils.upload_registry import get_upload_registry
+
 # ------------------------------ Logging Configuration ------------------------------
 
 def setup_logging(log_file: Path, level=logging.INFO, log_to_console=True):
@@ -47,35 +54,51 @@ def check_api_key(self):
 
 def validate_gemini_api_key(api_key: str, test_prompt: str = "Test") -> tuple[bool, str]:
     """
-    Validates the provided Gemini API key by configuring the API and attempting a minimal
-    text generation using the "gemini-2.0-flash-001" model.
+    Validates the provided Gemini API key by configuring the API and fetching the metadata of
+    the "gemini-2.0-flash-001" model, which costs no generation quota.
+    Keys validated within warmup.key_validation_ttl_seconds are not checked again, across launches too.
+    Several keys separated by commas (a key pool) are validated one by one.
+    test_prompt is kept for compatibility and no longer sent.
 
     Returns:
         (True, "") if the key is valid,
         (False, error_message) if invalid.
     """
-    try:
-        genai.configure(api_key=api_key)
-        # Use a supported model for key validation
-        check_model = "gemini-2.0-flash-001"
-        model_instance = genai.GenerativeModel(model_name=check_model)
-        # Call generate_content without any extra parameters
-        response = model_instance.generate_content(test_prompt)
-        if not response.text:
-            raise ValueError("No text returned from the model.")
-        logging.info("Gemini API key validation succeeded.")
+    if backend_mode() == "replay":
+        logging.info("Replay mode: skipping Gemini API key validation.")
         return True, ""
-    except Exception as e:
-        error_message = str(e)
-        logging.error(f"Gemini API key validation failed: {error_message}")
-        return False, error_message
+    api_keys = split_api_keys(api_key) or [api_key]
+    validated = load_session().get("validated_keys", {})
+    ttl = float(get_setting("warmup.key_validation_ttl_seconds", 21600))
+    for index, key in enumerate(api_keys):
+        if time.time() - validated.get(key_id_of(key), 0) < ttl:
+            continue
+        try:
+            genai.configure(api_key=key)
+            # Use a supported model for key validation
+            check_model = "gemini-2.0-flash-001"
+            genai.get_model(f"models/{check_model}")
+        except Exception as e:
+            error_message = str(e) if len(api_keys) == 1 else f"Key {index + 1} of {len(api_keys)}: {e}"
+            logging.error(f"Gemini API key validation failed: {error_message}")
+            return False, error_message
+        validated[key_id_of(key)] = time.time()
+    genai.configure(api_key=api_keys[0])
+    update_session(validated_keys={key_id: at for key_id, at in validated.items() if time.time() - at < ttl})
+    logging.info("Gemini API key validation succeeded.")
+    return True, ""
     
 def configure_genai_api(api_key: str):
     """
     Configures the Google Gemini API with the provided API key.
+    Several keys separated by commas form a key pool; the first one is used for uploads and caches.
     """
+    api_keys = split_api_keys(api_key) or [api_key]
     try:
-        genai.configure(api_key=api_key)
+        genai.configure(api_key=api_keys[0])
+        get_upload_registry().set_api_key(api_keys[0])
+        get_rate_limiter().set_api_key(api_keys[0])
+        get_key_pool().configure(api_keys)
         logging.info("Successfully configured Google Gemini API.")
     except Exception as e:
         logging.error(f"Failed to configure Google Gemini API: {e}")
@@ -112,6 +135,37 @@ def get_remote_repo_url(repo_url: str) -> str:
         logging.error("Invalid GitHub URL format.")
         raise ValueError("Invalid GitHub URL. Please enter a valid GitHub repository URL.")
 
+def normalize_remote_url(repo_input: str) -> str:
+    """
+    Adds the https:// scheme to GitHub URLs entered without one, e.g. "github.com/owner/repo".
+    """
+    if repo_input.startswith(("github.com/", "www.github.com/")):
+        return "https://" + repo_input.removeprefix("www.")
+    return repo_input
+
+def check_repository(repo_input: str) -> str:
+    """
+    Checks that a local directory or remote GitHub repository exists and is reachable.
+    Remote URLs are probed with `git ls-remote` instead of being cloned.
+    Returns the repository type, "local" or "remote"; raises on invalid input.
+    """
+    repo_url = normalize_remote_url(repo_input)
+    if repo_url.startswith(("https://", "http://", "git@")):
+        repo_url = get_remote_repo_url(repo_url).split('/tree/')[0]
+        try:
+            subprocess.run(
+                ["git", "ls-remote", "--heads", repo_url], check=True, capture_output=True, text=True,
+                timeout=float(get_setting("warmup.remote_check_timeout_seconds", 20)),
+                env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+            )
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f"Repository {repo_url} is not reachable: {e.stderr.strip()}")
+        except subprocess.TimeoutExpired:
+            raise ValueError(f"Repository {repo_url} did not answer in time.")
+        return "remote"
+    get_local_repo_path(repo_input)
+    return "local"
+
 def clone_remote_repo(repo_url: str) -> Path:
     """
     Clones the remote repository into a temporary directory.
@@ -120,6 +174,7 @@ def clone_remote_repo(repo_url: str) -> Path:
     the repository is cloned using that branch.
     """
     try:
+        repo_url = normalize_remote_url(repo_url)
         branch = None
         # If the URL contains '/tree/', extract the branch name and base URL.
         if '/tree/' in repo_url:
@@ -202,10 +257,12 @@ def convert_repo_to_txt(repo_path: Path, output_txt_path: Path):
 def upload_file_to_gemini(file_path: Path):
     """
     Uploads the specified file to Google Gemini.
+    Identical content is only uploaded once; the registry hands back the existing
+    remote file while it is still valid.
     Returns the uploaded file object.
     """
     try:
-        uploaded_file = genai.upload_file(file_path)
+        uploaded_file = get_upload_registry().get_or_upload(file_path)
         logging.info(f"Successfully uploaded file: {file_path.name}")
         return uploaded_file
     except Exception as e:
@@ -0,0 +1,135 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from google.generativeai import client as genai_client
+
+from app.llm_handler import OllamaHandler
+from app.utils.key_pool import get_key_pool
+from app.utils.llm_settings import get_setting, resolve_path
+from app.utils.rate_limiter import key_id_of
+from app.utils.session_state import load_session, update_session
+from app.utils.utils import (
+    check_repository,
+    configure_genai_api,
+    convert_repo_to_txt,
+    upload_file_to_gemini,
+    validate_gemini_api_key,
+)
+
+WARMUP_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+_ollama_models = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+        return _executor
+
+
+def _run(name: str, task, on_event):
+    """
+    Runs one warm-up task and reports (name, ok, detail) to on_event; failures stay on the future.
+    """
+    try:
+        detail = task()
+    except Exception as e:
+        logging.info(f"Warm-up step {name} failed: {e}")
+        if on_event:
+            on_event(name, False, str(e))
+        raise
+    if on_event:
+        on_event(name, True, detail)
+    return detail
+
+
+def prepare_api(api_key: str) -> str:
+    """
+    Validates the key (cheaply, cached), configures the API and builds the clients of every pooled key,
+    so the first request does not pay for channel setup.
+    """
+    valid, error_message = validate_gemini_api_key(api_key)
+    if not valid:
+        raise ValueError(error_message)
+    configure_genai_api(api_key)
+    genai_client.get_default_generative_client()
+    genai_client.get_default_file_client()
+    for key in get_key_pool().keys():
+        key.client
+    return f"{len(get_key_pool().keys())} key(s) ready"
+
+
+def ollama_models(refresh: bool = False) -> list:
+    """
+    Models installed on the configured Ollama server, queried over its HTTP API; [] when it is not running.
+    """
+    global _ollama_models
+    if _ollama_models is None or refresh:
+        handler = OllamaHandler()
+        try:
+            _ollama_models = handler.list_models()
+        except Exception as e:
+            logging.info(f"Ollama is not reachable at {handler.base_url}: {e}")
+            _ollama_models = []
+        finally:
+            handler.close()
+    return _ollama_models
+
+
+def repo_snapshot_path(repo_path) -> Path:
+    index_dir = resolve_path(get_setting("warmup.index_dir", "data/repo_index"))
+    return index_dir / key_id_of(str(Path(repo_path).resolve())) / "repo_content.txt"
+
+
+def index_repo(repo_path, upload: bool = False) -> Path:
+    """
+    Writes the text snapshot of a local repository to the index directory and, with upload=True, uploads it.
+    Tabs that later upload an identical snapshot get the existing remote file from the upload registry.
+    """
+    snapshot = repo_snapshot_path(repo_path)
+    snapshot.parent.mkdir(parents=True, exist_ok=True)
+    convert_repo_to_txt(Path(repo_path), snapshot)
+    if upload:
+        upload_file_to_gemini(snapshot)
+    return snapshot
+
+
+def remember_repo(repo_input: str, repo_type: str):
+    update_session(last_repo={"path": repo_input, "type": repo_type})
+
+
+def last_repo() -> dict:
+    """
+    The repository selected in the previous session, {"path": ..., "type": ...}, or None.
+    """
+    return load_session().get("last_repo")
+
+
+def start_warmup(api_key: str = None, repo: dict = None, on_event=None) -> dict:
+    """
+    Runs the warm-up steps concurrently in the background and returns their futures by name:
+    "api" (key validation and client setup, when api_key is given), "ollama" (installed models)
+    and "repo" (check and index of a local repository, by default the last one used).
+    :param on_event: called as on_event(name, ok, detail) from a worker thread when a step finishes.
+    """
+    executor = _get_executor()
+    futures = {}
+    if api_key:
+        futures["api"] = executor.submit(_run, "api", lambda: prepare_api(api_key), on_event)
+    futures["ollama"] = executor.submit(_run, "ollama", ollama_models, on_event)
+    repo = repo or last_repo()
+    if repo and repo.get("path"):
+        def check_and_index():
+            repo_type = check_repository(repo["path"])
+            if repo_type == "local":
+                # Uploading needs the configured API, so it waits for the "api" step (run concurrently until here)
+                index_repo(repo["path"], upload="api" in futures and futures["api"].exception() is None)
+            return repo_type
+        futures["repo"] = executor.submit(_run, "repo", check_and_index, on_event)
+    return futures
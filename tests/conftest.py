@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import retry_policy
+from tests.stub_server import StubServer
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_wait(monkeypatch):
+    # Retries happen at once; the backoff itself is not under test.
+    monkeypatch.setattr(retry_policy, "random", SimpleNamespace(uniform=lambda low, high: 0))
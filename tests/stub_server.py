@@ -0,0 +1,75 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+class StubServer:
+    """
+    Local HTTP server answering each POST with the next scripted responder, for testing LLM backends.
+    A responder is called as responder(handler, payload) and writes the whole response through handler.
+    When the script runs out, the last responder keeps answering.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responders = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.requests.append(SimpleNamespace(path=self.path, payload=payload))
+                    responder = stub.responders.pop(0) if len(stub.responders) > 1 else stub.responders[0]
+                responder(self, payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def stream(lines, content_type="application/x-ndjson", stall_after=None, stall_seconds=0):
+    """
+    Responder sending lines as a chunked stream; with stall_after, it stops sending for stall_seconds after that many lines.
+    """
+
+    def respond(handler, payload):
+        handler.send_response(200)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for number, line in enumerate(lines(payload) if callable(lines) else lines):
+            if stall_after is not None and number == stall_after:
+                threading.Event().wait(stall_seconds)
+                handler.close_connection = True
+                return
+            data = (line + "\n").encode("utf-8")
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+
+    return respond
+
+
+def status(code: int, body: str = "error"):
+    def respond(handler, payload):
+        data = body.encode("utf-8")
+        handler.send_response(code)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    return respond
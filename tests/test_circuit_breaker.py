@@ -0,0 +1,58 @@
+import pytest
+
+from app.utils import circuit_breaker
+from app.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("gemini")
+    for _ in range(5):
+        breaker.before_request()
+        breaker.record(Unavailable())
+    assert breaker.state == OPEN
+    clock[0] += 31
+    return breaker
+
+
+def test_late_request_from_before_the_outage_does_not_close_a_half_open_circuit(clock):
+    breaker = CircuitBreaker("gemini")
+    late = breaker.before_request()     # admitted while closed, answers only after the outage
+    for _ in range(5):
+        breaker.before_request()
+        breaker.record(Unavailable())
+    clock[0] += 31
+    probe = breaker.before_request()
+    assert breaker.state == HALF_OPEN
+
+    breaker.record(probe=late)
+
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record(probe=probe)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens_for_twice_as_long(clock):
+    breaker = open_breaker(clock)
+    probe = breaker.before_request()
+
+    breaker.record(Unavailable(), probe)
+
+    assert breaker.state == OPEN
+    clock[0] += 31
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    clock[0] += 30
+    assert breaker.before_request() is not None
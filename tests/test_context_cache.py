@@ -0,0 +1,115 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.context_cache import ContextCache, LocalContextBackend
+
+
+class ProviderError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class EchoModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        self.requests.append(contents)
+        return SimpleNamespace(text="ok")
+
+
+class FlakyBackend(LocalContextBackend):
+    """
+    Local backend whose cache creation fails with the given errors first.
+    """
+
+    def __init__(self, errors=(), delay=0.0):
+        super().__init__(EchoModel)
+        self.errors = list(errors)
+        self.delay = delay
+        self.create_calls = 0
+
+    def create_cache(self, model_name, contents, ttl):
+        self.create_calls += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().create_cache(model_name, contents, ttl)
+
+
+@pytest.fixture(autouse=True)
+def live_mode(monkeypatch):
+    monkeypatch.setenv("REPO_SHEPHERD_LLM_MODE", "live")
+
+
+def snapshot(name="files/repo-snapshot"):
+    return SimpleNamespace(name=name)
+
+
+def test_cached_binding_prepends_snapshot():
+    backend = FlakyBackend()
+    cache = ContextCache(backend=backend)
+    context_file = snapshot()
+    bound = cache.bind("gemini-2.0-flash", context_file)
+    assert bound.cached
+    assert bound.contents("question") == ["question"]
+    bound.model.generate_content(bound.contents("question"))
+    assert bound.model._model.requests == [[context_file, "question"]]
+    assert cache.bind("gemini-2.0-flash", context_file).cached
+    assert backend.create_calls == 1
+
+
+def test_transient_error_does_not_disable_caching():
+    backend = FlakyBackend(errors=[ProviderError(503, "Service unavailable")])
+    cache = ContextCache(backend=backend)
+    assert not cache.bind("gemini-2.0-flash", snapshot()).cached
+    assert cache.bind("gemini-2.0-flash", snapshot()).cached
+    assert backend.create_calls == 2
+
+
+def test_unsupported_model_falls_back_inline_for_good():
+    backend = FlakyBackend(errors=[ProviderError(400, "Model does not support CachedContent")])
+    cache = ContextCache(backend=backend)
+    context_file = snapshot()
+    for _ in range(2):
+        bound = cache.bind("gemini-2.0-flash", context_file)
+        assert not bound.cached
+        assert bound.contents("question") == [context_file, "\n\n", "question"]
+    assert backend.create_calls == 1
+
+
+def test_concurrent_binds_create_one_cache_without_blocking_other_snapshots():
+    backend = FlakyBackend(delay=0.3)
+    cache = ContextCache(backend=backend)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.bind("gemini-2.0-flash", snapshot())))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    # Another snapshot is not held up by the creation in flight
+    started = time.monotonic()
+    assert cache.bind("gemini-2.0-flash", snapshot("files/other")).cached
+    assert time.monotonic() - started < 0.45
+    for thread in threads:
+        thread.join()
+    assert all(bound.cached for bound in results)
+    assert backend.create_calls == 2
+
+
+def test_bind_without_create_only_reuses_an_existing_cache():
+    backend = FlakyBackend()
+    cache = ContextCache(backend=backend)
+    context_file = snapshot()
+    hedge = cache.bind("gemini-2.0-flash-lite", context_file, create=False)
+    assert not hedge.cached
+    assert hedge.contents("question") == [context_file, "\n\n", "question"]
+    assert backend.create_calls == 0
+    cache.bind("gemini-2.0-flash-lite", context_file)
+    assert cache.bind("gemini-2.0-flash-lite", context_file, create=False).cached
+    assert backend.create_calls == 1
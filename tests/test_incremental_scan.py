@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import git
+import pytest
+
+import app.security_scanner_gemini_all_code_withsecondpass as scanner
+from app.utils.finding_cache import git_blob_sha_of_file
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = git.Repo.init(tmp_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    (tmp_path / "old.py").write_text("import os\nos.system(input())\n")
+    repo.index.add(["old.py"])
+    repo.index.commit("initial")
+    return repo
+
+
+def previous_report(repo, **state):
+    file_path = Path(repo.working_tree_dir) / "old.py"
+    return {
+        "demo/old.py": [{"location": "demo/old.py, line 2", "description": "Command injection in demo/old.py"}],
+        scanner.SCAN_STATE_KEY: {
+            "commit": repo.head.commit.hexsha,
+            "model": "gemini-2.0-flash",
+            "prompt_versions": scanner.SCAN_PROMPT_VERSIONS,
+            "files": {"demo/old.py": {"path": "old.py", "blob": git_blob_sha_of_file(file_path)}},
+            **state,
+        },
+    }
+
+
+def test_renamed_file_carries_findings_under_its_new_path(repo):
+    report = previous_report(repo)
+    repo.git.mv("old.py", "new.py")
+    new_file = Path(repo.working_tree_dir) / "new.py"
+
+    to_scan, carried, _ = scanner.plan_incremental_scan(repo, "demo", [new_file], report, "gemini-2.0-flash")
+
+    assert to_scan == []
+    assert carried == {"demo/new.py": [{"location": "demo/new.py, line 2", "description": "Command injection in demo/new.py"}]}
+
+
+def test_changed_prompts_force_a_full_rescan(repo):
+    report = previous_report(repo, prompt_versions={**scanner.SCAN_PROMPT_VERSIONS, "first_pass": "outdated"})
+    file_path = Path(repo.working_tree_dir) / "old.py"
+
+    to_scan, carried, _ = scanner.plan_incremental_scan(repo, "demo", [file_path], report, "gemini-2.0-flash")
+
+    assert to_scan == [file_path]
+    assert carried == {}
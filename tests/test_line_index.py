@@ -0,0 +1,29 @@
+from app.utils.line_index import LineIndex
+
+
+def write_lines(tmp_path, line, count):
+    path = tmp_path / "large.txt"
+    path.write_text((line + "\n") * count)
+    return path
+
+
+def test_long_lines_are_chunked_by_bytes_without_stalling(tmp_path):
+    path = write_lines(tmp_path, "x" * 3071, 2000)
+
+    with LineIndex(path) as index:
+        chunks = index.chunks(max_lines=400, overlap=40, max_bytes=48_000)
+
+    assert 240 <= len(chunks) <= 260
+    assert chunks[0][0] == 1 and chunks[-1][1] == 2000
+    assert all(next_first <= last + 1 for (_, last), (next_first, _) in zip(chunks, chunks[1:]))
+    assert all((last - first + 1) * 3072 <= 48_000 for first, last in chunks)
+
+
+def test_short_lines_are_chunked_by_line_count_with_the_full_overlap(tmp_path):
+    path = write_lines(tmp_path, "x" * 30, 2000)
+
+    with LineIndex(path) as index:
+        chunks = index.chunks(max_lines=400, overlap=40, max_bytes=48_000)
+
+    assert chunks[:2] == [(1, 400), (361, 760)]
+    assert chunks[-1][1] == 2000
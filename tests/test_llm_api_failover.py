@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import llm_api
+from app.utils.circuit_breaker import CircuitOpenError
+
+
+class EchoModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.requests = []
+
+    def generate_content(self, contents, **kwargs):
+        self.requests.append(contents)
+        return SimpleNamespace(text="ok", usage_metadata=None)
+
+
+class OpenBreaker:
+    def before_request(self):
+        raise CircuitOpenError("gemini", 30)
+
+
+@pytest.fixture
+def open_circuit(monkeypatch):
+    failover = EchoModel("ollama:llama3.2")
+    monkeypatch.setattr(llm_api, "get_circuit_breaker", lambda provider: OpenBreaker() if provider == "gemini" else None)
+    monkeypatch.setattr(llm_api, "_failover_model", lambda model: failover.model_name)
+    monkeypatch.setattr(llm_api, "get_model", lambda model_name, **kwargs: failover)
+    return failover
+
+
+def test_open_circuit_fails_over_plain_requests(open_circuit):
+    response = llm_api.generate_content(EchoModel("gemini-2.0-flash"), "Explain this diff")
+
+    assert response.text == "ok"
+    assert open_circuit.requests == ["Explain this diff"]
+
+
+def test_open_circuit_does_not_fail_over_bound_context_requests(open_circuit):
+    with pytest.raises(CircuitOpenError):
+        llm_api.generate_content(
+            EchoModel("gemini-2.0-flash"), ["Find vulnerabilities"],
+            counted_contents=["<repository>", "\n\n", "Find vulnerabilities"],
+        )
+
+    assert open_circuit.requests == []
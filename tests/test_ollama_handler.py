@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.llm_handler import OllamaHandler, StreamInterruptedError
+from tests.stub_server import status, stream
+
+
+def ndjson(*fragments, prompt_tokens=5):
+    messages = [json.dumps({"response": fragment, "done": False}) for fragment in fragments]
+    messages.append(json.dumps({"response": "", "done": True, "done_reason": "stop",
+                                "prompt_eval_count": prompt_tokens, "eval_count": len(fragments)}))
+    return messages
+
+
+def handler(server, **kwargs):
+    return OllamaHandler(llm_url=server.url, model="stub-model", **kwargs)
+
+
+def test_streams_ndjson_fragments(stub_server):
+    stub_server.responders = [stream(ndjson("Hel", "lo", "!"))]
+    tokens = []
+    text, usage = handler(stub_server).generate_with_usage("hi", on_token=tokens.append)
+    assert text == "Hello!"
+    assert tokens == ["Hel", "lo", "!"]
+    assert usage == {"input_tokens": 5, "output_tokens": 3}
+    payload = stub_server.requests[0].payload
+    assert stub_server.requests[0].path == "/api/generate"
+    assert payload["stream"] is True and payload["model"] == "stub-model"
+    assert payload["options"]["num_ctx"] == 8192
+
+
+def test_transient_error_is_retried(stub_server):
+    stub_server.responders = [status(503), stream(ndjson("ok"))]
+    assert handler(stub_server).generate("hi") == "ok"
+    assert len(stub_server.requests) == 2
+
+
+def test_failure_mid_stream_is_not_retried_once_tokens_were_delivered(stub_server):
+    stub_server.responders = [stream(ndjson("partial", "rest"), stall_after=1, stall_seconds=2), stream(ndjson("again"))]
+    tokens = []
+    with pytest.raises(StreamInterruptedError):
+        handler(stub_server, timeout=0.5).generate("hi", on_token=tokens.append)
+    assert tokens == ["partial"]
+    assert len(stub_server.requests) == 1
+
+
+def test_failure_mid_stream_is_retried_without_token_callback(stub_server):
+    stub_server.responders = [stream(ndjson("partial", "rest"), stall_after=1, stall_seconds=2), stream(ndjson("again"))]
+    assert handler(stub_server, timeout=0.5).generate("hi") == "again"
+    assert len(stub_server.requests) == 2
+
+
+def test_analyze_code_splits_input_to_fit_num_ctx(stub_server):
+    stub_server.responders = [stream(lambda payload: ndjson(f"[{len(payload['prompt'])}]"))]
+    code = "".join(f"value_{line} = {line}\n" for line in range(400))
+    result = handler(stub_server, num_ctx=1024, num_predict=256).analyze_code(code)
+    assert result["chunks"] > 1
+    assert len(stub_server.requests) == result["chunks"]
+    assert all(request.payload["options"]["num_ctx"] == 1024 for request in stub_server.requests)
+    # Every chunk fits the window left next to the output
+    assert all(len(request.payload["prompt"]) < (1024 - 256) * 4 for request in stub_server.requests)
+    assert "".join(request.payload["prompt"] for request in stub_server.requests).count("value_") == 400
+
+
+def test_generate_many_runs_in_parallel_and_keeps_order(stub_server):
+    in_flight, peak, lock = [0], [0], threading.Lock()
+
+    def slow_echo(handler_, payload):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.2)
+        with lock:
+            in_flight[0] -= 1
+        stream(ndjson(payload["prompt"].upper()))(handler_, payload)
+
+    stub_server.responders = [slow_echo]
+    prompts = [f"prompt {number}" for number in range(6)]
+    answers = handler(stub_server, max_parallel=3).generate_many(prompts)
+    assert answers == [prompt.upper() for prompt in prompts]
+    assert peak[0] == 3
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from app.llm_handler import HandlerModel, OpenAICompatibleHandler
+from app.security_scanner_gemini_all_code_withsecondpass import send_gemini_request
+from app.utils.retry_policy import is_transient_error
+from tests.stub_server import status, stream
+
+
+def sse(*fragments, finish_reason="stop"):
+    events = [json.dumps({"choices": [{"delta": {"content": fragment}, "finish_reason": None}]}) for fragment in fragments]
+    events.append(json.dumps({"choices": [{"delta": {}, "finish_reason": finish_reason}]}))
+    events.append(json.dumps({"choices": [], "usage": {"prompt_tokens": 7, "completion_tokens": len(fragments)}}))
+    return [f"data: {event}\n" for event in events] + ["data: [DONE]\n"]
+
+
+def handler(server, **kwargs):
+    return OpenAICompatibleHandler(api_url=f"{server.url}/v1", api_key="test-key", model="stub-model", **kwargs)
+
+
+def test_streams_server_sent_events(stub_server):
+    stub_server.responders = [stream(sse("Hel", "lo"), content_type="text/event-stream")]
+    tokens = []
+    text, usage = handler(stub_server).generate_with_usage("hi", system="be brief", on_token=tokens.append)
+    assert (text, tokens) == ("Hello", ["Hel", "lo"])
+    assert usage == {"input_tokens": 7, "output_tokens": 2}
+    request = stub_server.requests[0]
+    assert request.path == "/v1/chat/completions"
+    assert request.payload["messages"] == [{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]
+    assert request.payload["stream"] is True
+
+
+def test_handler_model_sends_a_single_request(stub_server):
+    stub_server.responders = [status(503)]
+    model = HandlerModel(handler(stub_server), "openai:stub-model")
+    with pytest.raises(Exception) as raised:
+        model.generate_content("hi")
+    assert is_transient_error(raised.value)
+    assert len(stub_server.requests) == 1
+
+
+def test_server_errors_are_retried_once_by_the_provider_layer(stub_server):
+    stub_server.responders = [status(502), status(503), stream(sse("done"), content_type="text/event-stream")]
+    model = HandlerModel(handler(stub_server), "openai:stub-model")
+    response = send_gemini_request(model, ["part one ", "part two"])
+    assert response.text == "done"
+    assert response.usage_metadata.prompt_token_count == 7
+    assert len(stub_server.requests) == 3
+    assert stub_server.requests[-1].payload["messages"][-1]["content"] == "part one part two"
+
+
+def test_handler_model_passes_generation_config(stub_server):
+    stub_server.responders = [stream(sse('{"ok": true}'), content_type="text/event-stream")]
+    schema = {"type": "object", "properties": {"ok": {"type": "boolean"}}}
+    model = HandlerModel(handler(stub_server), "openai:stub-model")
+    model.generate_content("hi", generation_config={"max_output_tokens": 64, "response_schema": schema})
+    payload = stub_server.requests[0].payload
+    assert payload["max_tokens"] == 64
+    assert payload["response_format"]["json_schema"]["schema"] == schema
+
+
+def test_generate_many_keeps_input_order(stub_server):
+    stub_server.responders = [stream(lambda payload: sse(payload["messages"][-1]["content"][::-1]),
+                                     content_type="text/event-stream")]
+    prompts = ["abc", "def", "ghi", "jkl"]
+    assert handler(stub_server, max_parallel=4).generate_many(prompts) == ["cba", "fed", "ihg", "lkj"]
@@ -0,0 +1,97 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import git
+import pytest
+
+import app.security_scanner_gemini_all_code_withsecondpass as scanner
+from app.utils.model_router import route
+from app.utils.structured_output import StructuredResult
+from app.utils.token_budget import model_name_of
+
+
+class MemoryFindingCache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, blob_sha, model_name, version, file_path):
+        return self.entries.get((blob_sha, model_name, version))
+
+    def put(self, blob_sha, model_name, version, file_path, findings):
+        self.entries[(blob_sha, model_name, version)] = findings
+
+
+@pytest.fixture
+def finding_cache(monkeypatch):
+    cache = MemoryFindingCache()
+    monkeypatch.setattr(scanner, "get_finding_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return git.Repo.init(tmp_path)
+
+
+def write(repo, name, content):
+    path = Path(repo.working_tree_dir) / name
+    path.write_text(content)
+    return path
+
+
+def routed_name(relative_path, content):
+    prompt = scanner.FIRST_PASS_PROMPT.format(file_path=relative_path, file_content=content)
+    return route(scanner.FIRST_PASS_STAGE, prompt, scanner.MODEL_NAME).model_name
+
+
+def test_packs_only_share_files_routed_to_the_same_model(repo, finding_cache):
+    small = [write(repo, f"small_{i}.py", f"x = {i}\n") for i in range(3)]
+    large_content = "value = 'configuration entry'\n" * 300
+    large = [write(repo, f"large_{i}.py", large_content) for i in range(2)]
+    assert routed_name("demo/small_0.py", "x = 0\n") != routed_name("demo/large_0.py", large_content)
+
+    singles, packs = scanner.plan_packs(repo, "demo", small + large, always_pack=set(large))
+
+    assert singles == []
+    assert sorted([file_path.name for file_path, _, _, _ in pack] for pack in packs) == [
+        ["large_0.py", "large_1.py"], ["small_0.py", "small_1.py", "small_2.py"],
+    ]
+
+
+def test_packed_findings_are_cached_under_the_model_plan_packs_looks_up(repo, finding_cache, monkeypatch):
+    # Together the files are routed to a bigger model than each one on its own
+    content = "total = price * quantity\n" * 30
+    files = [write(repo, f"small_{i:02}.py", content) for i in range(12)]
+    sent = []
+
+    def generate_json(model, prompt, schema, **kwargs):
+        sent.append(model_name_of(model))
+        entries = [{"file_path": f"demo/{path.name}", "vulnerabilities": []} for path in files]
+        return StructuredResult({"files": entries}, "valid")
+
+    monkeypatch.setattr(scanner, "generate_json", generate_json)
+    _, packs = scanner.plan_packs(repo, "demo", files)
+    scanner.scan_pack(repo, packs[0], "demo")
+
+    assert len(packs) == 1
+    assert sent == [routed_name("demo/small_00.py", content)]
+    results = {}
+    singles, packs = scanner.plan_packs(repo, "demo", files, results=results)
+    assert (singles, packs) == ([], [])
+    assert results == {f"demo/{path.name}": [] for path in files}
+
+
+def test_truncated_and_salvaged_packed_response_drops_the_last_file(finding_cache, monkeypatch):
+    # Cut off inside the second file's findings, with a first-file finding missing required fields
+    text = (
+        '{"files": [{"file_path": "demo/a.py", "vulnerabilities": [{"description": "incomplete"}]},'
+        ' {"file_path": "demo/b.py", "vulnerabilities": [], "note": "x"},'
+        ' {"file_path": "demo/c.py", "vulnerabilities": [{"vulnerability_type": "Command Inj'
+    )
+    monkeypatch.setattr(scanner, "send_gemini_request", lambda *args, **kwargs: SimpleNamespace(text=text))
+    files = [(f"demo/{name}", "x = 1\n", f"blob-{name}") for name in ("a.py", "b.py", "c.py")]
+
+    processed = scanner.generate_packed_report(files, model=SimpleNamespace(model_name="gemini-2.0-flash"))
+
+    assert processed == {"demo/a.py": []}
+    assert finding_cache.entries == {}
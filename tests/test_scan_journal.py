@@ -0,0 +1,65 @@
+import gc
+import warnings
+from types import SimpleNamespace
+
+import git
+import pytest
+
+import app.security_scanner_gemini_all_code_withsecondpass as scanner
+from app.utils.scan_journal import ScanJournal, journal_path, read_journal
+
+
+class WindowClosed(RuntimeError):
+    pass
+
+
+@pytest.fixture
+def requested(monkeypatch):
+    """
+    Relative paths sent to the model by a first pass, which finds nothing.
+    """
+    sent = []
+
+    def generate_security_report(file_content, file_path, model=None, blob_sha=None, excerpt=False):
+        sent.append(file_path)
+        return []
+
+    def generate_packed_report(files, model=None):
+        sent.extend(path for path, _, _ in files)
+        return {path: [] for path, _, _ in files}
+
+    monkeypatch.setattr(scanner, "generate_security_report", generate_security_report)
+    monkeypatch.setattr(scanner, "generate_packed_report", generate_packed_report)
+    monkeypatch.setattr(scanner, "get_finding_cache", lambda: SimpleNamespace(get=lambda *args: None))
+    monkeypatch.setattr(scanner, "get_key_pool", lambda: SimpleNamespace(key_ids=lambda: []))
+    return sent
+
+
+def test_scan_interrupted_by_a_raising_callback_leaves_a_resumable_journal(tmp_path, requested, monkeypatch):
+    monkeypatch.setattr(scanner, "get_rate_limiter", lambda: SimpleNamespace(check_quota=lambda *args: True))
+    repo = git.Repo.init(tmp_path / "demo")
+    sources = []
+    for name in ("a.py", "b.py", "c.py"):
+        source = tmp_path / "demo" / name
+        source.write_text(f"import os\nos.system(input())  # {name}\n" + "x = 1\n" * 2000)
+        sources.append(source)
+    path = journal_path(tmp_path / "security_vulnerabilities.json")
+
+    def close_window(done, total, relative_path):
+        raise WindowClosed("progress label destroyed")
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        with pytest.raises(WindowClosed):
+            scanner.scan_code_files(repo, "demo", sources, workers=1, on_progress=close_window, journal=ScanJournal(path))
+        gc.collect()
+
+    assert not [warning for warning in caught if issubclass(warning.category, ResourceWarning)]
+    header, recorded = read_journal(path)
+    assert header is not None and recorded == 1
+    first_run = list(requested)
+    report = scanner.scan_code_files(repo, "demo", sources, workers=1, journal=ScanJournal(path))
+
+    assert report[scanner.SCAN_STATE_KEY]["resumed"] == 1
+    assert len(requested) - len(first_run) == 2
+    assert scanner.report_file_paths(report) == ["demo/a.py", "demo/b.py", "demo/c.py"]
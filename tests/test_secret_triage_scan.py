@@ -0,0 +1,45 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import git
+import pytest
+
+import app.security_scanner_gemini_all_code_withsecondpass as scanner
+
+
+@pytest.fixture
+def requested(monkeypatch):
+    """
+    Relative paths sent to the model by a first pass, which finds nothing.
+    """
+    sent = []
+
+    def generate_security_report(file_content, file_path, model=None, blob_sha=None, excerpt=False):
+        sent.append(file_path)
+        return []
+
+    def generate_packed_report(files, model=None):
+        sent.extend(path for path, _, _ in files)
+        return {path: [] for path, _, _ in files}
+
+    monkeypatch.setattr(scanner, "generate_security_report", generate_security_report)
+    monkeypatch.setattr(scanner, "generate_packed_report", generate_packed_report)
+    monkeypatch.setattr(scanner, "get_finding_cache", lambda: SimpleNamespace(get=lambda *args: None))
+    monkeypatch.setattr(scanner, "get_rate_limiter", lambda: SimpleNamespace(check_quota=lambda *args: None))
+    monkeypatch.setattr(scanner, "get_key_pool", lambda: SimpleNamespace(key_ids=lambda: []))
+    return sent
+
+
+def test_config_file_escalated_by_secret_detection_reaches_the_model(tmp_path, requested):
+    repo = git.Repo.init(tmp_path)
+    escalated = tmp_path / "conf.json"
+    escalated.write_text('{\n  "name": "demo",\n  "build_id": "Zk8fQ2mX9pL4vR7tY1bN3cW6hJ0sD5gA"\n}\n')
+    plain = tmp_path / "package.json"
+    plain.write_text('{\n  "name": "demo",\n  "version": "1.0.0"\n}\n')
+
+    report = scanner.scan_code_files(repo, "demo", [escalated, plain])
+
+    assert requested == ["demo/conf.json"]
+    assert report["demo/conf.json"] == []
+    assert report[scanner.SCAN_STATE_KEY]["skipped_by_triage"] == []
+    assert report[scanner.SCAN_STATE_KEY]["resolved_locally"] == ["demo/package.json"]
@@ -0,0 +1,17 @@
+from app.utils.static_triage import triage_file, triage_files
+
+
+def test_triage_files_matches_triage_file_for_every_file(tmp_path):
+    file_paths = []
+    for i in range(40):
+        path = tmp_path / f"module_{i}.py"
+        path.write_text("import os\nos.system(input())\n" if i % 2 else "total = 1 + 2\n")
+        file_paths.append(path)
+
+    triaged = triage_files(file_paths, workers=4)
+
+    assert list(triaged) == file_paths
+    assert [(result.score, result.signals) for result in triaged.values()] == [
+        (triage_file(path).score, triage_file(path).signals) for path in file_paths
+    ]
+    assert all(triaged[path].has_signals for path in file_paths[1::2])
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from app.utils import structured_output
+from app.utils.structured_output import generate_json
+
+SCHEMA = {"type": "object", "properties": {"ok": {"type": "boolean"}}, "required": ["ok"]}
+
+
+def http_error(status: int, body: str) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode("utf-8")
+    return requests.HTTPError(f"{status} Client Error: Bad Request for url: http://localhost/v1/chat/completions",
+                              response=response)
+
+
+class RejectingSend:
+    """
+    Rejects requests carrying a schema with the given error and answers the others.
+    """
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def __call__(self, model, contents, generation_config=None, **kwargs):
+        self.calls.append(generation_config)
+        if generation_config and "response_schema" in generation_config:
+            raise self.error
+        return SimpleNamespace(text='{"ok": true}')
+
+
+@pytest.fixture(autouse=True)
+def fresh_support_table(monkeypatch):
+    monkeypatch.setattr(structured_output, "_unsupported_models", set())
+
+
+@pytest.mark.parametrize("status, body", [
+    (400, '{"error": {"message": "Unrecognized request argument supplied: response_format"}}'),
+    (422, '{"detail": [{"loc": ["body", "response_format"], "msg": "extra fields not permitted"}]}'),
+])
+def test_local_server_rejecting_response_format_falls_back_to_prompt_json(status, body):
+    send = RejectingSend(http_error(status, body))
+    result = generate_json("openai:llama3", "question", SCHEMA, send=send)
+    assert result.data == {"ok": True}
+    assert not structured_output.supports_structured_output("openai:llama3")
+
+
+def test_local_server_context_overflow_keeps_json_mode():
+    send = RejectingSend(http_error(400, '{"error": {"message": "This model\'s maximum context length is 8192 tokens"}}'))
+    with pytest.raises(requests.HTTPError):
+        generate_json("openai:llama3", "question", SCHEMA, send=send)
+    assert structured_output.supports_structured_output("openai:llama3")
+
+
+def test_gemini_error_body_mentioning_schema_falls_back():
+    send = RejectingSend(http_error(400, '{"error": {"message": "response_schema is not supported"}}'))
+    assert generate_json("gemini-1.0-pro", "question", SCHEMA, send=send).data == {"ok": True}
+
+
+def test_unrelated_gemini_400_is_raised():
+    send = RejectingSend(http_error(400, '{"error": {"message": "API key not valid"}}'))
+    with pytest.raises(requests.HTTPError):
+        generate_json("gemini-2.0-flash", "question", SCHEMA, send=send)